@@ -5,7 +5,53 @@ from datetime import datetime
 
 from flask import Flask, jsonify
 from flask_cors import CORS
-from models import db
+from models import db, ensure_schema
+
+
+def _prepare_database(app):
+    """
+    建表并执行启动回填
+
+    多个 worker 同时启动时由数据库命名锁串行化：第一个 worker 完成建表和回填，
+    其余 worker 等到锁后执行的回填都是幂等的空操作。每个回填单独捕获异常，
+    一个失败不影响其它回填。
+    """
+    from services.catalog import catalog_versions
+    from services.chat import backfill_conversations
+    from services.comments import backfill_comment_paths
+    from services.friends import backfill_friend_pairs
+    from services.locks import named_lock
+    from services.tags import backfill_tag_keys, backfill_tags
+
+    try:
+        with named_lock("startup", timeout=120) as acquired:
+            if not acquired:
+                app.logger.warning(
+                    "Timed out waiting for the startup lock, skipping backfills"
+                )
+                return
+            db.create_all()
+            ensure_schema()
+
+            backfills = [
+                ("catalog versions", catalog_versions.ensure_rows),
+                ("tags", backfill_tags),
+                ("tag keys", backfill_tag_keys),
+                ("comment paths", backfill_comment_paths),
+                ("chat conversations", backfill_conversations),
+                ("friend pairs", backfill_friend_pairs),
+            ]
+            for label, backfill in backfills:
+                try:
+                    backfill()
+                except Exception as e:
+                    db.session.rollback()
+                    app.logger.error(f"Startup backfill of {label} failed: {e}")
+    except Exception as e:
+        app.logger.error(
+            f"Failed to create tables with configured DB ({e}), "
+            "continuing without creating tables so server can start."
+        )
 
 
 def create_app():
@@ -35,6 +81,11 @@ def create_app():
         )
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
+    # 响应 JSON 编码：可用时使用 orjson，否则回退到标准库
+    from services.json_provider import FastJSONProvider
+
+    app.json = FastJSONProvider(app)
+
     db.init_app(app)
     CORS(app)
 
@@ -52,15 +103,23 @@ def create_app():
     # import models to ensure they are registered with SQLAlchemy
     import models  # noqa: F401
 
+    # 目录数据（分类、算法、标签）写入时递增版本号，使缓存和 ETag 失效
+    from services.catalog import catalog_versions
+
+    catalog_versions.watch(models.AlgorithmCategory, "categories")
+    catalog_versions.watch(models.Algorithm, "algorithms")
+    catalog_versions.watch(models.ConvertedAlgorithm, "algorithms")
+    catalog_versions.watch(models.Tag, "tags")
+    catalog_versions.install()
+
     # create tables (best-effort; do not crash server if DB is unreachable)
     with app.app_context():
-        try:
-            db.create_all()
-        except Exception as e:
-            app.logger.error(
-                f"Failed to create tables with configured DB ({e}), "
-                "continuing without creating tables so server can start."
-            )
+        _prepare_database(app)
+
+    # 响应缓存后端（local / sqlite / redis），多 worker 部署时共享缓存
+    from services.cache import create_backend_from_env, response_cache
+
+    response_cache.configure(create_backend_from_env())
 
     # register blueprints
     from routes.auth import auth_bp
@@ -69,6 +128,46 @@ def create_app():
     app.register_blueprint(auth_bp, url_prefix="/api/auth")
     app.register_blueprint(api_bp, url_prefix="/api")
 
+    # 浏览量写回缓冲：后台定期批量写回，进程退出时写回剩余增量
+    from services.view_counter import view_counter
+
+    view_counter.init_app(app)
+
+    # 算法点击：可选的进程内缓冲，后台批量 upsert
+    from services.clicks import click_buffer
+
+    click_buffer.init_app(app)
+
+    # 定期按明细表重算点赞/评论计数，修复计数漂移
+    from services.counters import counter_reconciler
+
+    counter_reconciler.init_app(app)
+
+    # 聊天消息推送：进程内发布/订阅，中继线程分发其它 worker 写入的消息
+    from services.chat_events import chat_broker
+
+    chat_broker.init_app(app)
+
+    # 好友关系的进程内缓存（聊天收发和轮询的好友检查）
+    from services.friends import friendship_cache
+
+    friendship_cache.init_app(app)
+
+    # 审计日志：请求中只追加到缓冲区，后台线程批量写入 system_logs
+    from services.audit_log import audit_logger
+
+    audit_logger.init_app(app)
+
+    # 定期按天汇总操作日志并删除超过保留期的明细
+    from services.log_maintenance import log_maintenance
+
+    log_maintenance.init_app(app)
+
+    # 按 Accept-Encoding 压缩较大的文本/JSON 响应
+    from services.compression import response_compressor
+
+    response_compressor.init_app(app)
+
     @app.route("/health")
     def health():
         return jsonify({"status": "ok", "time": datetime.utcnow().isoformat()})
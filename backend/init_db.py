@@ -6,6 +6,7 @@
 
 from app import create_app
 from models import db, AlgorithmCategory, Algorithm, User, Post, AlgorithmPost
+from services.tags import backfill_tags
 
 
 def init_categories():
@@ -1445,6 +1446,9 @@ def main():
         db.session.commit()
         print("示例帖子初始化完成")
 
+        # 将算法和帖子的标签写入标签字典
+        backfill_tags()
+
         print("数据库初始化完成！")
 
 
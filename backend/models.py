@@ -1,5 +1,7 @@
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.orm.attributes import set_committed_value
 from werkzeug.security import generate_password_hash, check_password_hash
 
 # SQLAlchemy实例将在app.py中初始化
@@ -38,6 +40,9 @@ class User(db.Model):
         "Favorite", back_populates="user", cascade="all, delete-orphan"
     )
 
+    # 游标分页索引 (排序列, id)
+    __table_args__ = (db.Index("ix_users_created_at_id", "created_at", "id"),)
+
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
 
@@ -217,6 +222,17 @@ class Post(db.Model):
     algorithms = db.relationship(
         "AlgorithmPost", back_populates="post", cascade="all, delete-orphan"
     )
+    tag_links = db.relationship(
+        "PostTag", back_populates="post", cascade="all, delete-orphan"
+    )
+
+    # 游标分页索引 (排序列, id)
+    __table_args__ = (
+        db.Index("ix_posts_created_at_id", "created_at", "id"),
+        db.Index("ix_posts_view_count_id", "view_count", "id"),
+        db.Index("ix_posts_like_count_id", "like_count", "id"),
+        db.Index("ix_posts_comment_count_id", "comment_count", "id"),
+    )
 
     def to_dict(self):
         return {
@@ -238,6 +254,16 @@ class Post(db.Model):
         }
 
 
+# 评论物化路径：每层一段，最多 MAX_COMMENT_DEPTH 层
+COMMENT_PATH_SEGMENT = 11
+MAX_COMMENT_DEPTH = 64
+COMMENT_PATH_LENGTH = COMMENT_PATH_SEGMENT * MAX_COMMENT_DEPTH
+
+
+def comment_path_segment(comment_id):
+    return f"{comment_id:010d}/"
+
+
 # 评论表
 class Comment(db.Model):
     __tablename__ = "comments"
@@ -247,6 +273,8 @@ class Comment(db.Model):
     post_id = db.Column(db.Integer, db.ForeignKey("posts.id"), nullable=False)
     author_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
     parent_id = db.Column(db.Integer, db.ForeignKey("comments.id"))  # 回复评论
+    # 物化路径：祖先到自身的 id 序列（每段 10 位补零 + "/"），插入后由事件维护
+    path = db.Column(db.String(COMMENT_PATH_LENGTH), index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(
         db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
@@ -257,6 +285,10 @@ class Comment(db.Model):
     author = db.relationship("User", back_populates="comments")
     parent = db.relationship("Comment", remote_side=[id], backref="replies")
 
+    __table_args__ = (
+        db.Index("ix_comments_post_id_created_at_id", "post_id", "created_at", "id"),
+    )
+
     def to_dict(self):
         return {
             "id": self.id,
@@ -270,6 +302,37 @@ class Comment(db.Model):
         }
 
 
+@event.listens_for(Comment, "after_insert")
+def _assign_comment_path(mapper, connection, target):
+    """
+    插入评论后在同一事务内写入物化路径
+
+    父评论已达最大深度时，新回复挂到父评论的父评论下（保持路径长度有界）。
+    """
+    table = Comment.__table__
+    parent_path = ""
+    parent_id = target.parent_id
+    if parent_id is not None:
+        parent_path = (
+            connection.execute(
+                db.select(table.c.path).where(table.c.id == parent_id)
+            ).scalar()
+            or ""
+        )
+        if len(parent_path) >= COMMENT_PATH_LENGTH:
+            parent_path = parent_path[:-COMMENT_PATH_SEGMENT]
+            parent_id = int(parent_path[-COMMENT_PATH_SEGMENT:-1])
+
+    path = parent_path + comment_path_segment(target.id)
+    connection.execute(
+        db.update(table)
+        .where(table.c.id == target.id)
+        .values(path=path, parent_id=parent_id)
+    )
+    set_committed_value(target, "path", path)
+    set_committed_value(target, "parent_id", parent_id)
+
+
 # 点赞表
 class Like(db.Model):
     __tablename__ = "likes"
@@ -316,6 +379,42 @@ class Favorite(db.Model):
     )
 
 
+# 抓取转换后的算法理论数据（由 converted_algorithms.json 等文件导入）
+class ConvertedAlgorithm(db.Model):
+    __tablename__ = "converted_algorithms"
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(200), nullable=False, unique=True)
+    chinese_name = db.Column(db.String(200), index=True)
+    repo = db.Column(db.String(200))
+    theory_rendered = db.Column(db.Text(length=16777215))  # 预先改写图片路径的理论
+    content_hash = db.Column(db.String(40))
+    source_rank = db.Column(db.Integer, default=0)  # 来源文件优先级，越大越优先
+    updated_at = db.Column(
+        db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
+    )
+
+
+# 目录数据版本号表（分类、算法、标签等写入时递增，用于缓存失效和 ETag）
+class CatalogVersion(db.Model):
+    __tablename__ = "catalog_versions"
+
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+# 转换数据来源文件的导入记录（用于按 mtime 热更新）
+class ConvertedSource(db.Model):
+    __tablename__ = "converted_sources"
+
+    id = db.Column(db.Integer, primary_key=True)
+    path = db.Column(db.String(500), nullable=False, unique=True)
+    # 纳秒整数（os.stat().st_mtime_ns）：MySQL FLOAT 为单精度，存浮点时间戳无法精确比较
+    mtime_ns = db.Column(db.BigInteger)
+    size = db.Column(db.BigInteger)
+    ingested_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
 # 算法-帖子关联表（多对多）
 class AlgorithmPost(db.Model):
     __tablename__ = "algorithm_posts"
@@ -335,6 +434,51 @@ class AlgorithmPost(db.Model):
     )
 
 
+# 标签字典表
+class Tag(db.Model):
+    __tablename__ = "tags"
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False, unique=True)
+    # 小写名称：标签按它查找和去重，与数据库排序规则是否区分大小写无关
+    name_key = db.Column(db.String(100))
+    post_count = db.Column(db.Integer, default=0)  # 使用该标签的帖子数（反规范化）
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # 关联
+    post_links = db.relationship(
+        "PostTag", back_populates="tag", cascade="all, delete-orphan"
+    )
+
+    __table_args__ = (db.Index("ux_tags_name_key", "name_key", unique=True),)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "post_count": self.post_count or 0,
+        }
+
+
+# 帖子-标签关联表（多对多）
+class PostTag(db.Model):
+    __tablename__ = "post_tags"
+
+    id = db.Column(db.Integer, primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey("posts.id"), nullable=False)
+    tag_id = db.Column(db.Integer, db.ForeignKey("tags.id"), nullable=False)
+
+    # 关联
+    post = db.relationship("Post", back_populates="tag_links")
+    tag = db.relationship("Tag", back_populates="post_links")
+
+    # 唯一约束；按标签查帖子走 (tag_id, post_id) 索引
+    __table_args__ = (
+        db.UniqueConstraint("post_id", "tag_id", name="unique_post_tag"),
+        db.Index("ix_post_tags_tag_id_post_id", "tag_id", "post_id"),
+    )
+
+
 # 好友关系表
 class Friend(db.Model):
     __tablename__ = "friends"
@@ -342,6 +486,9 @@ class Friend(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
     friend_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    # 规范化的用户对 (较小 id, 较大 id)，双向关系检查只需一次唯一索引查找
+    user_low_id = db.Column(db.Integer)
+    user_high_id = db.Column(db.Integer)
     status = db.Column(
         db.String(20), default="pending"
     )  # 'pending', 'accepted', 'blocked'
@@ -358,9 +505,12 @@ class Friend(db.Model):
         "User", foreign_keys=[friend_id], backref="received_friend_requests"
     )
 
-    # 唯一约束，确保每对用户只有一个好友关系
+    # 唯一约束，确保每对用户只有一个好友关系（不论由谁发起）
     __table_args__ = (
         db.UniqueConstraint("user_id", "friend_id", name="unique_friendship"),
+        db.Index("ux_friends_pair", "user_low_id", "user_high_id", unique=True),
+        # 按接收方查好友/请求（按发起方查询走 unique_friendship 的前缀）
+        db.Index("ix_friends_friend_id_status", "friend_id", "status"),
     )
 
     def to_dict(self):
@@ -379,6 +529,14 @@ class Friend(db.Model):
         }
 
 
+@event.listens_for(Friend, "before_insert")
+@event.listens_for(Friend, "before_update")
+def _assign_friend_pair(mapper, connection, target):
+    """写入前根据 user_id / friend_id 维护规范化用户对"""
+    target.user_low_id = min(target.user_id, target.friend_id)
+    target.user_high_id = max(target.user_id, target.friend_id)
+
+
 # 聊天消息表
 class ChatMessage(db.Model):
     __tablename__ = "chat_messages"
@@ -397,6 +555,12 @@ class ChatMessage(db.Model):
         "User", foreign_keys=[receiver_id], backref="received_messages"
     )
 
+    __table_args__ = (
+        db.Index(
+            "ix_chat_messages_pair_created_at", "sender_id", "receiver_id", "created_at"
+        ),
+    )
+
     def to_dict(self):
         return {
             "id": self.id,
@@ -413,6 +577,27 @@ class ChatMessage(db.Model):
         }
 
 
+# 会话摘要表：每对用户一行（user_low_id < user_high_id），随发送和已读标记在同一事务内更新
+class ChatConversation(db.Model):
+    __tablename__ = "chat_conversations"
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_low_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    user_high_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    last_message_id = db.Column(db.Integer)
+    last_sender_id = db.Column(db.Integer)
+    last_message_preview = db.Column(db.String(255))
+    last_message_at = db.Column(db.DateTime)
+    unread_low = db.Column(db.Integer, default=0)  # user_low_id 未读的消息数
+    unread_high = db.Column(db.Integer, default=0)  # user_high_id 未读的消息数
+
+    __table_args__ = (
+        db.UniqueConstraint("user_low_id", "user_high_id", name="unique_chat_pair"),
+        db.Index("ix_chat_conversations_low_last", "user_low_id", "last_message_at"),
+        db.Index("ix_chat_conversations_high_last", "user_high_id", "last_message_at"),
+    )
+
+
 # 系统日志表
 class SystemLog(db.Model):
     __tablename__ = "system_logs"
@@ -432,6 +617,9 @@ class SystemLog(db.Model):
     # 关联
     user = db.relationship("User")
 
+    # 游标分页索引 (排序列, id)
+    __table_args__ = (db.Index("ix_system_logs_created_at_id", "created_at", "id"),)
+
     def to_dict(self):
         return {
             "id": self.id,
@@ -444,3 +632,71 @@ class SystemLog(db.Model):
             "user_agent": self.user_agent,
             "created_at": self.created_at.isoformat() if self.created_at else None,
         }
+
+
+# 操作日志按天汇总表（按 action / resource_type 聚合，明细过期删除后仍可用于统计）
+class SystemLogDaily(db.Model):
+    __tablename__ = "system_log_daily"
+
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    action = db.Column(db.String(100), nullable=False)
+    # 没有资源类型的日志记为空字符串，使唯一约束生效
+    resource_type = db.Column(db.String(50), nullable=False, default="")
+    count = db.Column(db.Integer, nullable=False, default=0)
+    user_count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint(
+            "day", "action", "resource_type", name="unique_log_daily_bucket"
+        ),
+    )
+
+    def to_dict(self):
+        return {
+            "day": self.day.isoformat() if self.day else None,
+            "action": self.action,
+            "resource_type": self.resource_type or None,
+            "count": self.count,
+            "user_count": self.user_count,
+        }
+
+
+def ensure_schema():
+    """
+    为已存在的表补建缺失的列和索引
+
+    db.create_all() 只创建不存在的表，不会给旧表添加新定义的列和索引，
+    因此启动时逐个检查并补建（尽力而为，失败只记录日志）。新增列须可为空。
+    """
+    import logging
+
+    inspector = db.inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_columns = {col["name"] for col in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns or not column.nullable:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(
+                        db.text(
+                            f"ALTER TABLE {table.name} "
+                            f"ADD COLUMN {column.name} {column_type}"
+                        )
+                    )
+            except Exception as e:
+                logging.warning(f"Failed to add column {table.name}.{column.name}: {e}")
+
+        existing_indexes = {ix["name"] for ix in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing_indexes:
+                continue
+            try:
+                index.create(bind=db.engine)
+            except Exception as e:
+                logging.warning(f"Failed to create index {index.name}: {e}")
@@ -1,5 +1,12 @@
 import logging
-from flask import Blueprint, request, jsonify
+from flask import (
+    Blueprint,
+    Response,
+    current_app,
+    jsonify,
+    request,
+    stream_with_context,
+)
 from models import (
     db,
     User,
@@ -12,15 +19,31 @@ from models import (
     Favorite,
     AlgorithmPost,
     SystemLog,
+    SystemLogDaily,
     Friend,
     ChatMessage,
 )
-from routes.auth import token_required, log_action
+from routes.auth import (
+    admin_required,
+    get_user_role,
+    invalidate_user_role,
+    log_action,
+    token_required,
+)
+from services.pagination import (
+    MAX_PER_PAGE,
+    approximate_count,
+    iter_batches,
+    keyset_paginate,
+    keyset_response,
+    wants_keyset,
+)
 import os
+import time
 import json
-import re
 from datetime import datetime
 import base64
+import hashlib
 from io import BytesIO
 from PIL import Image
 import numpy as np
@@ -36,84 +59,62 @@ except Exception:
 
 # Import vector service
 from services.vector_service import vector_service
-
-# Try to load converted scraped algorithm data
-# (contains full theory and image references)
-_CONVERTED_ALG_MAP = None
-
-
-def _load_converted_map():
-    global _CONVERTED_ALG_MAP
-    if _CONVERTED_ALG_MAP is not None:
-        return _CONVERTED_ALG_MAP
-
-    data = {}
-    candidates = [
-        os.path.join(os.getcwd(), "scraped_data", "converted_algorithms.json"),
-        os.path.join(os.getcwd(), "scraped_data", "missing_algorithms_converted.json"),
-        os.path.join(os.getcwd(), "converted_algorithms.json"),
-    ]
-    for path in candidates:
-        if os.path.exists(path):
-            try:
-                with open(path, "r", encoding="utf-8") as f:
-                    items = json.load(f)
-                    for it in items:
-                        name = it.get("name")
-                        if name:
-                            data[name] = it
-            except Exception:
-                continue
-
-    _CONVERTED_ALG_MAP = data
-    return _CONVERTED_ALG_MAP
-
-
-def _rewrite_image_paths(markdown_text, repo=None):
-    """Rewrite relative image paths.
-    If repo is provided, map relative paths (plot/, _images/) to local
-    /ml_images/<repo>/... Otherwise, rewrite to raw GitHub URLs (legacy behavior).
-    """
-    if not markdown_text:
-        return markdown_text
-
-    if repo:
-        text = markdown_text
-        text = text.replace("](" + "plot/", "](/ml_images/" + repo + "/plot/")
-        text = text.replace("(plot/", "(/ml_images/" + repo + "/plot/")
-        text = text.replace("](" + "../" + "plot/", "](/ml_images/" + repo + "/plot/")
-        text = text.replace("](" + "_images/", "](/ml_images/" + repo + "/_images/")
-        text = text.replace("../_images/", "/ml_images/" + repo + "/_images/")
-        text = text.replace("(_images/", "(/ml_images/" + repo + "/_images/")
-        # src="plot/...
-        text = text.replace('src="plot/', 'src="/ml_images/' + repo + "/plot/")
-        return text
-
-    # Fallback: rewrite to the original repo's raw GitHub path
-    base_raw = (
-        "https://raw.githubusercontent.com/gavinkhung/machine-learning-visualized/"
-        "main/book/"
-    )
-    # replace markdown image paths: ![alt](plot/...)
-    markdown_text = re.sub(
-        r"!\[([^\]]*)\]\((?:\.\./)*(plot/[^)]+)\)",
-        r"![\\1](" + base_raw + r"\\2)",
-        markdown_text,
-    )
-    # replace HTML img src attributes: src="plot/..."
-    markdown_text = re.sub(
-        r"(src=[\"\\\'])(?:\.\./)*(plot/[^\"\\\']+)([\"\\\'])",
-        r"\\1" + base_raw + r"\\2\\3",
-        markdown_text,
-    )
-    return markdown_text
-
+from services.view_counter import view_counter
+from services.clicks import click_buffer, record_click
+from services.counters import adjust_post_counter, insert_ignore
+from services.cache import cached_view, invalidate_user_cache, user_cache_version
+from services.catalog import (
+    cached_catalog,
+    catalog_cache,
+    conditional_catalog,
+    json_body_response,
+)
+from services.theory import get_algorithm_theory
+from services.friends import (
+    are_friends,
+    friend_ids,
+    friend_links,
+    get_friendship,
+    invalidate_friendship,
+    pair_condition,
+    pending_requests,
+    request_row_to_reuse,
+    search_users_by_prefix,
+    serialize_request,
+)
+from services.users import decode_avatar, load_user_cards
+from services.json_provider import iter_json, iter_json_items
+from services.chat import (
+    DEFAULT_MESSAGE_PAGE,
+    conversation_condition,
+    fetch_messages,
+    list_conversations,
+    mark_read,
+    record_message,
+)
+from services.chat_events import chat_broker, messages_since, serialize_message
+from services.comments import (
+    DEFAULT_REPLY_DEPTH,
+    delete_subtree,
+    get_comment_replies,
+    get_comment_threads,
+)
+from services.tags import (
+    get_all_tags,
+    posts_with_any_tag,
+    posts_with_tag,
+    register_tags,
+    sync_post_tags,
+    tag_counts_epoch,
+)
 
 api_bp = Blueprint("api", __name__)
 
 
 # 算法相关API
 @api_bp.route("/algorithms", methods=["GET"])
+@conditional_catalog("algorithms", "categories")
+@cached_catalog("algorithms", "categories")
 def get_algorithms():
     try:
         category_id = request.args.get("category_id", type=int)
@@ -159,33 +160,16 @@ def get_algorithms():
 
 
 @api_bp.route("/algorithms/<int:algorithm_id>", methods=["GET"])
+@conditional_catalog("algorithms", "categories")
+@cached_catalog("algorithms", "categories")
 def get_algorithm(algorithm_id):
     try:
         algorithm = Algorithm.query.get_or_404(algorithm_id)
         alg_dict = algorithm.to_dict()
 
-        # Attempt to attach full theory from converted scraped data (if available)
+        # Attach full theory (pre-rendered at ingest / first access, cached)
         try:
-            converted_map = _load_converted_map()
-            conv = converted_map.get(algorithm.name) or converted_map.get(
-                algorithm.chinese_name or ""
-            )
-            theory_text = None
-            if conv:
-                # theory might be under 'theory' (list) or 'theory' string
-                if isinstance(conv.get("theory"), list):
-                    theory_text = "\n\n".join(conv.get("theory"))
-                else:
-                    theory_text = conv.get("theory") or conv.get("description")
-            # Fallback: if algorithm model has attribute 'theory', use it
-            if not theory_text and hasattr(algorithm, "theory"):
-                theory_text = getattr(algorithm, "theory", None)
-
-            if theory_text:
-                repo_name = conv.get("repo") if conv else None
-                alg_dict["theory"] = _rewrite_image_paths(theory_text, repo=repo_name)
-            else:
-                alg_dict["theory"] = None
+            alg_dict["theory"] = get_algorithm_theory(algorithm)
         except Exception as e:
             logging.warning(f"Failed to attach converted theory: {e}")
             alg_dict["theory"] = None
@@ -197,56 +181,60 @@ def get_algorithm(algorithm_id):
 
 
 @api_bp.route("/categories", methods=["GET"])
+@conditional_catalog("categories")
 def get_categories():
     try:
-        categories = AlgorithmCategory.query.order_by(AlgorithmCategory.order).all()
-
-        # 构建树形结构
-        def build_tree(parent_id=None):
-            result = []
-            for cat in categories:
-                if cat.parent_id == parent_id:
-                    cat_dict = cat.to_dict()
-                    cat_dict["children"] = build_tree(cat.id)
-                    result.append(cat_dict)
-            return result
-
-        tree = build_tree()
-        return jsonify({"categories": tree}), 200
+        entry = catalog_cache.get_or_build(
+            "categories", "categories", build_category_tree
+        )
+        return json_body_response(entry)
 
     except Exception as e:
         logging.error(f"Get categories error: {e}")
         return jsonify({"message": "Failed to get categories"}), 500
 
 
+def build_category_tree():
+    """单次查询、单次遍历构建分类树"""
+    categories = AlgorithmCategory.query.order_by(AlgorithmCategory.order).all()
+
+    nodes = {}
+    for cat in categories:
+        nodes[cat.id] = {
+            "id": cat.id,
+            "name": cat.name,
+            "description": cat.description,
+            "parent_id": cat.parent_id,
+            "level": cat.level,
+            "order": cat.order,
+            "children": [],
+        }
+
+    tree = []
+    for cat in categories:
+        parent = nodes.get(cat.parent_id) if cat.parent_id is not None else None
+        if parent is not None:
+            parent["children"].append(nodes[cat.id])
+        elif cat.parent_id is None:
+            tree.append(nodes[cat.id])
+    return {"categories": tree}
+
+
 # 用户算法点击记录API
 @api_bp.route("/user/algorithm/<int:algorithm_id>/click", methods=["POST"])
 @token_required
 def record_algorithm_click(current_user_id, algorithm_id):
     """记录用户点击算法的行为"""
     try:
-        # 检查算法是否存在（仅用于验证存在性）
-        Algorithm.query.get_or_404(algorithm_id)
-
-        # 查找或创建用户知识记录
-        knowledge = UserKnowledge.query.filter_by(
-            user_id=current_user_id, algorithm_id=algorithm_id
-        ).first()
-
-        if knowledge:
-            # 更新最后访问时间
-            knowledge.last_accessed = db.func.now()
+        if click_buffer.enabled:
+            # 缓冲模式：不访问数据库，由后台批量写回（不存在的算法在写回时被忽略）
+            click_buffer.add(current_user_id, algorithm_id)
         else:
-            # 创建新的点击记录（不设置进度）
-            knowledge = UserKnowledge(
-                user_id=current_user_id,
-                algorithm_id=algorithm_id,
-                progress=0.0,  # 点击记录不设置进度
-                last_accessed=db.func.now(),
-            )
-            db.session.add(knowledge)
-
-        db.session.commit()
+            # 一条 upsert 完成存在性校验与插入/更新最后访问时间
+            if not record_click(current_user_id, algorithm_id):
+                return jsonify({"message": "Algorithm not found"}), 404
+            db.session.commit()
+            invalidate_user_cache(current_user_id)
 
         log_action(current_user_id, "click_algorithm", "algorithm", algorithm_id)
 
@@ -285,6 +273,7 @@ def update_user_knowledge(current_user_id, algorithm_id):
             db.session.add(knowledge)
 
         db.session.commit()
+        invalidate_user_cache(current_user_id)
 
         log_action(
             current_user_id,
@@ -324,6 +313,12 @@ def get_user_knowledge(current_user_id):
 # 推荐算法API - 基于向量相似度的现代化推荐系统
 @api_bp.route("/recommendations", methods=["GET"])
 @token_required
+@cached_view(
+    "recommendations",
+    ttl=120,
+    vary=lambda current_user_id: current_user_id,
+    version=user_cache_version,
+)
 def get_recommendations(current_user_id):
     """
     基于向量相似度的现代化推荐算法
@@ -767,6 +762,9 @@ def get_posts():
         sort_order = request.args.get("sort_order", "desc")  # 新增排序顺序
 
         query = Post.query
+        query_unfiltered = not any(
+            [filter_param not in ("", "all"), search, algorithm_id, tag]
+        ) and not request.args.get("author_id", type=int)
 
         # 处理filter参数
         if filter_param == "featured":
@@ -799,13 +797,8 @@ def get_posts():
             query = query.filter_by(author_id=author_id)
 
         if tag:
-            # 筛选包含指定标签的帖子
-            # 对于SQLite，tags存储为Unicode转义的JSON字符串
-            import json
-
-            # 将标签转换为JSON字符串中的Unicode转义形式进行匹配
-            json_tag = json.dumps(tag, ensure_ascii=True).strip('"')
-            query = query.filter(Post.tags.like(f"%{json_tag}%"))
+            # 筛选包含指定标签的帖子（通过 post_tags 索引查找）
+            query = query.filter(posts_with_tag(tag))
 
         # 排序逻辑
         if sort_by == "created_at":
@@ -819,6 +812,36 @@ def get_posts():
         else:
             order_column = Post.created_at
 
+        if wants_keyset(request.args):
+            # 游标分页：按 (排序列, id) 定位，不执行 OFFSET 和 COUNT(*)
+            try:
+                result = keyset_paginate(
+                    query,
+                    order_column,
+                    Post.id,
+                    cursor=request.args.get("cursor"),
+                    per_page=per_page,
+                    descending=sort_order != "asc",
+                )
+            except ValueError:
+                return jsonify({"message": "Invalid cursor"}), 400
+
+            total = None
+            if request.args.get("include_total") == "approx" and query_unfiltered:
+                total = approximate_count(Post)
+
+            return (
+                jsonify(
+                    keyset_response(
+                        "posts",
+                        result,
+                        [post.to_dict() for post in result["items"]],
+                        total,
+                    )
+                ),
+                200,
+            )
+
         if sort_order == "asc":
             query = query.order_by(order_column.asc())
         else:
@@ -844,24 +867,12 @@ def get_posts():
 
 
 @api_bp.route("/posts/tags", methods=["GET"])
+@conditional_catalog("tags", extra=tag_counts_epoch)
 def get_post_tags():
     """获取所有帖子标签"""
     try:
-        # 从数据库中收集所有唯一的标签
-        posts = Post.query.all()
-        all_tags = set()
-
-        for post in posts:
-            if post.tags:
-                all_tags.update(post.tags)
-
-        # 也可以从算法标签中获取一些常用标签
-        algorithms = Algorithm.query.all()
-        for alg in algorithms:
-            if alg.tags:
-                all_tags.update(alg.tags)
-
-        return jsonify({"tags": sorted(list(all_tags))}), 200
+        # 标签字典包含帖子标签和算法标签，结果带缓存
+        return json_body_response(get_all_tags())
 
     except Exception as e:
         logging.error(f"Get post tags error: {e}")
@@ -893,12 +904,16 @@ def create_post(current_user_id=None):
         db.session.add(post)
         db.session.flush()  # 获取post.id
 
+        # 同步标签字典和帖子-标签关联
+        sync_post_tags(post.id, tags)
+
         # 关联算法
         for alg_id in algorithm_ids:
             alg_post = AlgorithmPost(algorithm_id=alg_id, post_id=post.id)
             db.session.add(alg_post)
 
         db.session.commit()
+        invalidate_user_cache(current_user_id)
 
         # 异步向量化新帖子（不阻塞API响应）
         try:
@@ -941,11 +956,14 @@ def get_post(post_id):
     try:
         post = Post.query.get_or_404(post_id)
 
-        # 增加浏览量
-        post.view_count += 1
-        db.session.commit()
+        # 增加浏览量：先写入进程内缓冲，由后台线程批量写回数据库
+        view_counter.increment(post_id)
 
-        return jsonify({"post": post.to_dict()}), 200
+        post_dict = post.to_dict()
+        post_dict["view_count"] = (post.view_count or 0) + view_counter.pending(
+            post_id
+        )
+        return jsonify({"post": post_dict}), 200
 
     except Exception as e:
         logging.error(f"Get post error: {e}")
@@ -956,23 +974,37 @@ def get_post(post_id):
 @token_required
 def like_post(current_user_id, post_id):
     try:
-        post = Post.query.get_or_404(post_id)
-
-        like = Like.query.filter_by(user_id=current_user_id, post_id=post_id).first()
+        # 先尝试删除：删到了说明之前已点赞，本次为取消点赞
+        removed = Like.query.filter_by(
+            user_id=current_user_id, post_id=post_id
+        ).delete(synchronize_session=False)
 
-        if like:
+        if removed:
             # 取消点赞
-            db.session.delete(like)
-            post.like_count -= 1
+            post_exists = adjust_post_counter(post_id, Post.like_count, -1)
             action = "unlike_post"
         else:
-            # 点赞
-            like = Like(user_id=current_user_id, post_id=post_id)
-            db.session.add(like)
-            post.like_count += 1
+            # 点赞（依赖唯一约束幂等插入，并发重复点赞不会重复计数）
+            inserted = insert_ignore(
+                Like,
+                user_id=current_user_id,
+                post_id=post_id,
+                created_at=datetime.utcnow(),
+            )
+            post_exists = (
+                adjust_post_counter(post_id, Post.like_count, 1)
+                if inserted
+                else db.session.query(Post.id).filter_by(id=post_id).first()
+                is not None
+            )
             action = "like_post"
 
+        if not post_exists:
+            db.session.rollback()
+            return jsonify({"message": "Post not found"}), 404
+
         db.session.commit()
+        invalidate_user_cache(current_user_id)
 
         log_action(current_user_id, action, "post", post_id)
 
@@ -986,16 +1018,15 @@ def like_post(current_user_id, post_id):
 
 # 管理员API
 @api_bp.route("/admin/posts/<int:post_id>", methods=["DELETE"])
-@token_required
+@admin_required
 def delete_post(current_user_id, post_id):
     try:
-        user = User.query.get(current_user_id)
-        if user.role != "admin":
-            return jsonify({"message": "Admin access required"}), 403
-
         post = Post.query.get_or_404(post_id)
+        author_id = post.author_id
+        sync_post_tags(post_id, [])
         db.session.delete(post)
         db.session.commit()
+        invalidate_user_cache(author_id)
 
         log_action(current_user_id, "delete_post", "post", post_id)
 
@@ -1008,26 +1039,52 @@ def delete_post(current_user_id, post_id):
 
 
 @api_bp.route("/admin/logs", methods=["GET"])
-@token_required
+@admin_required
 def get_system_logs(current_user_id):
     try:
-        user = User.query.get(current_user_id)
-        if user.role != "admin":
-            return jsonify({"message": "Admin access required"}), 403
-
         page = request.args.get("page", 1, type=int)
         per_page = request.args.get("per_page", 50, type=int)
 
-        logs = SystemLog.query.order_by(SystemLog.created_at.desc()).paginate(
-            page=page, per_page=per_page, error_out=False
-        )
+        if wants_keyset(request.args):
+            try:
+                result = keyset_paginate(
+                    SystemLog.query,
+                    SystemLog.created_at,
+                    SystemLog.id,
+                    cursor=request.args.get("cursor"),
+                    per_page=per_page,
+                )
+            except ValueError:
+                return jsonify({"message": "Invalid cursor"}), 400
+
+            total = None
+            if request.args.get("include_total") == "approx":
+                total = approximate_count(SystemLog)
+
+            return (
+                jsonify(
+                    keyset_response(
+                        "logs",
+                        result,
+                        [log.to_dict() for log in result["items"]],
+                        total,
+                    )
+                ),
+                200,
+            )
+
+        # 旧客户端的页码分页：总数使用近似值，不对日志表执行 COUNT(*)
+        logs = SystemLog.query.order_by(
+            SystemLog.created_at.desc(), SystemLog.id.desc()
+        ).paginate(page=page, per_page=per_page, error_out=False, count=False)
+        total = approximate_count(SystemLog) or 0
 
         return (
             jsonify(
                 {
                     "logs": [log.to_dict() for log in logs.items],
-                    "total": logs.total,
-                    "pages": logs.pages,
+                    "total": total,
+                    "pages": -(-total // logs.per_page) if total else 0,
                     "current_page": logs.page,
                 }
             ),
@@ -1074,10 +1131,12 @@ def delete_own_post(current_user_id, post_id):
         Favorite.query.filter_by(post_id=post_id).delete()
         Comment.query.filter_by(post_id=post_id).delete()
         AlgorithmPost.query.filter_by(post_id=post_id).delete()
+        sync_post_tags(post_id, [])
 
         # 删除帖子
         db.session.delete(post)
         db.session.commit()
+        invalidate_user_cache(current_user_id)
 
         log_action(current_user_id, "delete_post", "post", post_id)
 
@@ -1111,6 +1170,7 @@ def favorite_post(current_user_id, post_id):
             action = "favorite_post"
 
         db.session.commit()
+        invalidate_user_cache(current_user_id)
 
         log_action(current_user_id, action, "post", post_id)
 
@@ -1126,30 +1186,35 @@ def favorite_post(current_user_id, post_id):
 @api_bp.route("/posts/<int:post_id>/comments", methods=["GET"])
 def get_comments(post_id):
     try:
-        comments = (
-            Comment.query.filter_by(post_id=post_id).order_by(Comment.created_at).all()
-        )
+        per_page = request.args.get("per_page", type=int)
+        cursor = request.args.get("cursor")
+        depth = request.args.get("depth", DEFAULT_REPLY_DEPTH, type=int)
 
-        # 构建评论树结构
-        def build_comment_tree(comments_list, parent_id=None):
-            result = []
-            for comment in comments_list:
-                if comment.parent_id == parent_id:
-                    comment_dict = comment.to_dict()
-                    comment_dict["replies"] = build_comment_tree(
-                        comments_list, comment.id
-                    )
-                    result.append(comment_dict)
-            return result
+        try:
+            result = get_comment_threads(post_id, cursor, per_page, depth)
+        except ValueError:
+            return jsonify({"message": "Invalid cursor"}), 400
 
-        comment_tree = build_comment_tree(comments)
-        return jsonify({"comments": comment_tree}), 200
+        return jsonify(result), 200
 
     except Exception as e:
         logging.error(f"Get comments error: {e}")
         return jsonify({"message": "Failed to get comments"}), 500
 
 
+@api_bp.route("/comments/<int:comment_id>/replies", methods=["GET"])
+def get_comment_reply_chain(comment_id):
+    """按需展开深层回复链"""
+    try:
+        comment = Comment.query.get_or_404(comment_id)
+        depth = request.args.get("depth", DEFAULT_REPLY_DEPTH, type=int)
+        return jsonify({"replies": get_comment_replies(comment, depth)}), 200
+
+    except Exception as e:
+        logging.error(f"Get comment replies error: {e}")
+        return jsonify({"message": "Comment not found"}), 404
+
+
 @api_bp.route("/posts/<int:post_id>/comments", methods=["POST"])
 @token_required
 def create_comment(current_user_id, post_id):
@@ -1168,12 +1233,14 @@ def create_comment(current_user_id, post_id):
             parent_id=parent_id,
         )
         db.session.add(comment)
-        db.session.commit()
 
-        # 更新帖子评论数
-        post = Post.query.get(post_id)
-        post.comment_count += 1
+        # 在同一事务中原子地更新帖子评论数
+        if not adjust_post_counter(post_id, Post.comment_count, 1):
+            db.session.rollback()
+            return jsonify({"message": "Post not found"}), 404
+
         db.session.commit()
+        invalidate_user_cache(current_user_id)
 
         log_action(current_user_id, "create_comment", "post", post_id)
 
@@ -1198,31 +1265,18 @@ def create_comment(current_user_id, post_id):
 def delete_comment(current_user_id, comment_id):
     try:
         comment = Comment.query.get_or_404(comment_id)
-        user = User.query.get(current_user_id)
 
         # 检查权限：只能删除自己的评论或管理员可以删除任何评论
-        if comment.author_id != current_user_id and user.role != "admin":
+        if (
+            comment.author_id != current_user_id
+            and get_user_role(current_user_id) != "admin"
+        ):
             return jsonify({"message": "Permission denied"}), 403
 
-        # 获取所有子评论
-        def get_all_replies(comment_id):
-            replies = Comment.query.filter_by(parent_id=comment_id).all()
-            all_replies = []
-            for reply in replies:
-                all_replies.append(reply)
-                all_replies.extend(get_all_replies(reply.id))
-            return all_replies
-
-        all_comments_to_delete = [comment] + get_all_replies(comment_id)
-
-        # 删除所有相关评论
-        for c in all_comments_to_delete:
-            db.session.delete(c)
-
-        # 更新帖子评论数
-        post = Post.query.get(comment.post_id)
-        post.comment_count -= len(all_comments_to_delete)
+        # 按物化路径一次删除评论及其全部回复，并原子扣减帖子评论数
+        result = delete_subtree(comment)
         db.session.commit()
+        invalidate_user_cache(*result["author_ids"])
 
         log_action(current_user_id, "delete_comment", "comment", comment_id)
 
@@ -1249,13 +1303,9 @@ def get_user_likes(current_user_id):
 
 # 管理员专用API
 @api_bp.route("/admin/stats", methods=["GET"])
-@token_required
+@admin_required
 def get_admin_stats(current_user_id):
     try:
-        user = User.query.get(current_user_id)
-        if user.role != "admin":
-            return jsonify({"message": "Admin access required"}), 403
-
         stats = {
             "totalUsers": User.query.count(),
             "totalPosts": Post.query.count(),
@@ -1272,47 +1322,66 @@ def get_admin_stats(current_user_id):
 
 # 数据分析API
 @api_bp.route("/admin/analytics/user-activity", methods=["GET"])
-@token_required
+@admin_required
+@cached_view("user_activity", ttl=60)
 def get_user_activity_rankings(current_user_id):
     try:
-        user = User.query.get(current_user_id)
-        if user.role != "admin":
-            return jsonify({"message": "Admin access required"}), 403
-
-        # 计算用户活跃度得分
-        users_data = []
-        users = User.query.all()
-
-        for user in users:
-            posts_count = Post.query.filter_by(author_id=user.id).count()
-            comments_count = Comment.query.filter_by(author_id=user.id).count()
-
-            # 计算获赞数（用户所有帖子的点赞总数）
-            likes_received = (
-                db.session.query(db.func.coalesce(db.func.sum(Post.like_count), 0))
-                .filter_by(author_id=user.id)
-                .scalar()
+        # 按作者分组统计帖子数、获赞数（用户所有帖子的点赞总数）与评论数
+        post_stats = (
+            db.session.query(
+                Post.author_id.label("user_id"),
+                db.func.count(Post.id).label("posts_count"),
+                db.func.coalesce(db.func.sum(Post.like_count), 0).label("likes"),
             )
-
-            # 活跃度得分 = 帖子数 * 3 + 评论数 * 1 + 获赞数 * 0.5
-            activity_score = (
-                posts_count * 3 + comments_count * 1 + float(likes_received) * 0.5
+            .group_by(Post.author_id)
+            .subquery()
+        )
+        comment_stats = (
+            db.session.query(
+                Comment.author_id.label("user_id"),
+                db.func.count(Comment.id).label("comments_count"),
             )
-
-            users_data.append(
-                {
-                    "id": user.id,
-                    "username": user.username,
-                    "posts_count": posts_count,
-                    "comments_count": comments_count,
-                    "likes_received": likes_received,
-                    "activity_score": round(activity_score, 2),
-                }
+            .group_by(Comment.author_id)
+            .subquery()
+        )
+        posts_count = db.func.coalesce(post_stats.c.posts_count, 0)
+        comments_count = db.func.coalesce(comment_stats.c.comments_count, 0)
+        likes_received = db.func.coalesce(post_stats.c.likes, 0)
+
+        # 活跃度得分 = 帖子数 * 3 + 评论数 * 1 + 获赞数 * 0.5
+        # 数据库中按其两倍（整数）排序，与得分顺序一致且不受浮点误差影响；
+        # 同分按用户 id 排序
+        doubled_score = posts_count * 6 + comments_count * 2 + likes_received
+        rows = (
+            db.session.query(
+                User.id,
+                User.username,
+                posts_count.label("posts_count"),
+                comments_count.label("comments_count"),
+                likes_received.label("likes_received"),
             )
+            .outerjoin(post_stats, post_stats.c.user_id == User.id)
+            .outerjoin(comment_stats, comment_stats.c.user_id == User.id)
+            .order_by(doubled_score.desc(), User.id)
+            .limit(20)
+            .all()
+        )
 
-        # 按活跃度得分降序排序
-        rankings = sorted(users_data, key=lambda x: x["activity_score"], reverse=True)[
-            :20
+        rankings = [
+            {
+                "id": row.id,
+                "username": row.username,
+                "posts_count": row.posts_count,
+                "comments_count": row.comments_count,
+                "likes_received": int(row.likes_received),
+                "activity_score": round(
+                    row.posts_count * 3
+                    + row.comments_count * 1
+                    + float(row.likes_received) * 0.5,
+                    2,
+                ),
+            }
+            for row in rows
         ]
 
         return jsonify({"rankings": rankings}), 200
@@ -1323,13 +1392,9 @@ def get_user_activity_rankings(current_user_id):
 
 
 @api_bp.route("/admin/analytics/post-popularity", methods=["GET"])
-@token_required
+@admin_required
 def get_post_popularity_rankings(current_user_id):
     try:
-        user = User.query.get(current_user_id)
-        if user.role != "admin":
-            return jsonify({"message": "Admin access required"}), 403
-
         # 计算帖子热度得分
         posts_data = []
         posts = Post.query.all()
@@ -1371,13 +1436,9 @@ def get_post_popularity_rankings(current_user_id):
 
 
 @api_bp.route("/admin/analytics/system-stats", methods=["GET"])
-@token_required
+@admin_required
 def get_system_stats(current_user_id):
     try:
-        user = User.query.get(current_user_id)
-        if user.role != "admin":
-            return jsonify({"message": "Admin access required"}), 403
-
         # 计算系统统计信息
         from datetime import datetime, timedelta
 
@@ -1412,15 +1473,46 @@ def get_system_stats(current_user_id):
         return jsonify({"message": "Failed to get stats"}), 500
 
 
+@api_bp.route("/admin/analytics/actions", methods=["GET"])
+@admin_required
+def get_action_stats(current_user_id):
+    """按天汇总的操作统计（读取 system_log_daily，不扫描日志明细）"""
+    try:
+        from datetime import datetime, timedelta
+
+        days = max(1, min(request.args.get("days", 30, type=int), 366))
+        since = datetime.utcnow().date() - timedelta(days=days - 1)
+        query = SystemLogDaily.query.filter(SystemLogDaily.day >= since)
+        action = request.args.get("action")
+        if action:
+            query = query.filter(SystemLogDaily.action == action)
+        rows = query.order_by(SystemLogDaily.day, SystemLogDaily.action).all()
+
+        totals = {}
+        for row in rows:
+            totals[row.action] = totals.get(row.action, 0) + row.count
+
+        return (
+            jsonify(
+                {
+                    "since": since.isoformat(),
+                    "daily": [row.to_dict() for row in rows],
+                    "totals": totals,
+                }
+            ),
+            200,
+        )
+
+    except Exception as e:
+        logging.error(f"Get action stats error: {e}")
+        return jsonify({"message": "Failed to get action stats"}), 500
+
+
 # 数据库管理API
 @api_bp.route("/admin/database/cleanup-users", methods=["POST"])
-@token_required
+@admin_required
 def cleanup_inactive_users(current_user_id):
     try:
-        user = User.query.get(current_user_id)
-        if user.role != "admin":
-            return jsonify({"message": "Admin access required"}), 403
-
         from datetime import datetime, timedelta
 
         # 定义非活跃用户：90天内没有登录且没有发帖
@@ -1465,56 +1557,75 @@ def cleanup_inactive_users(current_user_id):
         return jsonify({"message": "Failed to cleanup users"}), 500
 
 
-@api_bp.route("/admin/database/export-users", methods=["GET"])
-@token_required
-def export_users_data(current_user_id):
-    try:
-        user = User.query.get(current_user_id)
-        if user.role != "admin":
-            return jsonify({"message": "Admin access required"}), 403
+EXPORT_BATCH_SIZE = 500
 
-        users = User.query.all()
-        export_data = []
 
-        for user in users:
-            user_data = user.to_dict()
-            # 添加额外统计信息
-            user_data["stats"] = {
-                "posts_count": Post.query.filter_by(author_id=user.id).count(),
-                "comments_count": Comment.query.filter_by(author_id=user.id).count(),
-                "likes_received": db.session.query(db.func.sum(Post.like_count))
-                .filter_by(author_id=user.id)
-                .scalar()
-                or 0,
-                "favorites_count": Favorite.query.filter_by(user_id=user.id).count(),
-            }
-            export_data.append(user_data)
+def stream_json_export(export_data, filename):
+    """以流式 JSON 附件返回导出数据，逐批查询、逐块输出"""
+
+    def dumps(value):
+        return json.dumps(value, ensure_ascii=False, default=str)
 
-        import json
+    def generate():
+        try:
+            yield from iter_json(export_data, dumps)
+        except Exception as e:
+            logging.error(f"Streaming export {filename} failed: {e}")
+            raise
 
-        json_data = json.dumps(export_data, ensure_ascii=False, indent=2, default=str)
+    return Response(
+        stream_with_context(generate()),
+        mimetype="application/json",
+        headers={"Content-Disposition": f"attachment;filename={filename}"},
+    )
 
-        from flask import Response
 
-        return Response(
-            json_data,
-            mimetype="application/json",
-            headers={"Content-Disposition": "attachment;filename=users_export.json"},
+@api_bp.route("/admin/database/export-users", methods=["GET"])
+@admin_required
+def export_users_data(current_user_id):
+    try:
+        # 各项统计用分组聚合一次查出，避免逐个用户查询
+        post_stats = {
+            author_id: (count, likes or 0)
+            for author_id, count, likes in db.session.query(
+                Post.author_id, db.func.count(Post.id), db.func.sum(Post.like_count)
+            ).group_by(Post.author_id)
+        }
+        comment_counts = dict(
+            db.session.query(Comment.author_id, db.func.count(Comment.id)).group_by(
+                Comment.author_id
+            )
+        )
+        favorite_counts = dict(
+            db.session.query(Favorite.user_id, db.func.count(Favorite.id)).group_by(
+                Favorite.user_id
+            )
         )
 
+        def export_rows():
+            for user in iter_batches(User.query, User.id, EXPORT_BATCH_SIZE):
+                user_data = user.to_dict()
+                posts_count, likes_received = post_stats.get(user.id, (0, 0))
+                # 添加额外统计信息
+                user_data["stats"] = {
+                    "posts_count": posts_count,
+                    "comments_count": comment_counts.get(user.id, 0),
+                    "likes_received": likes_received,
+                    "favorites_count": favorite_counts.get(user.id, 0),
+                }
+                yield user_data
+
+        return stream_json_export(export_rows(), "users_export.json")
+
     except Exception as e:
         logging.error(f"Export users data error: {e}")
         return jsonify({"message": "Failed to export data"}), 500
 
 
 @api_bp.route("/admin/database/cleanup-posts", methods=["POST"])
-@token_required
+@admin_required
 def cleanup_old_posts(current_user_id):
     try:
-        user = User.query.get(current_user_id)
-        if user.role != "admin":
-            return jsonify({"message": "Admin access required"}), 403
-
         from datetime import datetime, timedelta
 
         # 清理1年前的帖子（且浏览量少于5，点赞少于2）
@@ -1536,6 +1647,7 @@ def cleanup_old_posts(current_user_id):
                 post.id,
                 {"title": post.title, "reason": "old_inactive_post"},
             )
+            sync_post_tags(post.id, [])
             db.session.delete(post)
             deleted_count += 1
 
@@ -1558,31 +1670,23 @@ def cleanup_old_posts(current_user_id):
 
 
 @api_bp.route("/admin/database/export-content", methods=["GET"])
-@token_required
+@admin_required
 def export_content_data(current_user_id):
     try:
-        user = User.query.get(current_user_id)
-        if user.role != "admin":
-            return jsonify({"message": "Admin access required"}), 403
-
-        posts = Post.query.all()
         export_data = {
-            "posts": [post.to_dict() for post in posts],
-            "comments": [comment.to_dict() for comment in Comment.query.all()],
+            "posts": iter_json_items(
+                post.to_dict()
+                for post in iter_batches(Post.query, Post.id, EXPORT_BATCH_SIZE)
+            ),
+            "comments": iter_json_items(
+                comment.to_dict()
+                for comment in iter_batches(
+                    Comment.query, Comment.id, EXPORT_BATCH_SIZE
+                )
+            ),
             "export_time": datetime.utcnow().isoformat(),
         }
-
-        import json
-
-        json_data = json.dumps(export_data, ensure_ascii=False, indent=2, default=str)
-
-        from flask import Response
-
-        return Response(
-            json_data,
-            mimetype="application/json",
-            headers={"Content-Disposition": "attachment;filename=content_export.json"},
-        )
+        return stream_json_export(export_data, "content_export.json")
 
     except Exception as e:
         logging.error(f"Export content data error: {e}")
@@ -1590,13 +1694,9 @@ def export_content_data(current_user_id):
 
 
 @api_bp.route("/admin/database/backup", methods=["POST"])
-@token_required
+@admin_required
 def backup_database(current_user_id):
     try:
-        user = User.query.get(current_user_id)
-        if user.role != "admin":
-            return jsonify({"message": "Admin access required"}), 403
-
         # 这里可以实现数据库备份逻辑
         # 由于是SQLite/MySQL，我们可以创建数据库文件的副本
         import shutil
@@ -1639,13 +1739,9 @@ def backup_database(current_user_id):
 
 
 @api_bp.route("/admin/database/optimize", methods=["POST"])
-@token_required
+@admin_required
 def optimize_database(current_user_id):
     try:
-        user = User.query.get(current_user_id)
-        if user.role != "admin":
-            return jsonify({"message": "Admin access required"}), 403
-
         # 对于SQLite，VACUUM可以优化数据库
         if "sqlite" in str(db.engine.url):
             db.engine.execute("VACUUM")
@@ -1662,13 +1758,9 @@ def optimize_database(current_user_id):
 
 
 @api_bp.route("/admin/posts", methods=["GET"])
-@token_required
+@admin_required
 def get_admin_posts(current_user_id):
     try:
-        user = User.query.get(current_user_id)
-        if user.role != "admin":
-            return jsonify({"message": "Admin access required"}), 403
-
         page = request.args.get("page", 1, type=int)
         per_page = request.args.get("per_page", 20, type=int)
         search = request.args.get("search")
@@ -1682,6 +1774,34 @@ def get_admin_posts(current_user_id):
                 )
             )
 
+        if wants_keyset(request.args):
+            try:
+                result = keyset_paginate(
+                    query,
+                    Post.created_at,
+                    Post.id,
+                    cursor=request.args.get("cursor"),
+                    per_page=per_page,
+                )
+            except ValueError:
+                return jsonify({"message": "Invalid cursor"}), 400
+
+            total = None
+            if request.args.get("include_total") == "approx" and not search:
+                total = approximate_count(Post)
+
+            return (
+                jsonify(
+                    keyset_response(
+                        "posts",
+                        result,
+                        [post.to_dict() for post in result["items"]],
+                        total,
+                    )
+                ),
+                200,
+            )
+
         posts = query.order_by(Post.created_at.desc()).paginate(
             page=page, per_page=per_page, error_out=False
         )
@@ -1704,13 +1824,9 @@ def get_admin_posts(current_user_id):
 
 
 @api_bp.route("/admin/users", methods=["GET"])
-@token_required
+@admin_required
 def get_admin_users(current_user_id):
     try:
-        user = User.query.get(current_user_id)
-        if user.role != "admin":
-            return jsonify({"message": "Admin access required"}), 403
-
         page = request.args.get("page", 1, type=int)
         per_page = request.args.get("per_page", 20, type=int)
         search = request.args.get("search")
@@ -1724,6 +1840,34 @@ def get_admin_users(current_user_id):
                 )
             )
 
+        if wants_keyset(request.args):
+            try:
+                result = keyset_paginate(
+                    query,
+                    User.created_at,
+                    User.id,
+                    cursor=request.args.get("cursor"),
+                    per_page=per_page,
+                )
+            except ValueError:
+                return jsonify({"message": "Invalid cursor"}), 400
+
+            total = None
+            if request.args.get("include_total") == "approx" and not search:
+                total = approximate_count(User)
+
+            return (
+                jsonify(
+                    keyset_response(
+                        "users",
+                        result,
+                        [u.to_dict() for u in result["items"]],
+                        total,
+                    )
+                ),
+                200,
+            )
+
         users = query.order_by(User.created_at.desc()).paginate(
             page=page, per_page=per_page, error_out=False
         )
@@ -1746,13 +1890,9 @@ def get_admin_users(current_user_id):
 
 
 @api_bp.route("/admin/posts/<int:post_id>/featured", methods=["PUT"])
-@token_required
+@admin_required
 def toggle_post_featured(current_user_id, post_id):
     try:
-        user = User.query.get(current_user_id)
-        if user.role != "admin":
-            return jsonify({"message": "Admin access required"}), 403
-
         data = request.get_json()
         featured = data.get("featured", False)
 
@@ -1773,22 +1913,24 @@ def toggle_post_featured(current_user_id, post_id):
 
 
 @api_bp.route("/admin/users/<int:user_id>/role", methods=["PUT"])
-@token_required
+@admin_required
 def change_user_role(current_user_id, user_id):
     try:
-        user = User.query.get(current_user_id)
-        if user.role != "admin":
-            return jsonify({"message": "Admin access required"}), 403
-
         data = request.get_json()
         new_role = data.get("role")
 
         if new_role not in ["user", "admin"]:
             return jsonify({"message": "Invalid role"}), 400
 
-        target_user = User.query.get_or_404(user_id)
-        target_user.role = new_role
+        # 直接更新角色列，不加载用户行
+        updated = User.query.filter_by(id=user_id).update(
+            {"role": new_role}, synchronize_session=False
+        )
+        if not updated:
+            return jsonify({"message": "User not found"}), 404
         db.session.commit()
+        invalidate_user_role(user_id)
+        invalidate_user_cache(user_id)
 
         log_action(
             current_user_id, "change_role", "user", user_id, {"new_role": new_role}
@@ -1803,14 +1945,11 @@ def change_user_role(current_user_id, user_id):
 
 
 @api_bp.route("/admin/users/<int:user_id>", methods=["DELETE"])
-@token_required
+@admin_required
 def delete_user_admin(current_user_id, user_id):
     try:
-        user = User.query.get(current_user_id)
-        if user.role != "admin":
-            return jsonify({"message": "Admin access required"}), 403
-
-        target_user = User.query.get_or_404(user_id)
+        # 删除只需级联关系，不加载头像
+        target_user = User.query.options(db.defer(User.avatar)).get_or_404(user_id)
 
         # 防止删除自己
         if target_user.id == current_user_id:
@@ -1818,6 +1957,7 @@ def delete_user_admin(current_user_id, user_id):
 
         db.session.delete(target_user)
         db.session.commit()
+        invalidate_user_role(user_id)
 
         log_action(current_user_id, "delete_user", "user", user_id)
 
@@ -1886,13 +2026,9 @@ def get_user_summary(current_user_id):
 
 
 @api_bp.route("/admin/fetch_avatars", methods=["POST"])
-@token_required
+@admin_required
 def admin_fetch_avatars(current_user_id):
     try:
-        user = User.query.get(current_user_id)
-        if not user or user.role != "admin":
-            return jsonify({"message": "Admin access required"}), 403
-
         body = request.get_json() or {}
         items = body.get("items") or []
         if not isinstance(items, list) or not items:
@@ -1955,13 +2091,9 @@ def admin_fetch_avatars(current_user_id):
 
 # 管理员专用算法管理API
 @api_bp.route("/admin/algorithms", methods=["POST"])
-@token_required
+@admin_required
 def create_algorithm(current_user_id):
     try:
-        user = User.query.get(current_user_id)
-        if user.role != "admin":
-            return jsonify({"message": "Admin access required"}), 403
-
         data = request.get_json()
         name = data.get("name")
         chinese_name = data.get("chinese_name")
@@ -1997,6 +2129,7 @@ def create_algorithm(current_user_id):
         )
 
         db.session.add(algorithm)
+        register_tags(tags)
         db.session.commit()
 
         # 异步向量化新算法（不阻塞API响应）
@@ -2049,13 +2182,9 @@ def create_algorithm(current_user_id):
 
 
 @api_bp.route("/admin/algorithms/<int:algorithm_id>", methods=["PUT"])
-@token_required
+@admin_required
 def update_algorithm(current_user_id, algorithm_id):
     try:
-        user = User.query.get(current_user_id)
-        if user.role != "admin":
-            return jsonify({"message": "Admin access required"}), 403
-
         algorithm = Algorithm.query.get_or_404(algorithm_id)
         data = request.get_json()
 
@@ -2084,6 +2213,9 @@ def update_algorithm(current_user_id, algorithm_id):
             if field in data:
                 setattr(algorithm, field, data[field])
 
+        if "tags" in data:
+            register_tags(data["tags"])
+
         db.session.commit()
 
         log_action(current_user_id, "update_algorithm", "algorithm", algorithm_id, data)
@@ -2105,13 +2237,9 @@ def update_algorithm(current_user_id, algorithm_id):
 
 
 @api_bp.route("/admin/algorithms/<int:algorithm_id>", methods=["DELETE"])
-@token_required
+@admin_required
 def delete_algorithm(current_user_id, algorithm_id):
     try:
-        user = User.query.get(current_user_id)
-        if user.role != "admin":
-            return jsonify({"message": "Admin access required"}), 403
-
         algorithm = Algorithm.query.get_or_404(algorithm_id)
 
         # 删除相关的用户知识记录
@@ -2150,43 +2278,19 @@ def search_users(current_user_id):
         if not query:
             return jsonify({"users": []}), 200
 
-        # 搜索用户名或邮箱（排除自己和已经是好友的用户）
-        users = (
-            User.query.filter(
-                db.and_(
-                    db.or_(
-                        User.username.ilike(f"%{query}%"),
-                        User.email.ilike(f"%{query}%"),
-                    ),
-                    User.id != current_user_id,
-                )
-            )
-            .limit(10)
-            .all()
-        )
+        # 按用户名/邮箱前缀搜索（排除自己），好友状态一次查询取出
+        users = search_users_by_prefix(query, exclude_id=current_user_id, limit=10)
+        links = friend_links(current_user_id, [user.id for user in users])
+        cards = load_user_cards(user.id for user in users)
 
-        # 检查每个用户是否已经是好友
         result = []
         for user in users:
-            # 检查是否存在好友关系（无论谁发起的）
-            existing_friend = Friend.query.filter(
-                db.or_(
-                    db.and_(
-                        Friend.user_id == current_user_id, Friend.friend_id == user.id
-                    ),
-                    db.and_(
-                        Friend.user_id == user.id, Friend.friend_id == current_user_id
-                    ),
-                )
-            ).first()
+            existing_friend = links.get(user.id)
 
-            user_dict = user.to_dict()
+            user_dict = dict(cards[user.id], email=user.email)
             if existing_friend:
                 user_dict["friend_status"] = existing_friend.status
-                if existing_friend.user_id == current_user_id:
-                    user_dict["is_sender"] = True
-                else:
-                    user_dict["is_sender"] = False
+                user_dict["is_sender"] = existing_friend.user_id == current_user_id
             else:
                 user_dict["friend_status"] = None
                 user_dict["is_sender"] = False
@@ -2211,20 +2315,12 @@ def send_friend_request(current_user_id):
         if not friend_id:
             return jsonify({"message": "Friend ID is required"}), 400
 
+        friend_id = int(friend_id)
         if friend_id == current_user_id:
             return jsonify({"message": "Cannot add yourself as friend"}), 400
 
-        # 检查是否已经是好友
-        existing_friend = Friend.query.filter(
-            db.or_(
-                db.and_(
-                    Friend.user_id == current_user_id, Friend.friend_id == friend_id
-                ),
-                db.and_(
-                    Friend.user_id == friend_id, Friend.friend_id == current_user_id
-                ),
-            )
-        ).first()
+        # 检查是否已经是好友（写操作前绕过缓存）
+        existing_friend = get_friendship(current_user_id, friend_id, use_cache=False)
 
         if existing_friend:
             if existing_friend.status == "accepted":
@@ -2232,13 +2328,22 @@ def send_friend_request(current_user_id):
             elif existing_friend.status == "pending":
                 return jsonify({"message": "Friend request already sent"}), 400
 
-        # 创建好友请求
-        friend_request = Friend(
-            user_id=current_user_id, friend_id=friend_id, status="pending"
+        # 每对用户只保留一条关系记录：被拒绝后重新发起时复用原记录
+        friend_request = request_row_to_reuse(
+            current_user_id, friend_id, existing_friend
         )
-
-        db.session.add(friend_request)
+        if friend_request is not None:
+            friend_request.user_id = current_user_id
+            friend_request.friend_id = friend_id
+            friend_request.status = "pending"
+        else:
+            # 创建好友请求
+            friend_request = Friend(
+                user_id=current_user_id, friend_id=friend_id, status="pending"
+            )
+            db.session.add(friend_request)
         db.session.commit()
+        invalidate_friendship(current_user_id, friend_id)
 
         log_action(current_user_id, "send_friend_request", "user", friend_id)
 
@@ -2263,20 +2368,25 @@ def send_friend_request(current_user_id):
 def get_friend_requests(current_user_id):
     """获取好友请求列表"""
     try:
-        # 获取收到的好友请求
-        received_requests = Friend.query.filter_by(
-            friend_id=current_user_id, status="pending"
-        ).all()
-        # 获取发出的好友请求
-        sent_requests = Friend.query.filter_by(
-            user_id=current_user_id, status="pending"
-        ).all()
+        # 收到和发出的请求一次取出，双方用户卡片批量加载
+        requests = pending_requests(current_user_id)
+        cards = load_user_cards(
+            {row.user_id for row in requests} | {row.friend_id for row in requests}
+        )
 
         return (
             jsonify(
                 {
-                    "received": [req.to_dict() for req in received_requests],
-                    "sent": [req.to_dict() for req in sent_requests],
+                    "received": [
+                        serialize_request(row, cards)
+                        for row in requests
+                        if row.friend_id == current_user_id
+                    ],
+                    "sent": [
+                        serialize_request(row, cards)
+                        for row in requests
+                        if row.user_id == current_user_id
+                    ],
                 }
             ),
             200,
@@ -2310,6 +2420,7 @@ def respond_friend_request(current_user_id, request_id):
             friend_request.status = "rejected"
 
         db.session.commit()
+        invalidate_friendship(friend_request.user_id, friend_request.friend_id)
 
         log_action(
             current_user_id,
@@ -2332,29 +2443,11 @@ def respond_friend_request(current_user_id, request_id):
 def get_friends(current_user_id):
     """获取好友列表"""
     try:
-        # 获取所有已接受的好友关系
-        friends1 = Friend.query.filter_by(
-            user_id=current_user_id, status="accepted"
-        ).all()
-        friends2 = Friend.query.filter_by(
-            friend_id=current_user_id, status="accepted"
-        ).all()
-
-        friend_users = []
-        for friend in friends1:
-            friend_users.append(friend.friend)
-        for friend in friends2:
-            friend_users.append(friend.user)
+        # 好友 id 一次 UNION 查询取出（已去重），再批量加载紧凑的用户卡片
+        cards = load_user_cards(friend_ids(current_user_id))
+        friends = sorted(cards.values(), key=lambda card: card["username"].lower())
 
-        # 去重
-        seen_ids = set()
-        unique_friends = []
-        for friend in friend_users:
-            if friend.id not in seen_ids:
-                seen_ids.add(friend.id)
-                unique_friends.append(friend.to_dict())
-
-        return jsonify({"friends": unique_friends}), 200
+        return jsonify({"friends": friends}), 200
 
     except Exception as e:
         logging.error(f"Get friends error: {e}")
@@ -2366,24 +2459,16 @@ def get_friends(current_user_id):
 def remove_friend(current_user_id, friend_id):
     """删除好友"""
     try:
-        # 查找好友关系
-        friend_relation = Friend.query.filter(
-            db.or_(
-                db.and_(
-                    Friend.user_id == current_user_id, Friend.friend_id == friend_id
-                ),
-                db.and_(
-                    Friend.user_id == friend_id, Friend.friend_id == current_user_id
-                ),
-            ),
-            Friend.status == "accepted",
-        ).first()
+        # 查找并删除好友关系（规范化用户对上的一次索引查找）
+        deleted = Friend.query.filter(
+            pair_condition(current_user_id, friend_id), Friend.status == "accepted"
+        ).delete(synchronize_session=False)
 
-        if not friend_relation:
+        if not deleted:
             return jsonify({"message": "Friend relationship not found"}), 404
 
-        db.session.delete(friend_relation)
         db.session.commit()
+        invalidate_friendship(current_user_id, friend_id)
 
         log_action(current_user_id, "remove_friend", "user", friend_id)
 
@@ -2396,6 +2481,12 @@ def remove_friend(current_user_id, friend_id):
 
 
 @api_bp.route("/users/<int:user_id>/profile", methods=["GET"])
+@cached_view(
+    "profile",
+    ttl=60,
+    vary=lambda user_id: user_id,
+    version=user_cache_version,
+)
 def get_user_profile(user_id):
     """获取用户公开资料"""
     try:
@@ -2438,6 +2529,32 @@ def get_user_profile(user_id):
         return jsonify({"message": "Failed to get user profile"}), 404
 
 
+@api_bp.route("/users/<int:user_id>/avatar", methods=["GET"])
+def get_user_avatar(user_id):
+    """用户头像图片（地址带版本号，可被浏览器和代理长期缓存）"""
+    try:
+        avatar = (
+            db.session.query(User.avatar).filter(User.id == user_id).scalar()
+        )
+        decoded = decode_avatar(avatar)
+        if decoded is None:
+            return jsonify({"message": "Avatar not found"}), 404
+
+        mimetype, data = decoded
+        response = Response(data, mimetype=mimetype)
+        response.set_etag(hashlib.sha1(data).hexdigest())
+        response.cache_control.public = True
+        response.cache_control.max_age = 86400
+        # SVG 头像只作为图片使用，禁止其中的脚本在直接打开时执行
+        response.headers["Content-Security-Policy"] = "default-src 'none'"
+        response.headers["X-Content-Type-Options"] = "nosniff"
+        return response.make_conditional(request)
+
+    except Exception as e:
+        logging.error(f"Get user avatar error: {e}")
+        return jsonify({"message": "Failed to get avatar"}), 500
+
+
 # 聊天相关API
 @api_bp.route("/chat/messages", methods=["GET"])
 @token_required
@@ -2449,50 +2566,43 @@ def get_chat_messages(current_user_id):
             return jsonify({"messages": []}), 200
 
         # 检查是否是好友关系
-        friendship = Friend.query.filter(
-            db.or_(
-                db.and_(
-                    Friend.user_id == current_user_id, Friend.friend_id == friend_id
-                ),
-                db.and_(
-                    Friend.user_id == friend_id, Friend.friend_id == current_user_id
-                ),
-            ),
-            Friend.status == "accepted",
-        ).first()
-
-        if not friendship:
+        if not are_friends(current_user_id, friend_id):
             return jsonify({"message": "Not friends with this user"}), 403
 
-        # 获取聊天消息
-        messages = (
-            ChatMessage.query.filter(
-                db.or_(
-                    db.and_(
-                        ChatMessage.sender_id == current_user_id,
-                        ChatMessage.receiver_id == friend_id,
-                    ),
-                    db.and_(
-                        ChatMessage.sender_id == friend_id,
-                        ChatMessage.receiver_id == current_user_id,
+        if "cursor" in request.args:
+            # 游标分页：从最新消息向前翻页，返回时按时间正序排列
+            try:
+                page_info = keyset_paginate(
+                    ChatMessage.query.filter(
+                        conversation_condition(current_user_id, friend_id)
                     ),
+                    ChatMessage.created_at,
+                    ChatMessage.id,
+                    cursor=request.args.get("cursor"),
+                    per_page=request.args.get("per_page", 50, type=int),
                 )
+            except ValueError:
+                return jsonify({"message": "Invalid cursor"}), 400
+            result = keyset_response(
+                "messages",
+                page_info,
+                [serialize_message(msg) for msg in reversed(page_info["items"])],
+            )
+        else:
+            # 按消息 id 增量读取：after_id 追新，before_id 翻看更早的消息，否则返回最新一页
+            result = fetch_messages(
+                current_user_id,
+                friend_id,
+                after_id=request.args.get("after_id", type=int),
+                before_id=request.args.get("before_id", type=int),
+                per_page=request.args.get("per_page", DEFAULT_MESSAGE_PAGE, type=int),
             )
-            .order_by(ChatMessage.created_at)
-            .all()
-        )
-
-        # 标记接收到的消息为已读
-        unread_messages = ChatMessage.query.filter_by(
-            sender_id=friend_id, receiver_id=current_user_id, is_read=False
-        ).all()
-
-        for msg in unread_messages:
-            msg.is_read = True
 
-        db.session.commit()
+        # 标记接收到的消息为已读（没有未读时不写库）
+        if mark_read(current_user_id, friend_id):
+            db.session.commit()
 
-        return jsonify({"messages": [msg.to_dict() for msg in messages]}), 200
+        return jsonify(result), 200
 
     except Exception as e:
         db.session.rollback()
@@ -2513,20 +2623,8 @@ def send_chat_message(current_user_id):
         if not receiver_id or not content:
             return jsonify({"message": "Receiver ID and content are required"}), 400
 
-        # 检查是否是好友关系
-        friendship = Friend.query.filter(
-            db.or_(
-                db.and_(
-                    Friend.user_id == current_user_id, Friend.friend_id == receiver_id
-                ),
-                db.and_(
-                    Friend.user_id == receiver_id, Friend.friend_id == current_user_id
-                ),
-            ),
-            Friend.status == "accepted",
-        ).first()
-
-        if not friendship:
+        # 检查是否是好友关系（写入前直接查询，不使用可能过期的进程内缓存）
+        if not are_friends(current_user_id, receiver_id, use_cache=False):
             return jsonify({"message": "Not friends with this user"}), 403
 
         # 创建消息
@@ -2538,8 +2636,15 @@ def send_chat_message(current_user_id):
         )
 
         db.session.add(message)
+        db.session.flush()
+
+        # 在同一事务中更新会话摘要（最后一条消息、接收方未读数）
+        record_message(message)
         db.session.commit()
 
+        # 推送给在线的接收方（及发送方的其它连接）
+        chat_broker.publish(serialize_message(message))
+
         log_action(
             current_user_id,
             "send_message",
@@ -2552,7 +2657,7 @@ def send_chat_message(current_user_id):
             jsonify(
                 {
                     "message": "Message sent successfully",
-                    "chat_message": message.to_dict(),
+                    "chat_message": serialize_message(message),
                 }
             ),
             201,
@@ -2564,6 +2669,83 @@ def send_chat_message(current_user_id):
         return jsonify({"message": "Failed to send message"}), 500
 
 
+@api_bp.route("/chat/conversations", methods=["GET"])
+@token_required
+def get_chat_conversations(current_user_id):
+    """会话列表：每个会话的最后一条消息和未读数（读取会话摘要表）"""
+    try:
+        limit = request.args.get("per_page", MAX_PER_PAGE, type=int)
+        return (
+            jsonify({"conversations": list_conversations(current_user_id, limit)}),
+            200,
+        )
+
+    except Exception as e:
+        logging.error(f"Get chat conversations error: {e}")
+        return jsonify({"message": "Failed to get conversations"}), 500
+
+
+CHAT_STREAM_HEARTBEAT = 15
+
+
+@api_bp.route("/chat/stream", methods=["GET"])
+@token_required
+def chat_stream(current_user_id):
+    """
+    聊天消息推送（Server-Sent Events）
+
+    只推送新消息；重连时根据 Last-Event-ID（或 last_id 参数）补发断线期间的消息。
+    连接保持 CHAT_STREAM_MAX_SECONDS 秒后由服务端结束，客户端自动重连。
+    """
+    try:
+        last_id = request.headers.get("Last-Event-ID") or request.args.get("last_id")
+        try:
+            last_id = int(last_id) if last_id else None
+        except ValueError:
+            last_id = None
+        missed = (
+            messages_since(current_user_id, last_id) if last_id is not None else []
+        )
+
+        subscription = chat_broker.subscribe(current_user_id)
+        if subscription is None:
+            return jsonify({"message": "Too many chat streams, use polling"}), 503
+        for message in missed:
+            subscription.offer(message)
+
+        max_seconds = float(os.getenv("CHAT_STREAM_MAX_SECONDS", "120"))
+        json_provider = current_app.json
+
+        def generate():
+            deadline = time.monotonic() + max_seconds
+            try:
+                yield "retry: 3000\n\n"
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    event = subscription.get(
+                        timeout=min(CHAT_STREAM_HEARTBEAT, remaining)
+                    )
+                    if event is None:
+                        yield ": keepalive\n\n"
+                        continue
+                    data = json_provider.dumps(event)
+                    yield f"id: {event['id']}\nevent: message\ndata: {data}\n\n"
+            finally:
+                chat_broker.unsubscribe(subscription)
+
+        return Response(
+            generate(),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    except Exception as e:
+        logging.error(f"Chat stream error: {e}")
+        return jsonify({"message": "Failed to open chat stream"}), 500
+
+
 # AI分析相关API
 @api_bp.route("/algorithms/<int:algorithm_id>/related-posts", methods=["GET"])
 @token_required
@@ -2771,12 +2953,13 @@ def get_fallback_related_posts(algorithm):
 
     # 标签匹配
     if algorithm.tags:
-        tag_conditions = [Post.tags.contains([tag]) for tag in algorithm.tags]
-        if tag_conditions:
-            tag_posts = (
-                db.session.query(Post).filter(db.or_(*tag_conditions)).limit(10).all()
-            )
-            related_posts.extend(tag_posts)
+        tag_posts = (
+            db.session.query(Post)
+            .filter(posts_with_any_tag(algorithm.tags))
+            .limit(10)
+            .all()
+        )
+        related_posts.extend(tag_posts)
 
     # 关键词匹配
     algorithm_keywords = get_algorithm_keywords(algorithm.name.lower())
@@ -1,9 +1,15 @@
 import logging
+import os
+import threading
+import time
+from collections import OrderedDict
 from flask import Blueprint, request, jsonify
 import datetime
 from functools import wraps
 
 from models import db, User, UserKnowledge, SystemLog
+from services.audit_log import audit_logger
+from services.cache import LocalLRUBackend, invalidate_user_cache
 
 import base64
 from io import BytesIO
@@ -42,6 +48,114 @@ def jwt_encode(payload: dict, secret: str = SECRET_KEY) -> str:
     return f"{header_b}.{payload_b}.{sig_b}"
 
 
+def _b64url_decode(input_str: str) -> bytes:
+    rem = len(input_str) % 4
+    if rem > 0:
+        input_str += "=" * (4 - rem)
+    return base64.urlsafe_b64decode(input_str.encode("utf-8"))
+
+
+class InvalidTokenError(ValueError):
+    """令牌结构、签名无效或已过期"""
+
+
+# 预先以密钥初始化的 HMAC 对象，每次校验只复制状态后追加签名输入
+_SIGNER = hmac.new(SECRET_KEY.encode("utf-8"), digestmod=hashlib.sha256)
+
+
+def verify_token(token: str) -> dict:
+    """
+    校验 HS256 JWT 并返回其中的声明（手工实现以避免不同环境下依赖版本的差异）
+
+    Raises:
+        InvalidTokenError: 结构、签名无效或已过期
+    """
+    parts = token.split(".")
+    if len(parts) != 3:
+        raise InvalidTokenError("Invalid token structure")
+    header_b, payload_b, sig_b = parts
+    signer = _SIGNER.copy()
+    signer.update((header_b + "." + payload_b).encode("utf-8"))
+    try:
+        signature = _b64url_decode(sig_b)
+        if not hmac.compare_digest(signature, signer.digest()):
+            raise InvalidTokenError("Signature mismatch")
+        data = json.loads(_b64url_decode(payload_b).decode("utf-8"))
+        if not isinstance(data, dict) or "user_id" not in data:
+            raise InvalidTokenError("Missing claims")
+        # check exp
+        if "exp" in data and int(data["exp"]) < int(time.time()):
+            raise InvalidTokenError("Token expired")
+    except InvalidTokenError:
+        raise
+    except Exception as e:
+        raise InvalidTokenError(f"Malformed token: {e}")
+    return data
+
+
+class TokenCache:
+    """
+    已校验令牌的进程内缓存（令牌摘要 -> 声明）
+
+    缓存项在令牌 exp 与缓存 TTL 中较早的时间失效，命中时只需一次摘要计算和字典查找。
+    只缓存校验成功的令牌，伪造的令牌无法挤占缓存。
+    """
+
+    def __init__(self, ttl: float = 300.0, max_entries: int = 10000):
+        """
+        初始化
+
+        Args:
+            ttl: 缓存项最长有效期（秒）
+            max_entries: 最多缓存的令牌数量，超出时淘汰最久未使用的
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data: "OrderedDict[bytes, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.blake2b(token.encode("utf-8"), digest_size=16).digest()
+
+    def decode(self, token: str) -> dict:
+        """返回令牌声明；未命中时完整校验并缓存"""
+        key = self._key(token)
+        now = time.time()
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                claims, expires = item
+                if expires > now:
+                    self._data.move_to_end(key)
+                    return claims
+                del self._data[key]
+
+        claims = verify_token(token)
+        expires = now + self.ttl
+        if "exp" in claims:
+            expires = min(expires, int(claims["exp"]) + 1)
+        if self.ttl > 0:
+            with self._lock:
+                self._data[key] = (claims, expires)
+                while len(self._data) > self.max_entries:
+                    self._data.popitem(last=False)
+        return claims
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+# 全局令牌缓存实例
+token_cache = TokenCache(ttl=float(os.getenv("TOKEN_CACHE_TTL", "300")))
+
+
+def decode_token(token: str) -> dict:
+    """校验令牌并返回声明（带缓存），无效时抛出 InvalidTokenError"""
+    return token_cache.decode(token)
+
+
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -50,39 +164,9 @@ def token_required(f):
             return jsonify({"message": "Token is missing"}), 401
         try:
             token = token.split(" ")[1]  # Bearer token
-            # Manual JWT decode + verify HS256 to avoid dependency
-            # differences across environments
             try:
-                import base64
-                import hmac
-                import hashlib
-                import json
-                import time
-
-                def b64url_decode(input_str: str) -> bytes:
-                    rem = len(input_str) % 4
-                    if rem > 0:
-                        input_str += "=" * (4 - rem)
-                    return base64.urlsafe_b64decode(input_str.encode("utf-8"))
-
-                parts = token.split(".")
-                if len(parts) != 3:
-                    raise ValueError("Invalid token structure")
-                header_b, payload_b, sig_b = parts
-                signing_input = (header_b + "." + payload_b).encode("utf-8")
-                signature = b64url_decode(sig_b)
-                expected_sig = hmac.new(
-                    SECRET_KEY.encode("utf-8"), signing_input, hashlib.sha256
-                ).digest()
-                if not hmac.compare_digest(signature, expected_sig):
-                    raise ValueError("Signature mismatch")
-                payload_json = b64url_decode(payload_b).decode("utf-8")
-                data = json.loads(payload_json)
-                # check exp
-                if "exp" in data:
-                    if int(data["exp"]) < int(time.time()):
-                        raise ValueError("Token expired")
-            except Exception as ex:
+                data = decode_token(token)
+            except InvalidTokenError as ex:
                 logging.warning(
                     f"JWT manual decode failed: {ex}; "
                     f"token header preview: {token[:40]}"
@@ -96,19 +180,82 @@ def token_required(f):
     return decorated
 
 
+class RoleCache:
+    """
+    用户角色的进程内短期缓存（只查询 role 列，不加载用户行）
+
+    角色变更后由调用方失效本进程的缓存；其它 worker 最多在 TTL 内看到旧角色。
+    """
+
+    # 缓存"用户不存在"的占位值
+    _MISSING = ""
+
+    def __init__(self, ttl: float = 30.0, max_entries: int = 4096):
+        self.ttl = ttl
+        self._store = LocalLRUBackend(max_entries=max_entries)
+
+    def get(self, user_id: int):
+        cached = self._store.get(str(user_id))
+        if cached is not None:
+            return cached or None
+        role = db.session.query(User.role).filter(User.id == user_id).scalar()
+        if self.ttl > 0:
+            self._store.set(str(user_id), role or self._MISSING, self.ttl)
+        return role
+
+    def invalidate(self, user_id: int):
+        self._store.delete(str(user_id))
+
+
+# 全局角色缓存实例
+role_cache = RoleCache(ttl=float(os.getenv("ROLE_CACHE_TTL", "30")))
+
+
+def get_user_role(user_id: int):
+    """用户当前角色（带短期缓存），用户不存在时返回 None"""
+    return role_cache.get(user_id)
+
+
+def invalidate_user_role(user_id: int):
+    """修改或删除用户后调用"""
+    role_cache.invalidate(user_id)
+
+
+def admin_required(f):
+    """要求管理员权限（包含 token_required 的校验，视图同样接收 current_user_id）"""
+
+    @token_required
+    @wraps(f)
+    def decorated(current_user_id, *args, **kwargs):
+        if get_user_role(current_user_id) != "admin":
+            return jsonify({"message": "Admin access required"}), 403
+        return f(current_user_id, *args, **kwargs)
+
+    return decorated
+
+
 def log_action(user_id, action, resource_type=None, resource_id=None, details=None):
-    """记录用户操作日志"""
+    """
+    记录用户操作日志
+
+    日志交给后台批量写入（services/audit_log.py），不在请求中单独提交事务；
+    写入器未启动时（如离线脚本）直接同步写入。
+    """
     try:
-        log = SystemLog(
-            user_id=user_id,
-            action=action,
-            resource_type=resource_type,
-            resource_id=resource_id,
-            details=details,
-            ip_address=request.remote_addr,
-            user_agent=request.headers.get("User-Agent"),
-        )
-        db.session.add(log)
+        entry = {
+            "user_id": user_id,
+            "action": action,
+            "resource_type": resource_type,
+            "resource_id": resource_id,
+            "details": details,
+            "ip_address": request.remote_addr if request else None,
+            "user_agent": request.headers.get("User-Agent") if request else None,
+            "created_at": datetime.datetime.utcnow(),
+        }
+        if audit_logger.running:
+            audit_logger.record(entry)
+            return
+        db.session.add(SystemLog(**entry))
         db.session.commit()
     except Exception as e:
         logging.error(f"Failed to log action: {e}")
@@ -361,6 +508,7 @@ def upload_avatar(current_user_id):
                 return jsonify({"message": "No avatar provided"}), 400
 
         db.session.commit()
+        invalidate_user_cache(user.id)
         log_action(user.id, "upload_avatar")
         return jsonify({"message": "Avatar updated", "user": user.to_dict()}), 200
     except Exception as e:
@@ -0,0 +1,294 @@
+"""
+审计日志服务模块
+log_action 只把日志追加到进程内的有界缓冲区，由后台线程批量插入 system_logs，
+请求路径不再为日志单独开启事务。缓冲区写满时短暂等待后台写出（背压），仍写不下或
+数据库不可用时落盘到溢出文件，数据库恢复后自动补写
+"""
+
+import atexit
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from models import db, SystemLog
+
+logger = logging.getLogger(__name__)
+
+SPILL_PREFIX = "audit_spill"
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+class AuditLogger:
+    """审计日志异步批量写入器"""
+
+    def __init__(
+        self,
+        flush_interval: float = 1.0,
+        batch_size: int = 500,
+        capacity: int = 10000,
+        block_timeout: float = 0.05,
+    ):
+        """
+        初始化
+
+        Args:
+            flush_interval: 后台批量写入的间隔（秒）
+            batch_size: 单条 INSERT 最多写入的日志数；缓冲达到该数量时立即唤醒写入
+            capacity: 缓冲区容量
+            block_timeout: 缓冲区满时调用方最多等待的时间（秒），超时后写入溢出文件
+        """
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.capacity = capacity
+        self.block_timeout = block_timeout
+        self.spill_dir = None
+        self._buffer: deque = deque()
+        self._lock = threading.Lock()
+        self._not_full = threading.Condition(self._lock)
+        # 串行化写出，避免定时线程与退出时的写出交错
+        self._flush_lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._app = None
+
+    def init_app(self, app):
+        """绑定 Flask 应用并启动后台写入线程"""
+        self._app = app
+        self.flush_interval = float(
+            os.getenv("AUDIT_LOG_FLUSH_INTERVAL", self.flush_interval)
+        )
+        self.batch_size = int(os.getenv("AUDIT_LOG_BATCH_SIZE", self.batch_size))
+        self.capacity = int(os.getenv("AUDIT_LOG_BUFFER_SIZE", self.capacity))
+        self.spill_dir = os.getenv(
+            "AUDIT_LOG_SPILL_DIR", os.path.join(app.root_path, "logs")
+        )
+        os.makedirs(self.spill_dir, exist_ok=True)
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="audit-log-flush", daemon=True
+            )
+            self._thread.start()
+            # 正常退出时写出剩余日志
+            atexit.register(self.shutdown)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and not self._stop.is_set()
+
+    def record(self, entry: Dict[str, Any]):
+        """追加一条日志（字段与 SystemLog 列一致）"""
+        with self._not_full:
+            if len(self._buffer) >= self.capacity:
+                # 背压：唤醒写入线程并短暂等待腾出空间
+                self._wakeup.set()
+                self._not_full.wait(self.block_timeout)
+            if len(self._buffer) < self.capacity:
+                self._buffer.append(entry)
+                if len(self._buffer) >= self.batch_size:
+                    self._wakeup.set()
+                return
+        logger.warning("Audit log buffer full, spilling entry to disk")
+        self._spill([entry])
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._buffer)
+
+    def _take(self, limit: int) -> List[Dict[str, Any]]:
+        with self._not_full:
+            count = min(limit, len(self._buffer))
+            batch = [self._buffer.popleft() for _ in range(count)]
+            if batch:
+                self._not_full.notify_all()
+            return batch
+
+    def _insert(self, rows: List[Dict[str, Any]]):
+        """在一个事务中分批插入（全部成功或全部回滚）"""
+        with db.engine.begin() as conn:
+            for start in range(0, len(rows), self.batch_size):
+                conn.execute(
+                    SystemLog.__table__.insert(), rows[start : start + self.batch_size]
+                )
+
+    def flush(self) -> int:
+        """
+        将缓冲区中的日志分批写入数据库
+
+        Returns:
+            本次写入的日志数量
+        """
+        written = 0
+        with self._flush_lock:
+            while True:
+                batch = self._take(self.batch_size)
+                if not batch:
+                    break
+                try:
+                    self._insert(batch)
+                except Exception as e:
+                    # 数据库不可用：落盘保存，避免缓冲区持续积压
+                    logger.error(f"Failed to write audit logs, spilling to disk: {e}")
+                    self._spill(batch + self._take(len(self._buffer)))
+                    break
+                written += len(batch)
+        return written
+
+    def _spill_path(self) -> str:
+        return os.path.join(self.spill_dir, f"{SPILL_PREFIX}.{os.getpid()}.jsonl")
+
+    def _spill(self, entries: List[Dict[str, Any]]):
+        if not entries:
+            return
+        if self.spill_dir is None:
+            logger.error(f"Dropped {len(entries)} audit logs (spill dir not set)")
+            return
+        lines = "".join(
+            json.dumps(entry, ensure_ascii=False, default=str) + "\n"
+            for entry in entries
+        )
+        with self._spill_lock:
+            with open(self._spill_path(), "a", encoding="utf-8") as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+
+    @staticmethod
+    def _parse_spilled(line: str) -> Dict[str, Any]:
+        entry = json.loads(line)
+        if entry.get("created_at"):
+            entry["created_at"] = datetime.fromisoformat(entry["created_at"])
+        return entry
+
+    def _read_spilled(self, path: str) -> List[Dict[str, Any]]:
+        """
+        逐行解析溢出文件；无法解析的行（如进程崩溃时写了一半的行）移入隔离文件，
+        不影响其余日志的补写
+        """
+        entries = []
+        rejected = []
+        with open(path, encoding="utf-8", errors="replace") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    entries.append(self._parse_spilled(line))
+                except (ValueError, TypeError, AttributeError):
+                    rejected.append(line if line.endswith("\n") else line + "\n")
+        if rejected:
+            logger.warning(
+                f"Quarantined {len(rejected)} unreadable audit log lines from {path}"
+            )
+            quarantine = os.path.join(self.spill_dir, f"{SPILL_PREFIX}.rejected")
+            with self._spill_lock:
+                with open(quarantine, "a", encoding="utf-8") as f:
+                    f.write("".join(rejected))
+        return entries
+
+    def _claim_spill(self, path: str) -> Optional[str]:
+        """
+        把溢出文件原子地改名为本进程所有的文件，多个 worker 同时补写时只有一个能
+        认领成功；已被其它进程认领（文件不存在）时返回 None
+        """
+        claimed = os.path.join(
+            self.spill_dir, f"{SPILL_PREFIX}.{os.getpid()}.{time.time_ns()}.claimed"
+        )
+        # 持有写锁改名，本进程并发写入的溢出日志不会落到已认领的文件之后
+        with self._spill_lock:
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                return None
+        return claimed
+
+    def replay_spill(self) -> int:
+        """
+        补写溢出文件中的日志（本进程的文件，以及已退出进程遗留的文件）
+
+        每个文件先认领再读取，避免多个 worker 重复补写同一文件；写入失败时认领的
+        文件保留，由本进程下次重试（本进程退出后由其它进程认领）。无法解析的行
+        移入隔离文件 audit_spill.rejected。
+
+        Returns:
+            补写的日志数量
+        """
+        if self.spill_dir is None:
+            return 0
+        replayed = 0
+        paths = glob.glob(os.path.join(self.spill_dir, f"{SPILL_PREFIX}.*.jsonl"))
+        paths += glob.glob(os.path.join(self.spill_dir, f"{SPILL_PREFIX}.*.claimed"))
+        for path in paths:
+            try:
+                pid = int(os.path.basename(path).split(".")[1])
+            except ValueError:
+                continue
+            if pid != os.getpid() and _pid_alive(pid):
+                continue
+            if not (pid == os.getpid() and path.endswith(".claimed")):
+                path = self._claim_spill(path)
+                if path is None:
+                    continue
+            try:
+                entries = self._read_spilled(path)
+                if entries:
+                    self._insert(entries)
+            except Exception as e:
+                # 认领的文件保留到下次重试，继续处理其余文件
+                logger.error(f"Failed to replay spilled audit logs {path}: {e}")
+                continue
+            os.remove(path)
+            replayed += len(entries)
+        if replayed:
+            logger.info(f"Replayed {replayed} spilled audit logs")
+        return replayed
+
+    def _flush_with_context(self) -> int:
+        if self._app is None:
+            return self.flush()
+        with self._app.app_context():
+            return self.flush()
+
+    def _run(self):
+        replay_due = 0.0
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self._flush_with_context()
+                # 每分钟检查一次溢出文件（写入失败时插入会抛错，文件保留到下次）
+                if time.monotonic() >= replay_due:
+                    replay_due = time.monotonic() + 60.0
+                    with self._app.app_context():
+                        self.replay_spill()
+            except Exception as e:
+                logger.error(f"Audit log flush loop error: {e}")
+
+    def shutdown(self):
+        """停止后台线程并写出剩余日志"""
+        self._stop.set()
+        self._wakeup.set()
+        try:
+            self._flush_with_context()
+        except Exception as e:
+            logger.error(f"Final audit log flush failed: {e}")
+            self._spill(self._take(len(self._buffer)))
+
+
+# 全局审计日志实例
+audit_logger = AuditLogger()
@@ -0,0 +1,408 @@
+"""
+响应缓存服务模块
+提供可插拔的缓存后端（进程内 LRU、同机多 worker 共享的 SQLite 文件缓存、可选的 Redis），
+带命名空间版本号的缓存键和防击穿（stampede）保护；共享后端不可用时自动回退到进程内缓存
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from flask import Response, request
+
+try:
+    import redis
+except Exception:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+
+class CacheBackend:
+    """缓存后端接口：值均为 bytes，ttl 单位为秒"""
+
+    name = "base"
+
+    def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes, ttl: float):
+        raise NotImplementedError
+
+    def add(self, key: str, value: bytes, ttl: float) -> bool:
+        """仅当键不存在时写入，返回是否写入成功（用于分布式锁）"""
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+
+class LocalLRUBackend(CacheBackend):
+    """进程内 LRU 缓存"""
+
+    name = "local"
+
+    def __init__(self, max_entries: int = 2048):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_live(self, key: str, now: float):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires = item
+        if expires <= now:
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            return self._get_live(key, time.monotonic())
+
+    def set(self, key: str, value: bytes, ttl: float):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def add(self, key: str, value: bytes, ttl: float) -> bool:
+        with self._lock:
+            if self._get_live(key, time.monotonic()) is not None:
+                return False
+            self._data[key] = (value, time.monotonic() + ttl)
+            return True
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+class SQLiteFileBackend(CacheBackend):
+    """基于 SQLite 文件的缓存，同一主机上的多个 worker 共享"""
+
+    name = "sqlite"
+
+    def __init__(self, path: str, purge_interval: float = 60.0):
+        self.path = path
+        self.purge_interval = purge_interval
+        self._local = threading.local()
+        self._next_purge = 0.0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL)"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _maybe_purge(self, now: float):
+        if now < self._next_purge:
+            return
+        self._next_purge = now + self.purge_interval
+        self._conn().execute("DELETE FROM cache WHERE expires <= ?", (now,))
+
+    def get(self, key: str) -> Optional[bytes]:
+        now = time.time()
+        row = (
+            self._conn()
+            .execute(
+                "SELECT value FROM cache WHERE key = ? AND expires > ?", (key, now)
+            )
+            .fetchone()
+        )
+        return bytes(row[0]) if row else None
+
+    def set(self, key: str, value: bytes, ttl: float):
+        now = time.time()
+        self._conn().execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+            (key, value, now + ttl),
+        )
+        self._maybe_purge(now)
+
+    def add(self, key: str, value: bytes, ttl: float) -> bool:
+        now = time.time()
+        conn = self._conn()
+        conn.execute("DELETE FROM cache WHERE key = ? AND expires <= ?", (key, now))
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+            (key, value, now + ttl),
+        )
+        return cursor.rowcount > 0
+
+    def delete(self, key: str):
+        self._conn().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+
+class RedisBackend(CacheBackend):
+    """外部 Redis 缓存（可选依赖）"""
+
+    name = "redis"
+
+    def __init__(self, url: str):
+        if redis is None:
+            raise RuntimeError("redis package is not installed")
+        self._client = redis.Redis.from_url(url, socket_timeout=1)
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._client.get(key)
+
+    def set(self, key: str, value: bytes, ttl: float):
+        self._client.set(key, value, px=max(1, int(ttl * 1000)))
+
+    def add(self, key: str, value: bytes, ttl: float) -> bool:
+        return bool(self._client.set(key, value, px=max(1, int(ttl * 1000)), nx=True))
+
+    def delete(self, key: str):
+        self._client.delete(key)
+
+
+class FallbackBackend(CacheBackend):
+    """共享后端出错时回退到进程内缓存，并在冷却期后重试共享后端"""
+
+    def __init__(self, primary: CacheBackend, fallback: CacheBackend, cooldown=30.0):
+        self.primary = primary
+        self.fallback = fallback
+        self.cooldown = cooldown
+        self._down_until = 0.0
+        self.name = f"{primary.name}+{fallback.name}"
+
+    def _call(self, method: str, *args):
+        if time.monotonic() >= self._down_until:
+            try:
+                return getattr(self.primary, method)(*args)
+            except Exception as e:
+                logger.warning(
+                    f"Cache backend {self.primary.name} unavailable ({e}); "
+                    "falling back to local cache"
+                )
+                self._down_until = time.monotonic() + self.cooldown
+        return getattr(self.fallback, method)(*args)
+
+    def get(self, key):
+        return self._call("get", key)
+
+    def set(self, key, value, ttl):
+        return self._call("set", key, value, ttl)
+
+    def add(self, key, value, ttl):
+        return self._call("add", key, value, ttl)
+
+    def delete(self, key):
+        return self._call("delete", key)
+
+
+def create_backend_from_env() -> CacheBackend:
+    """
+    根据环境变量创建缓存后端
+
+    CACHE_BACKEND: local（默认）| sqlite | redis
+    CACHE_SQLITE_PATH: SQLite 缓存文件路径
+    CACHE_REDIS_URL: Redis 连接地址
+    """
+    kind = os.getenv("CACHE_BACKEND", "local").lower()
+    local = LocalLRUBackend()
+    try:
+        if kind == "sqlite":
+            path = os.getenv(
+                "CACHE_SQLITE_PATH",
+                os.path.join(tempfile.gettempdir(), "ml_learner_cache.sqlite3"),
+            )
+            return FallbackBackend(SQLiteFileBackend(path), local)
+        if kind == "redis":
+            url = os.getenv("CACHE_REDIS_URL", "redis://127.0.0.1:6379/0")
+            return FallbackBackend(RedisBackend(url), local)
+    except Exception as e:
+        logger.warning(f"Failed to create {kind} cache backend ({e}); using local")
+    return local
+
+
+class ResponseCache:
+    """带命名空间版本号和防击穿保护的缓存"""
+
+    def __init__(self, backend: Optional[CacheBackend] = None, prefix: str = "mll"):
+        """
+        初始化缓存
+
+        Args:
+            backend: 缓存后端，默认进程内 LRU
+            prefix: 所有缓存键的前缀
+        """
+        self.backend = backend or LocalLRUBackend()
+        self.prefix = prefix
+        self.lock_ttl = 10.0
+        self.lock_wait = 2.0
+        self._flights: Dict[str, threading.Lock] = {}
+        self._flights_lock = threading.Lock()
+
+    def configure(self, backend: CacheBackend):
+        self.backend = backend
+        logger.info(f"Response cache backend: {backend.name}")
+
+    def namespace_version(self, namespace: str) -> str:
+        """命名空间当前版本（失效时生成新版本，旧键自然过期）"""
+        value = self.backend.get(f"{self.prefix}:ns:{namespace}")
+        return value.decode("utf-8") if value else "0"
+
+    def invalidate_namespace(self, namespace: str, ttl: float = 86400.0):
+        """使命名空间下的全部缓存失效"""
+        self.backend.set(
+            f"{self.prefix}:ns:{namespace}", uuid.uuid4().hex[:12].encode(), ttl
+        )
+
+    def make_key(self, namespace: str, version: Any, parts: Iterable[Any]) -> str:
+        digest = hashlib.sha1(
+            json.dumps(list(parts), sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
+        return f"{self.prefix}:{namespace}:v{version}:{digest}"
+
+    def _flight_lock(self, key: str) -> threading.Lock:
+        with self._flights_lock:
+            lock = self._flights.get(key)
+            if lock is None:
+                if len(self._flights) > 1024:
+                    self._flights.clear()
+                lock = self._flights[key] = threading.Lock()
+            return lock
+
+    def get_or_set(
+        self,
+        key: str,
+        builder: Callable[[], bytes],
+        ttl: float,
+    ) -> bytes:
+        """
+        读取缓存，未命中时构建并写入
+
+        防击穿：同一进程内同一键只有一个线程构建；跨进程通过后端的
+        add() 抢占构建锁，未抢到的进程短暂等待其他进程写入的结果。
+        """
+        value = self.backend.get(key)
+        if value is not None:
+            return value
+
+        with self._flight_lock(key):
+            value = self.backend.get(key)
+            if value is not None:
+                return value
+
+            lock_key = key + ":lock"
+            acquired = self.backend.add(lock_key, b"1", self.lock_ttl)
+            if not acquired:
+                deadline = time.monotonic() + self.lock_wait
+                while time.monotonic() < deadline:
+                    time.sleep(0.05)
+                    value = self.backend.get(key)
+                    if value is not None:
+                        return value
+            try:
+                value = builder()
+                if value is not None:
+                    self.backend.set(key, value, ttl)
+                return value
+            finally:
+                # 只释放自己持有的构建锁；等待超时后自行构建时锁仍属于其他进程
+                if acquired:
+                    self.backend.delete(lock_key)
+
+
+# 全局响应缓存实例（后端在 create_app 中按环境变量配置）
+response_cache = ResponseCache()
+
+
+def user_namespace(user_id) -> str:
+    """用户相关缓存（推荐、公开资料）的命名空间"""
+    return f"user:{user_id}"
+
+
+def user_cache_version(user_id) -> str:
+    return response_cache.namespace_version(user_namespace(user_id))
+
+
+def invalidate_user_cache(*user_ids):
+    """用户的学习记录、帖子、评论、点赞、收藏变化后调用（失败不影响业务）"""
+    for user_id in set(user_ids):
+        if user_id is None:
+            continue
+        try:
+            response_cache.invalidate_namespace(user_namespace(user_id))
+        except Exception as e:
+            logger.warning(f"Failed to invalidate cache for user {user_id}: {e}")
+
+
+class _Uncacheable(Exception):
+    def __init__(self, response):
+        self.response = response
+
+
+def cached_view(
+    namespace: str,
+    ttl: float,
+    vary: Optional[Callable[..., Any]] = None,
+    version: Optional[Callable[..., Any]] = None,
+):
+    """
+    缓存 JSON 视图 200 响应的装饰器
+
+    Args:
+        namespace: 缓存命名空间
+        ttl: 缓存有效期（秒）
+        vary: 根据视图参数返回额外的缓存键组成部分（如用户 id）
+        version: 根据视图参数返回版本标识，版本变化即视为失效
+    """
+
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            parts = [request.path, sorted(request.args.items(multi=True))]
+            if vary is not None:
+                parts.append(vary(*args, **kwargs))
+            ver = version(*args, **kwargs) if version is not None else 0
+            key = response_cache.make_key(namespace, ver, parts)
+
+            def build():
+                response = f(*args, **kwargs)
+                response = _as_response(response)
+                if response.status_code != 200 or response.mimetype != (
+                    "application/json"
+                ):
+                    raise _Uncacheable(response)
+                return response.get_data()
+
+            try:
+                body = response_cache.get_or_set(key, build, ttl)
+            except _Uncacheable as e:
+                return e.response
+            return Response(body, mimetype="application/json")
+
+        return decorated
+
+    return decorator
+
+
+def _as_response(rv) -> Response:
+    from flask import make_response
+
+    return make_response(rv)
@@ -0,0 +1,271 @@
+"""
+目录数据缓存服务模块
+为很少变化的目录数据（算法、分类、标签）提供版本号、响应缓存和 HTTP 条件响应（ETag / 304）
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import time
+from functools import wraps
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from flask import Response, current_app, make_response, request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import db, CatalogVersion
+from services.cache import cached_view, response_cache
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogVersions:
+    """
+    目录数据版本号
+
+    版本号存放在 catalog_versions 表中，并在写入数据的同一事务内递增，
+    因此对所有 worker、重启前后都一致。读取走进程内缓存，最多每 ttl 秒查询一次。
+    """
+
+    def __init__(self, ttl: float = 2.0):
+        """
+        初始化版本号
+
+        Args:
+            ttl: 进程内版本号缓存的有效期（秒）
+        """
+        self.ttl = float(os.getenv("CATALOG_VERSION_TTL", ttl))
+        self._versions: Dict[str, int] = {}
+        self._expires = 0.0
+        self._lock = threading.Lock()
+        self._watched: Dict[type, str] = {}
+        self._installed = False
+
+    def watch(self, model, name: str):
+        """模型有新增/修改/删除时，在同一事务内递增对应的版本号"""
+        self._watched[model] = name
+
+    def names(self):
+        return sorted(set(self._watched.values()))
+
+    def ensure_rows(self, names: Optional[Iterable[str]] = None):
+        """确保版本号行存在（启动时调用，并发执行时幂等）"""
+        # services.counters 依赖本模块，在此处导入避免循环导入
+        from services.counters import insert_ignore
+
+        wanted = set(names or self.names())
+        existing = {name for (name,) in db.session.query(CatalogVersion.name)}
+        for name in wanted - existing:
+            insert_ignore(CatalogVersion, name=name, version=0)
+        db.session.commit()
+
+    def get(self, name: str) -> int:
+        return self.snapshot().get(name, 0)
+
+    def snapshot(self) -> Dict[str, int]:
+        """返回全部版本号（带 TTL 缓存）"""
+        now = time.monotonic()
+        with self._lock:
+            if now < self._expires:
+                return self._versions
+        try:
+            rows = db.session.query(CatalogVersion.name, CatalogVersion.version).all()
+            versions = {name: version for name, version in rows}
+        except Exception as e:
+            logger.warning(f"Failed to read catalog versions: {e}")
+            versions = self._versions
+        with self._lock:
+            self._versions = versions
+            self._expires = now + self.ttl
+        return versions
+
+    def expire(self):
+        """使本进程的版本号缓存立即失效"""
+        with self._lock:
+            self._expires = 0.0
+
+    def bump(self, session, names: Iterable[str]):
+        """在 session 当前事务中递增版本号（用于绕过 ORM 的批量写入）"""
+        names = set(names)
+        if not names:
+            return
+        conn = session.connection()
+        result = conn.execute(
+            db.update(CatalogVersion)
+            .where(CatalogVersion.name.in_(names))
+            .values(version=CatalogVersion.version + 1)
+        )
+        if result.rowcount < len(names):
+            # 版本号行缺失（如表被重建）时补建，避免缓存永不失效
+            existing = {
+                name
+                for (name,) in conn.execute(
+                    db.select(CatalogVersion.name).where(
+                        CatalogVersion.name.in_(names)
+                    )
+                )
+            }
+            for name in names - existing:
+                stmt = db.insert(CatalogVersion).values(name=name, version=1)
+                if conn.dialect.name == "mysql":
+                    stmt = stmt.prefix_with("IGNORE")
+                elif conn.dialect.name == "sqlite":
+                    stmt = stmt.prefix_with("OR IGNORE")
+                conn.execute(stmt)
+        session.info.setdefault("catalog_bumped", set()).update(names)
+
+    def _changed_names(self, session):
+        names = set()
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+            name = self._watched.get(type(obj))
+            if name:
+                names.add(name)
+        return names
+
+    def install(self):
+        """注册 SQLAlchemy 会话事件（重复调用无副作用）"""
+        if self._installed:
+            return
+        self._installed = True
+
+        @event.listens_for(Session, "before_flush")
+        def _collect(session, flush_context, instances):
+            session.info["catalog_pending"] = self._changed_names(session)
+
+        @event.listens_for(Session, "after_flush")
+        def _bump_in_transaction(session, flush_context):
+            self.bump(session, session.info.pop("catalog_pending", set()))
+
+        @event.listens_for(Session, "after_commit")
+        def _expire(session):
+            if session.info.pop("catalog_bumped", None):
+                self.expire()
+
+        @event.listens_for(Session, "after_soft_rollback")
+        def _discard(session, previous_transaction):
+            session.info.pop("catalog_bumped", None)
+            session.info.pop("catalog_pending", None)
+
+
+# 全局目录版本号实例
+catalog_versions = CatalogVersions()
+
+
+class CatalogCache:
+    """按版本号失效的序列化响应缓存（存放在共享响应缓存中）"""
+
+    def __init__(self, max_age: float = 300.0):
+        """
+        初始化缓存
+
+        Args:
+            max_age: 缓存最长存活时间（秒）
+        """
+        self.max_age = max_age
+
+    def get_or_build(
+        self, key: str, version_name: str, builder: Callable[[], Any]
+    ) -> Dict[str, Any]:
+        """
+        返回缓存的 {"body": bytes}，版本变化或过期时重新构建
+
+        Args:
+            key: 缓存键
+            version_name: 关联的目录版本名称
+            builder: 返回可 JSON 序列化数据的构建函数
+        """
+        version = catalog_versions.get(version_name)
+        cache_key = response_cache.make_key(
+            "catalog", f"{version_name}{version}", [key]
+        )
+        body = response_cache.get_or_set(
+            cache_key,
+            lambda: current_app.json.dumps(builder()).encode("utf-8"),
+            self.max_age,
+        )
+        return {"body": body, "version": version}
+
+
+# 全局目录响应缓存实例
+catalog_cache = CatalogCache()
+
+
+def json_body_response(entry: Dict[str, Any]) -> Response:
+    """将缓存的序列化结果包装为 JSON 响应"""
+    return Response(entry["body"], mimetype="application/json")
+
+
+def catalog_version_tag(names: Iterable[str]) -> str:
+    """相关目录版本号组成的标识，用作缓存键版本"""
+    versions = catalog_versions.snapshot()
+    return ".".join(f"{name}{versions.get(name, 0)}" for name in sorted(names))
+
+
+def cached_catalog(*names: str, ttl: float = 300.0):
+    """缓存目录接口的 JSON 响应，相关目录版本变化即失效"""
+    return cached_view(
+        "catalog", ttl, version=lambda *args, **kwargs: catalog_version_tag(names)
+    )
+
+
+def catalog_etag(names: Iterable[str], extra: Any = None) -> str:
+    """由相关目录版本号、附加标识和请求路径/参数计算 ETag"""
+    versions = catalog_versions.snapshot()
+    digest = hashlib.sha1()
+    for name in sorted(names):
+        digest.update(f"{name}={versions.get(name, 0)};".encode("utf-8"))
+    if extra is not None:
+        digest.update(f"+{extra};".encode("utf-8"))
+    digest.update(request.path.encode("utf-8"))
+    digest.update(b"?")
+    for key in sorted(request.args):
+        for value in request.args.getlist(key):
+            digest.update(f"{key}={value}&".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def conditional_catalog(
+    *names: str,
+    max_age: Optional[int] = None,
+    extra: Optional[Callable[[], Any]] = None,
+):
+    """
+    目录接口的 HTTP 条件响应装饰器
+
+    extra 返回参与 ETag 计算的附加标识（如按周期刷新的计数的周期编号）。
+
+    先用版本号计算 ETag，If-None-Match 命中时直接返回 304，不执行视图、不查询数据；
+    200 响应附带 ETag 和 Cache-Control，便于浏览器和反向代理缓存。
+    响应体随后可能按 Accept-Encoding 压缩，同一 ETag 对应多种编码的字节，
+    因此使用弱 ETag，并在 304 响应上同样声明 Vary: Accept-Encoding。
+    """
+
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            cache_seconds = (
+                max_age
+                if max_age is not None
+                else int(os.getenv("CATALOG_MAX_AGE", "60"))
+            )
+            cache_control = f"public, max-age={cache_seconds}"
+
+            etag = catalog_etag(names, extra() if extra is not None else None)
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+                response.set_etag(etag, weak=True)
+                response.headers["Cache-Control"] = cache_control
+                response.vary.add("Accept-Encoding")
+                return response
+
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag, weak=True)
+                response.headers["Cache-Control"] = cache_control
+            return response
+
+        return decorated
+
+    return decorator
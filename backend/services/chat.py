@@ -0,0 +1,344 @@
+"""
+聊天服务模块
+按消息 id 游标增量读取会话消息（after_id 向后追新、before_id 向前翻页），
+查询走 (sender_id, receiver_id, created_at) 复合索引；
+维护每对用户的会话摘要（最后一条消息、双方未读数），会话列表只需一次索引查询
+"""
+
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from models import db, ChatConversation, ChatMessage, User
+from services.chat_events import serialize_message
+from services.counters import insert_ignore
+from services.pagination import MAX_PER_PAGE
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MESSAGE_PAGE = 50
+PREVIEW_LENGTH = 200
+
+
+def conversation_condition(user_id: int, friend_id: int):
+    """两人之间双向消息的过滤条件（两个分支都能使用复合索引）"""
+    return db.or_(
+        db.and_(ChatMessage.sender_id == user_id, ChatMessage.receiver_id == friend_id),
+        db.and_(ChatMessage.sender_id == friend_id, ChatMessage.receiver_id == user_id),
+    )
+
+
+def _anchor(message_id: int):
+    """游标消息的 (created_at, id)，用于在复合索引上做 keyset 范围扫描"""
+    row = (
+        db.session.query(ChatMessage.created_at, ChatMessage.id)
+        .filter(ChatMessage.id == message_id)
+        .first()
+    )
+    return (row.created_at, row.id) if row else (None, message_id)
+
+
+def _keyset_condition(message_id: int, newer: bool):
+    created_at, row_id = _anchor(message_id)
+    if created_at is None:
+        return ChatMessage.id > row_id if newer else ChatMessage.id < row_id
+    if newer:
+        return db.or_(
+            ChatMessage.created_at > created_at,
+            db.and_(ChatMessage.created_at == created_at, ChatMessage.id > row_id),
+        )
+    return db.or_(
+        ChatMessage.created_at < created_at,
+        db.and_(ChatMessage.created_at == created_at, ChatMessage.id < row_id),
+    )
+
+
+def fetch_messages(
+    user_id: int,
+    friend_id: int,
+    after_id: Optional[int] = None,
+    before_id: Optional[int] = None,
+    per_page: int = DEFAULT_MESSAGE_PAGE,
+) -> Dict[str, Any]:
+    """
+    读取一页会话消息（按时间正序返回）
+
+    Args:
+        user_id: 当前用户
+        friend_id: 会话对方
+        after_id: 只返回该消息之后的新消息（轮询/刷新用）
+        before_id: 返回该消息之前的一页历史（向上翻页用）
+        per_page: 每页条数；都不指定游标时返回最新一页
+
+    Returns:
+        {"messages": [...], "has_more": bool}；after_id 模式下 has_more 表示还有更新的消息，
+        其它模式表示还有更早的消息
+    """
+    per_page = max(1, min(per_page or DEFAULT_MESSAGE_PAGE, MAX_PER_PAGE))
+    query = db.session.query(
+        ChatMessage.id,
+        ChatMessage.sender_id,
+        ChatMessage.receiver_id,
+        ChatMessage.content,
+        ChatMessage.message_type,
+        ChatMessage.is_read,
+        ChatMessage.created_at,
+    ).filter(conversation_condition(user_id, friend_id))
+
+    if after_id is not None:
+        rows = (
+            query.filter(_keyset_condition(after_id, newer=True))
+            .order_by(ChatMessage.created_at, ChatMessage.id)
+            .limit(per_page + 1)
+            .all()
+        )
+        has_more = len(rows) > per_page
+        rows = rows[:per_page]
+    else:
+        if before_id is not None:
+            query = query.filter(_keyset_condition(before_id, newer=False))
+        rows = (
+            query.order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc())
+            .limit(per_page + 1)
+            .all()
+        )
+        has_more = len(rows) > per_page
+        rows = list(reversed(rows[:per_page]))
+
+    return {"messages": [serialize_message(row) for row in rows], "has_more": has_more}
+
+
+def pair_key(user_a: int, user_b: int):
+    """会话摘要的规范化用户对 (较小 id, 较大 id)"""
+    return (user_a, user_b) if user_a <= user_b else (user_b, user_a)
+
+
+def _pair_condition(low: int, high: int):
+    return db.and_(
+        ChatConversation.user_low_id == low, ChatConversation.user_high_id == high
+    )
+
+
+def _unread_column(user_id: int, low: int):
+    """user_id 一方的未读数列"""
+    if user_id == low:
+        return ChatConversation.unread_low
+    return ChatConversation.unread_high
+
+
+def record_message(message: ChatMessage):
+    """
+    在发送消息的同一事务中更新会话摘要：接收方未读数 +1，最后一条消息只向前推进
+
+    message 须已 flush（有 id）。摘要行不存在时幂等插入后重试。
+    """
+    low, high = pair_key(message.sender_id, message.receiver_id)
+    unread = _unread_column(message.receiver_id, low)
+    is_newer = db.func.coalesce(ChatConversation.last_message_id, 0) < message.id
+
+    def newer_or_keep(column, value):
+        return db.case((is_newer, value), else_=column)
+
+    # last_message_id 放在最后赋值（MySQL 按顺序求值 SET，之前的条件需看到旧值）
+    stmt = (
+        db.update(ChatConversation)
+        .where(_pair_condition(low, high))
+        .ordered_values(
+            (unread, db.func.coalesce(unread, 0) + 1),
+            (
+                ChatConversation.last_sender_id,
+                newer_or_keep(ChatConversation.last_sender_id, message.sender_id),
+            ),
+            (
+                ChatConversation.last_message_preview,
+                newer_or_keep(
+                    ChatConversation.last_message_preview,
+                    (message.content or "")[:PREVIEW_LENGTH],
+                ),
+            ),
+            (
+                ChatConversation.last_message_at,
+                newer_or_keep(
+                    ChatConversation.last_message_at,
+                    message.created_at or datetime.utcnow(),
+                ),
+            ),
+            (
+                ChatConversation.last_message_id,
+                newer_or_keep(ChatConversation.last_message_id, message.id),
+            ),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    if db.session.execute(stmt).rowcount == 0:
+        insert_ignore(
+            ChatConversation,
+            user_low_id=low,
+            user_high_id=high,
+            unread_low=0,
+            unread_high=0,
+        )
+        db.session.execute(stmt)
+
+
+def mark_read(user_id: int, friend_id: int) -> bool:
+    """
+    将好友发给用户的未读消息批量标记为已读（在调用方事务中执行，由调用方提交）
+
+    先读会话摘要中用户一方的未读数，为 0 时不做任何写入；否则用一条 UPDATE
+    标记到摘要记录的最后一条消息 id（高水位）为止，并按实际标记条数扣减未读数，
+    并发到达的新消息不会被误清零。
+
+    Returns:
+        是否有写入（调用方据此决定是否提交）
+    """
+    low, high = pair_key(user_id, friend_id)
+    unread = _unread_column(user_id, low)
+    summary = (
+        db.session.query(unread, ChatConversation.last_message_id)
+        .filter(_pair_condition(low, high))
+        .first()
+    )
+    if summary is not None and not summary[0]:
+        return False
+
+    query = db.update(ChatMessage).where(
+        ChatMessage.sender_id == friend_id,
+        ChatMessage.receiver_id == user_id,
+        ChatMessage.is_read.is_(False),
+    )
+    if summary is not None and summary.last_message_id is not None:
+        query = query.where(ChatMessage.id <= summary.last_message_id)
+    marked = db.session.execute(
+        query.values(is_read=True).execution_options(synchronize_session=False)
+    ).rowcount
+    if summary is not None:
+        db.session.execute(
+            db.update(ChatConversation)
+            .where(_pair_condition(low, high))
+            .values({unread: db.case((unread > marked, unread - marked), else_=0)})
+            .execution_options(synchronize_session=False)
+        )
+    return bool(marked) or summary is not None
+
+
+def list_conversations(
+    user_id: int, limit: int = MAX_PER_PAGE
+) -> List[Dict[str, Any]]:
+    """
+    用户的会话列表（按最后消息时间倒序），一次查询连同对方的基本信息一起取出
+    """
+    is_low = ChatConversation.user_low_id == user_id
+    peer_id = db.case(
+        (is_low, ChatConversation.user_high_id), else_=ChatConversation.user_low_id
+    )
+    unread = db.case(
+        (is_low, ChatConversation.unread_low), else_=ChatConversation.unread_high
+    )
+    rows = (
+        db.session.query(
+            ChatConversation.last_message_id,
+            ChatConversation.last_sender_id,
+            ChatConversation.last_message_preview,
+            ChatConversation.last_message_at,
+            unread.label("unread_count"),
+            User.id.label("peer_id"),
+            User.username,
+            User.role,
+        )
+        .join(User, User.id == peer_id)
+        .filter(
+            db.or_(
+                ChatConversation.user_low_id == user_id,
+                ChatConversation.user_high_id == user_id,
+            )
+        )
+        .order_by(ChatConversation.last_message_at.desc())
+        .limit(max(1, min(limit or MAX_PER_PAGE, MAX_PER_PAGE)))
+        .all()
+    )
+
+    conversations = []
+    for row in rows:
+        latest = None
+        if row.last_message_id is not None:
+            latest = {
+                "id": row.last_message_id,
+                "sender_id": row.last_sender_id,
+                "content": row.last_message_preview,
+                "created_at": (
+                    row.last_message_at.isoformat() + "Z"
+                    if row.last_message_at
+                    else None
+                ),
+            }
+        conversations.append(
+            {
+                "friend": {
+                    "id": row.peer_id,
+                    "username": row.username,
+                    "role": row.role,
+                },
+                "latest_message": latest,
+                "unread_count": row.unread_count or 0,
+            }
+        )
+    return conversations
+
+
+def backfill_conversations() -> int:
+    """
+    从已有消息生成会话摘要（仅在摘要表为空且存在消息时执行，用于升级后的首次启动）
+
+    Returns:
+        生成的会话数量
+    """
+    if db.session.query(ChatConversation.id).first() is not None:
+        return 0
+    if db.session.query(ChatMessage.id).first() is None:
+        return 0
+
+    grouped = db.session.query(
+        ChatMessage.sender_id,
+        ChatMessage.receiver_id,
+        db.func.max(ChatMessage.id),
+        db.func.sum(db.case((ChatMessage.is_read.is_(False), 1), else_=0)),
+    ).group_by(ChatMessage.sender_id, ChatMessage.receiver_id)
+
+    pairs: Dict[tuple, Dict[str, int]] = {}
+    for sender_id, receiver_id, last_id, unread in grouped:
+        low, high = pair_key(sender_id, receiver_id)
+        pair = pairs.setdefault(
+            (low, high), {"last_id": 0, "unread_low": 0, "unread_high": 0}
+        )
+        pair["last_id"] = max(pair["last_id"], last_id)
+        side = "unread_low" if receiver_id == low else "unread_high"
+        pair[side] += int(unread or 0)
+
+    last_ids = [pair["last_id"] for pair in pairs.values()]
+    last_messages = {
+        msg.id: msg
+        for msg in db.session.query(
+            ChatMessage.id,
+            ChatMessage.sender_id,
+            ChatMessage.content,
+            ChatMessage.created_at,
+        ).filter(ChatMessage.id.in_(last_ids))
+    }
+    for (low, high), pair in pairs.items():
+        last = last_messages[pair["last_id"]]
+        db.session.add(
+            ChatConversation(
+                user_low_id=low,
+                user_high_id=high,
+                last_message_id=last.id,
+                last_sender_id=last.sender_id,
+                last_message_preview=(last.content or "")[:PREVIEW_LENGTH],
+                last_message_at=last.created_at,
+                unread_low=pair["unread_low"],
+                unread_high=pair["unread_high"],
+            )
+        )
+    db.session.commit()
+    logger.info(f"Backfilled {len(pairs)} chat conversation summaries")
+    return len(pairs)
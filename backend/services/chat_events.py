@@ -0,0 +1,251 @@
+"""
+聊天事件服务模块
+进程内的发布/订阅：发送消息时直接推送给本进程的订阅者；其它 worker 写入的消息
+由每个进程一个的中继线程按消息 id 增量读取后分发（并回看水位线之前的一段 id，
+补上晚提交的消息）。没有订阅者时不产生任何查询
+"""
+
+import logging
+import os
+import queue
+import threading
+from collections import defaultdict, deque
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from models import db, ChatMessage
+
+logger = logging.getLogger(__name__)
+
+_MESSAGE_COLUMNS = (
+    ChatMessage.id,
+    ChatMessage.sender_id,
+    ChatMessage.receiver_id,
+    ChatMessage.content,
+    ChatMessage.message_type,
+    ChatMessage.is_read,
+    ChatMessage.created_at,
+)
+
+
+def serialize_message(message) -> Dict[str, Any]:
+    """紧凑的消息序列化（不内嵌发送者/接收者用户对象）"""
+    return {
+        "id": message.id,
+        "sender_id": message.sender_id,
+        "receiver_id": message.receiver_id,
+        "content": message.content,
+        "message_type": message.message_type,
+        "is_read": bool(message.is_read),
+        "created_at": (
+            message.created_at.isoformat() + "Z" if message.created_at else None
+        ),
+    }
+
+
+class Subscription:
+    """单个推送连接的事件队列"""
+
+    def __init__(self, user_id: int, max_pending: int = 256):
+        self.user_id = user_id
+        self.queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=max_pending)
+        self._seen = deque(maxlen=max_pending)
+        self._seen_ids = set()
+        self._lock = threading.Lock()
+
+    def offer(self, event: Dict[str, Any]):
+        """投递事件；同一条消息（本地推送与中继）只投递一次，队列满时丢弃"""
+        message_id = event.get("id")
+        with self._lock:
+            if message_id is not None:
+                if message_id in self._seen_ids:
+                    return
+                if len(self._seen) == self._seen.maxlen:
+                    self._seen_ids.discard(self._seen[0])
+                self._seen.append(message_id)
+                self._seen_ids.add(message_id)
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            logger.warning(f"Chat stream queue full for user {self.user_id}")
+
+    def get(self, timeout: float) -> Optional[Dict[str, Any]]:
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class ChatBroker:
+    """聊天消息的进程内发布/订阅"""
+
+    def __init__(
+        self,
+        relay_interval: float = 1.0,
+        max_subscriptions: Optional[int] = None,
+        relay_lookback: int = 200,
+    ):
+        """
+        初始化
+
+        Args:
+            relay_interval: 中继线程读取其它 worker 新消息的间隔（秒）
+            max_subscriptions: 本进程允许的最大推送连接数；未指定时为 worker
+                线程数（THREADS）的一半
+            relay_lookback: 每次中继回看水位线之前的消息 id 数
+        """
+        self.relay_interval = relay_interval
+        self.max_subscriptions = max_subscriptions
+        self.relay_lookback = relay_lookback
+        self._subscriptions: Dict[int, List[Subscription]] = defaultdict(list)
+        self._count = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._app = None
+        self._last_id: Optional[int] = None
+        # 回看窗口内已分发过的消息 id
+        self._relayed: Set[int] = set()
+
+    def init_app(self, app):
+        """绑定 Flask 应用（中继线程在第一个订阅出现时启动）"""
+        self._app = app
+        self.relay_interval = float(
+            os.getenv("CHAT_RELAY_INTERVAL", self.relay_interval)
+        )
+        self.relay_lookback = int(
+            os.getenv("CHAT_RELAY_LOOKBACK", self.relay_lookback)
+        )
+        # 每个推送连接占用一个 worker 线程，上限须低于线程数，给普通请求留出线程
+        if self.max_subscriptions is None:
+            threads = int(os.getenv("THREADS", "16"))
+            self.max_subscriptions = max(1, threads // 2)
+        self.max_subscriptions = int(
+            os.getenv("CHAT_STREAM_MAX_CONNECTIONS", self.max_subscriptions)
+        )
+
+    def subscribe(self, user_id: int) -> Optional[Subscription]:
+        """订阅用户的消息事件；超过连接上限时返回 None"""
+        with self._lock:
+            if self._count >= self.max_subscriptions:
+                return None
+            subscription = Subscription(user_id)
+            self._subscriptions[user_id].append(subscription)
+            self._count += 1
+            self._ensure_relay()
+        self._wakeup.set()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subs = self._subscriptions.get(subscription.user_id, [])
+            if subscription in subs:
+                subs.remove(subscription)
+                self._count -= 1
+            if not subs:
+                self._subscriptions.pop(subscription.user_id, None)
+
+    def has_subscribers(self) -> bool:
+        return self._count > 0
+
+    def publish(self, message: Dict[str, Any]):
+        """将已序列化的消息推送给本进程中发送方和接收方的订阅"""
+        self._dispatch([message])
+
+    def _dispatch(self, messages: Iterable[Dict[str, Any]]):
+        with self._lock:
+            targets = {
+                user_id: list(subs) for user_id, subs in self._subscriptions.items()
+            }
+        for message in messages:
+            for user_id in {message["sender_id"], message["receiver_id"]}:
+                for subscription in targets.get(user_id, []):
+                    subscription.offer(message)
+
+    def _ensure_relay(self):
+        if self._thread is None and self._app is not None:
+            self._thread = threading.Thread(
+                target=self._run, name="chat-relay", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            if not self.has_subscribers():
+                # 空闲时不查询数据库，等待新的订阅
+                self._last_id = None
+                self._relayed.clear()
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            self.relay_once()
+            self._stop.wait(self.relay_interval)
+
+    def relay_once(self):
+        """
+        读取新消息并分发给本进程的订阅者
+
+        多个 worker 并发提交时消息 id 的可见顺序可能与 id 顺序不同：id 较小的消息
+        可能在水位线越过它之后才提交。因此每次从水位线之前 relay_lookback 个 id
+        开始读取，只分发窗口内尚未分发过的消息。
+        """
+        with self._app.app_context():
+            try:
+                if self._last_id is None:
+                    self._last_id = (
+                        db.session.query(db.func.max(ChatMessage.id)).scalar() or 0
+                    )
+                    # 订阅开始前已可见的消息不再推送
+                    self._relayed = {
+                        message_id
+                        for (message_id,) in db.session.query(ChatMessage.id).filter(
+                            ChatMessage.id > self._last_id - self.relay_lookback
+                        )
+                    }
+                    return
+                rows = (
+                    db.session.query(*_MESSAGE_COLUMNS)
+                    .filter(ChatMessage.id > self._last_id - self.relay_lookback)
+                    .order_by(ChatMessage.id)
+                    .limit(self.relay_lookback + 500)
+                    .all()
+                )
+                fresh = [row for row in rows if row.id not in self._relayed]
+                if rows:
+                    self._last_id = max(self._last_id, rows[-1].id)
+                floor = self._last_id - self.relay_lookback
+                self._relayed = {
+                    message_id for message_id in self._relayed if message_id > floor
+                }
+                self._relayed.update(row.id for row in fresh)
+                if fresh:
+                    self._dispatch(serialize_message(row) for row in fresh)
+            except Exception as e:
+                logger.error(f"Chat relay failed: {e}")
+            finally:
+                db.session.remove()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+
+# 全局聊天事件实例
+chat_broker = ChatBroker()
+
+
+def messages_since(user_id: int, last_id: int, limit: int = 200):
+    """断线重连时补发用户在 last_id 之后收发的消息"""
+    rows = (
+        db.session.query(*_MESSAGE_COLUMNS)
+        .filter(
+            ChatMessage.id > last_id,
+            db.or_(
+                ChatMessage.receiver_id == user_id, ChatMessage.sender_id == user_id
+            ),
+        )
+        .order_by(ChatMessage.id)
+        .limit(limit)
+        .all()
+    )
+    return [serialize_message(row) for row in rows]
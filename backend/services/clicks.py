@@ -0,0 +1,155 @@
+"""
+算法点击记录服务模块
+点击写入为一条 INSERT ... SELECT ... ON DUPLICATE KEY UPDATE（SQLite 为 ON CONFLICT DO UPDATE），
+依赖 unique_user_algorithm 唯一约束，同时校验算法存在；可选在进程内缓冲后批量写入
+"""
+
+import atexit
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, Tuple
+
+from sqlalchemy.dialects import mysql, sqlite
+
+from models import db, Algorithm, UserKnowledge
+from services.cache import invalidate_user_cache
+
+logger = logging.getLogger(__name__)
+
+
+def _click_upsert(dialect_name: str, user_id: int, algorithm_id: int, at: datetime):
+    """构造单次点击的 upsert 语句（算法不存在时不插入任何行）"""
+    columns = ["user_id", "algorithm_id", "progress", "last_accessed", "created_at"]
+    select = db.select(
+        db.literal(user_id),
+        Algorithm.id,
+        db.literal(0.0),
+        db.literal(at),
+        db.literal(at),
+    ).where(Algorithm.id == algorithm_id)
+    # 点击记录不设置进度，已有记录只刷新最后访问时间
+    if dialect_name == "mysql":
+        stmt = mysql.insert(UserKnowledge).from_select(columns, select)
+        return stmt.on_duplicate_key_update(
+            last_accessed=stmt.inserted.last_accessed,
+            updated_at=stmt.inserted.last_accessed,
+        )
+    stmt = sqlite.insert(UserKnowledge).from_select(columns, select)
+    return stmt.on_conflict_do_update(
+        index_elements=["user_id", "algorithm_id"],
+        set_={
+            "last_accessed": stmt.excluded.last_accessed,
+            "updated_at": stmt.excluded.last_accessed,
+        },
+    )
+
+
+def record_click(user_id: int, algorithm_id: int, at: datetime = None) -> bool:
+    """
+    在当前事务中记录一次点击（由调用方提交）
+
+    Returns:
+        算法是否存在（是否写入了记录）
+    """
+    dialect_name = db.session.get_bind().dialect.name
+    stmt = _click_upsert(dialect_name, user_id, algorithm_id, at or datetime.utcnow())
+    return db.session.execute(stmt).rowcount > 0
+
+
+class ClickBuffer:
+    """点击记录写回缓冲：同一用户-算法在一个周期内只保留最后一次点击时间"""
+
+    def __init__(self, flush_interval: float = 2.0):
+        """
+        初始化缓冲区
+
+        Args:
+            flush_interval: 后台批量写回的间隔（秒）
+        """
+        self.flush_interval = flush_interval
+        self.enabled = False
+        self._pending: Dict[Tuple[int, int], datetime] = {}
+        self._lock = threading.Lock()
+        # 串行化写回，避免定时线程与退出时的写回交错
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._app = None
+
+    def init_app(self, app):
+        """绑定 Flask 应用；CLICK_BUFFER_ENABLED=true 时启动后台写回线程"""
+        self._app = app
+        self.enabled = os.getenv("CLICK_BUFFER_ENABLED", "false").lower() == "true"
+        self.flush_interval = float(
+            os.getenv("CLICK_FLUSH_INTERVAL", self.flush_interval)
+        )
+        if self.enabled and self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="click-flush", daemon=True
+            )
+            self._thread.start()
+            # 正常退出时写回剩余点击，保证不丢失
+            atexit.register(self.shutdown)
+
+    def add(self, user_id: int, algorithm_id: int):
+        with self._lock:
+            self._pending[(user_id, algorithm_id)] = datetime.utcnow()
+
+    def _write(self, batch: Iterable[Tuple[Tuple[int, int], datetime]]):
+        with db.engine.begin() as conn:
+            for (user_id, algorithm_id), at in batch:
+                conn.execute(
+                    _click_upsert(conn.dialect.name, user_id, algorithm_id, at)
+                )
+
+    def flush(self) -> int:
+        """
+        将缓冲的点击批量写回数据库（一个事务）
+
+        Returns:
+            本次写回的用户-算法对数量
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+            try:
+                self._write(batch.items())
+            except Exception as e:
+                # 写回失败时放回缓冲区（保留较新的点击时间），下次重试
+                logger.error(f"Failed to flush algorithm clicks: {e}")
+                with self._lock:
+                    for key, at in batch.items():
+                        if key not in self._pending or self._pending[key] < at:
+                            self._pending[key] = at
+                return 0
+            invalidate_user_cache(*{user_id for user_id, _ in batch})
+            return len(batch)
+
+    def _flush_with_context(self):
+        if self._app is None:
+            return self.flush()
+        with self._app.app_context():
+            return self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self._flush_with_context()
+            except Exception as e:
+                logger.error(f"Click flush loop error: {e}")
+
+    def shutdown(self):
+        """停止后台线程并写回剩余点击"""
+        self._stop.set()
+        try:
+            self._flush_with_context()
+        except Exception as e:
+            logger.error(f"Final click flush failed: {e}")
+
+
+# 全局点击缓冲实例
+click_buffer = ClickBuffer()
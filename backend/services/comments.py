@@ -0,0 +1,319 @@
+"""
+评论树服务模块
+一次查询取出帖子的全部评论列，按 parent_id 分组线性组装评论树；作者批量加载，
+顶层评论串支持游标分页，超过深度限制的回复链按需展开。
+子树的查询、计数和删除基于物化路径（comments.path 前缀匹配），各只需一条索引查询
+"""
+
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+import logging
+
+from sqlalchemy.orm.attributes import set_committed_value
+
+from models import db, Comment, Post, User, comment_path_segment
+from services.counters import adjust_post_counter
+from services.pagination import MAX_PER_PAGE, decode_cursor, encode_cursor
+
+logger = logging.getLogger(__name__)
+
+# 默认展开的回复层数（顶层评论为第 1 层），更深的回复通过 /comments/<id>/replies 展开
+DEFAULT_REPLY_DEPTH = 3
+MAX_REPLY_DEPTH = 20
+
+_COMMENT_COLUMNS = (
+    Comment.id,
+    Comment.content,
+    Comment.post_id,
+    Comment.author_id,
+    Comment.parent_id,
+    Comment.created_at,
+    Comment.updated_at,
+)
+
+
+def load_post_comments(post_id: int) -> List[Any]:
+    """一次查询取出帖子全部评论（只取列，不构造 ORM 对象、不触发懒加载）"""
+    return (
+        db.session.query(*_COMMENT_COLUMNS)
+        .filter(Comment.post_id == post_id)
+        .order_by(Comment.created_at, Comment.id)
+        .all()
+    )
+
+
+def ensure_comment_path(comment) -> str:
+    """
+    返回评论的物化路径；启动回填遗漏的评论（path 为空）按需补算
+
+    补算整个帖子中缺少路径的评论（子孙与其一同缺失），在调用方的事务中写入。
+    """
+    if comment.path is None:
+        rows = (
+            db.session.query(Comment.id, Comment.parent_id, Comment.path)
+            .filter(Comment.post_id == comment.post_id)
+            .all()
+        )
+        paths = _write_paths(_resolve_paths(rows))
+        set_committed_value(comment, "path", paths[comment.id])
+    return comment.path
+
+
+def subtree_condition(comment):
+    """评论自身及其全部子孙的过滤条件（path 前缀匹配，走 path 索引）"""
+    return Comment.path.like(ensure_comment_path(comment) + "%")
+
+
+def load_subtree(comment) -> List[Any]:
+    """一次查询取出评论自身及其全部子孙"""
+    return (
+        db.session.query(*_COMMENT_COLUMNS)
+        .filter(subtree_condition(comment))
+        .order_by(Comment.created_at, Comment.id)
+        .all()
+    )
+
+
+def count_subtree(comment) -> int:
+    """评论自身及其全部子孙的数量"""
+    return (
+        db.session.query(db.func.count(Comment.id))
+        .filter(subtree_condition(comment))
+        .scalar()
+    )
+
+
+def delete_subtree(comment) -> Dict[str, Any]:
+    """
+    删除评论及其全部子孙，并在同一事务中原子地扣减帖子评论数
+
+    在调用方的事务中执行，由调用方提交。
+
+    Returns:
+        {"deleted": 删除的评论数, "author_ids": 涉及的作者 id 列表}
+    """
+    author_ids = [
+        author_id
+        for (author_id,) in db.session.query(Comment.author_id)
+        .filter(subtree_condition(comment))
+        .distinct()
+    ]
+
+    if db.session.get_bind().dialect.name == "mysql":
+        # 子孙的 path 更长，倒序删除保证先删子评论，满足自引用外键
+        result = db.session.execute(
+            db.text("DELETE FROM comments WHERE path LIKE :prefix ORDER BY path DESC"),
+            {"prefix": ensure_comment_path(comment) + "%"},
+        )
+    else:
+        result = db.session.execute(
+            db.delete(Comment)
+            .where(subtree_condition(comment))
+            .execution_options(synchronize_session=False)
+        )
+    deleted = result.rowcount
+    if deleted:
+        adjust_post_counter(comment.post_id, Post.comment_count, -deleted)
+    db.session.expunge(comment)
+    return {"deleted": deleted, "author_ids": author_ids}
+
+
+def _resolve_paths(rows) -> Dict[int, str]:
+    """由 (id, parent_id, path) 行计算缺少路径的评论的 path"""
+    parents = {row.id: row.parent_id for row in rows}
+    paths = {row.id: row.path for row in rows if row.path}
+
+    def resolve(comment_id):
+        chain = []
+        node = comment_id
+        while node is not None and node not in paths:
+            chain.append(node)
+            node = parents.get(node)
+            if len(chain) > len(parents):
+                break  # 数据中存在环，按根评论处理
+        prefix = paths.get(node, "") if node is not None else ""
+        for item in reversed(chain):
+            prefix += comment_path_segment(item)
+            paths[item] = prefix
+        return paths[comment_id]
+
+    return {row.id: resolve(row.id) for row in rows if not row.path}
+
+
+def _write_paths(paths: Dict[int, str]) -> Dict[int, str]:
+    if paths:
+        db.session.execute(
+            db.text("UPDATE comments SET path = :path WHERE id = :comment_id"),
+            [
+                {"comment_id": comment_id, "path": path}
+                for comment_id, path in paths.items()
+            ],
+        )
+    return paths
+
+
+def backfill_comment_paths() -> int:
+    """
+    为缺少物化路径的旧评论补算 path（启动时调用，已全部补齐时只需一次查询）
+
+    Returns:
+        补算的评论数量
+    """
+    if db.session.query(Comment.id).filter(Comment.path.is_(None)).first() is None:
+        return 0
+
+    rows = db.session.query(Comment.id, Comment.parent_id, Comment.path).all()
+    updates = _write_paths(_resolve_paths(rows))
+    db.session.commit()
+    logger.info(f"Backfilled materialized paths for {len(updates)} comments")
+    return len(updates)
+
+
+def load_authors(author_ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+    """批量加载评论作者，每个作者只查询和序列化一次"""
+    ids = {author_id for author_id in author_ids if author_id is not None}
+    if not ids:
+        return {}
+    return {user.id: user.to_dict() for user in User.query.filter(User.id.in_(ids))}
+
+
+class CommentTree:
+    """由评论行构建的父子索引，组装和计数均为线性时间"""
+
+    def __init__(self, rows: List[Any]):
+        self.rows = {row.id: row for row in rows}
+        self.children: Dict[Optional[int], List[Any]] = defaultdict(list)
+        for row in rows:
+            self.children[row.parent_id].append(row)
+        self._sizes: Dict[int, int] = {}
+
+    @property
+    def roots(self) -> List[Any]:
+        return self.children.get(None, [])
+
+    def descendant_count(self, comment_id: int) -> int:
+        """子孙评论数量（迭代后序计算并缓存，避免深链递归）"""
+        if comment_id in self._sizes:
+            return self._sizes[comment_id]
+        stack = [(comment_id, False)]
+        while stack:
+            node_id, visited = stack.pop()
+            if node_id in self._sizes:
+                continue
+            kids = self.children.get(node_id, [])
+            if visited:
+                self._sizes[node_id] = sum(1 + self._sizes[k.id] for k in kids)
+            else:
+                stack.append((node_id, True))
+                stack.extend((k.id, False) for k in kids)
+        return self._sizes[comment_id]
+
+    def collect_author_ids(self, roots: List[Any], depth: int) -> set:
+        ids = set()
+        level = list(roots)
+        for _ in range(depth):
+            if not level:
+                break
+            ids.update(row.author_id for row in level)
+            level = [kid for row in level for kid in self.children.get(row.id, [])]
+        return ids
+
+    def serialize(
+        self, roots: List[Any], depth: int, authors: Dict[int, Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        """
+        序列化评论串（与 Comment.to_dict 字段一致）
+
+        depth 层以内的回复放在 replies 中；更深的回复不展开，
+        以 reply_count 和 has_more_replies 提示客户端按需加载。
+        """
+        result: List[Dict[str, Any]] = []
+        stack = [(row, 1, result) for row in reversed(roots)]
+        while stack:
+            row, level, siblings = stack.pop()
+            kids = self.children.get(row.id, [])
+            item = {
+                "id": row.id,
+                "content": row.content,
+                "post_id": row.post_id,
+                "author": authors.get(row.author_id),
+                "parent_id": row.parent_id,
+                "created_at": row.created_at.isoformat() if row.created_at else None,
+                "updated_at": row.updated_at.isoformat() if row.updated_at else None,
+                "replies": [],
+                "reply_count": self.descendant_count(row.id),
+                "has_more_replies": bool(kids) and level >= depth,
+            }
+            siblings.append(item)
+            if level < depth:
+                replies = item["replies"]
+                stack.extend((kid, level + 1, replies) for kid in reversed(kids))
+        return result
+
+
+def _thread_key(row):
+    return (row.created_at or datetime.min, row.id)
+
+
+def get_comment_threads(
+    post_id: int,
+    cursor: Optional[str] = None,
+    per_page: Optional[int] = None,
+    depth: int = DEFAULT_REPLY_DEPTH,
+) -> Dict[str, Any]:
+    """
+    返回帖子的评论树
+
+    Args:
+        post_id: 帖子 id
+        cursor: 上一页返回的 next_cursor（按顶层评论分页）
+        per_page: 每页顶层评论数，为空时返回全部评论串
+        depth: 展开的回复层数
+
+    Returns:
+        {"comments", "total", "total_threads", "next_cursor", "has_more"}
+
+    Raises:
+        ValueError: 游标无效
+    """
+    depth = max(1, min(depth or DEFAULT_REPLY_DEPTH, MAX_REPLY_DEPTH))
+    tree = CommentTree(load_post_comments(post_id))
+    roots = tree.roots
+
+    if cursor:
+        value, row_id = decode_cursor(cursor, "created_at")
+        after = (value or datetime.min, row_id)
+        roots = [row for row in roots if _thread_key(row) > after]
+
+    has_more = False
+    if per_page:
+        per_page = max(1, min(per_page, MAX_PER_PAGE))
+        has_more = len(roots) > per_page
+        roots = roots[:per_page]
+
+    next_cursor = None
+    if has_more:
+        last = roots[-1]
+        next_cursor = encode_cursor("created_at", last.created_at, last.id)
+
+    authors = load_authors(tree.collect_author_ids(roots, depth))
+    return {
+        "comments": tree.serialize(roots, depth, authors),
+        "total": len(tree.rows),
+        "total_threads": len(tree.roots),
+        "next_cursor": next_cursor,
+        "has_more": has_more,
+    }
+
+
+def get_comment_replies(
+    comment: Comment, depth: int = DEFAULT_REPLY_DEPTH
+) -> List[Dict[str, Any]]:
+    """展开某条评论下的回复（用于深层回复链的按需加载）"""
+    depth = max(1, min(depth or DEFAULT_REPLY_DEPTH, MAX_REPLY_DEPTH))
+    tree = CommentTree(load_subtree(comment))
+    kids = tree.children.get(comment.id, [])
+    authors = load_authors(tree.collect_author_ids(kids, depth))
+    return tree.serialize(kids, depth, authors)
@@ -0,0 +1,122 @@
+"""
+响应压缩服务模块
+按 Accept-Encoding 协商 brotli / gzip，对超过阈值的文本类响应压缩；流式响应逐块压缩
+"""
+
+import gzip
+import logging
+import os
+import zlib
+from typing import Iterable, Iterator, Optional
+
+from flask import request
+
+try:
+    import brotli
+except Exception:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE_MIMETYPES = {
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+}
+
+
+class ResponseCompressor:
+    """Flask 响应压缩（after_request 钩子）"""
+
+    def __init__(self, min_size: int = 1024, gzip_level: int = 5, brotli_quality=4):
+        """
+        初始化压缩器
+
+        Args:
+            min_size: 小于该字节数的响应不压缩
+            gzip_level: gzip 压缩级别
+            brotli_quality: brotli 压缩质量
+        """
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    def init_app(self, app):
+        """注册 after_request 钩子"""
+        self.min_size = int(os.getenv("COMPRESS_MIN_SIZE", self.min_size))
+        self.gzip_level = int(os.getenv("COMPRESS_GZIP_LEVEL", self.gzip_level))
+        if os.getenv("COMPRESS_RESPONSES", "true").lower() == "true":
+            app.after_request(self.compress_response)
+
+    def available_encodings(self):
+        return ["br", "gzip"] if brotli is not None else ["gzip"]
+
+    def negotiate(self) -> Optional[str]:
+        """按客户端的 Accept-Encoding 选择编码"""
+        encoding = request.accept_encodings.best_match(self.available_encodings())
+        return encoding if encoding in ("br", "gzip") else None
+
+    @staticmethod
+    def is_compressible(response) -> bool:
+        mimetype = response.mimetype or ""
+        if mimetype == "text/event-stream":
+            # 推送流需要逐条立即送达，压缩器的缓冲会延迟事件
+            return False
+        return mimetype.startswith("text/") or mimetype in COMPRESSIBLE_MIMETYPES
+
+    def compress_response(self, response):
+        if (
+            response.status_code < 200
+            or response.status_code in (204, 206, 304)
+            or response.direct_passthrough
+            or "Content-Encoding" in response.headers
+            or not self.is_compressible(response)
+        ):
+            return response
+
+        streamed = response.is_streamed
+        if not streamed and (response.content_length or 0) < self.min_size:
+            return response
+
+        response.vary.add("Accept-Encoding")
+        encoding = self.negotiate()
+        if encoding is None:
+            return response
+
+        if streamed:
+            response.response = self._compress_stream(response.response, encoding)
+            response.headers.pop("Content-Length", None)
+        else:
+            response.set_data(self._compress(response.get_data(), encoding))
+        response.headers["Content-Encoding"] = encoding
+        return response
+
+    def _compress(self, data: bytes, encoding: str) -> bytes:
+        if encoding == "br":
+            return brotli.compress(data, quality=self.brotli_quality)
+        return gzip.compress(data, compresslevel=self.gzip_level)
+
+    def _compress_stream(self, chunks: Iterable, encoding: str) -> Iterator[bytes]:
+        if encoding == "br":
+            compressor = brotli.Compressor(quality=self.brotli_quality)
+            compress, finish = compressor.process, compressor.finish
+        else:
+            compressor = zlib.compressobj(self.gzip_level, zlib.DEFLATED, 31)
+            compress, finish = compressor.compress, compressor.flush
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode("utf-8")
+                data = compress(chunk)
+                if data:
+                    yield data
+            yield finish()
+        finally:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+
+
+# 全局响应压缩器实例
+response_compressor = ResponseCompressor()
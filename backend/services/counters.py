@@ -0,0 +1,151 @@
+"""
+计数器服务模块
+提供原子化的反规范化计数器更新、幂等的 insert-or-ignore 写入，以及修复计数漂移的定期重算任务
+"""
+
+import logging
+import os
+import threading
+
+from models import db, Post
+from services.catalog import catalog_versions
+from services.locks import LeaderElection
+
+logger = logging.getLogger(__name__)
+
+
+def insert_ignore(model, **values) -> bool:
+    """
+    幂等插入：违反唯一约束时忽略而不是抛错
+
+    MySQL 使用 INSERT IGNORE，SQLite 使用 INSERT OR IGNORE。
+
+    Returns:
+        是否真正插入了新行
+    """
+    dialect = db.session.get_bind().dialect.name
+    stmt = db.insert(model).values(**values)
+    if dialect == "mysql":
+        stmt = stmt.prefix_with("IGNORE")
+    elif dialect == "sqlite":
+        stmt = stmt.prefix_with("OR IGNORE")
+    result = db.session.execute(stmt)
+    return result.rowcount > 0
+
+
+def adjust_post_counter(post_id: int, column, delta: int) -> bool:
+    """
+    在当前事务中原子地调整帖子计数列（column = column + delta）
+
+    Returns:
+        帖子是否存在（是否更新到了行）
+    """
+    result = db.session.execute(
+        db.update(Post)
+        .where(Post.id == post_id)
+        .values({column: db.func.coalesce(column, 0) + delta})
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount > 0
+
+
+def recount_post_counters() -> int:
+    """
+    按明细表重算帖子的点赞数和评论数，修复计数漂移
+
+    Returns:
+        被修正的帖子数量
+    """
+    like_total = "(SELECT COUNT(*) FROM likes WHERE likes.post_id = posts.id)"
+    comment_total = "(SELECT COUNT(*) FROM comments WHERE comments.post_id = posts.id)"
+    result = db.session.execute(
+        db.text(
+            f"UPDATE posts SET like_count = {like_total}, "
+            f"comment_count = {comment_total} "
+            f"WHERE COALESCE(like_count, -1) <> {like_total} "
+            f"OR COALESCE(comment_count, -1) <> {comment_total}"
+        )
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def recount_tag_counts() -> int:
+    """
+    按 post_tags 重算标签的帖子数，修复计数漂移
+
+    Returns:
+        被修正的标签数量
+    """
+    tag_total = "(SELECT COUNT(*) FROM post_tags WHERE post_tags.tag_id = tags.id)"
+    result = db.session.execute(
+        db.text(
+            f"UPDATE tags SET post_count = {tag_total} "
+            f"WHERE COALESCE(post_count, -1) <> {tag_total}"
+        )
+    )
+    if result.rowcount:
+        catalog_versions.bump(db.session, ["tags"])
+    db.session.commit()
+    return result.rowcount
+
+
+class CounterReconciler:
+    """定期重算计数器的后台任务"""
+
+    def __init__(self, interval: float = 3600.0):
+        """
+        初始化重算任务
+
+        Args:
+            interval: 重算间隔（秒）
+        """
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._app = None
+        self._leader = LeaderElection("counter_recount")
+
+    def init_app(self, app):
+        """绑定 Flask 应用并启动后台线程"""
+        self._app = app
+        self.interval = float(os.getenv("COUNTER_RECOUNT_INTERVAL", self.interval))
+        if self._thread is None and self.interval > 0:
+            self._thread = threading.Thread(
+                target=self._run, name="counter-reconciler", daemon=True
+            )
+            self._thread.start()
+
+    def run_once(self) -> int:
+        """
+        执行一次重算（只在被选为执行者的 worker 中执行，避免各 worker 同时全表重算）
+
+        Returns:
+            修复的计数数量
+        """
+        with self._app.app_context():
+            try:
+                if not self._leader.is_leader():
+                    return 0
+                fixed = recount_post_counters() + recount_tag_counts()
+                if fixed:
+                    logger.info(f"Repaired {fixed} drifted counters")
+                return fixed
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Counter recount failed: {e}")
+                return 0
+            finally:
+                db.session.remove()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+    def stop(self):
+        self._stop.set()
+        self._leader.release()
+
+
+# 全局计数重算任务实例
+counter_reconciler = CounterReconciler()
@@ -0,0 +1,323 @@
+"""
+好友关系服务模块
+通过规范化用户对 (user_low_id, user_high_id) 的唯一索引查找两人之间的关系，
+并在进程内缓存查找结果（包括"没有关系"），聊天收发和轮询的好友检查多数直接命中缓存。
+关系变更后由调用方失效缓存；其它 worker 的缓存最多在 TTL 内过期
+"""
+
+import logging
+import os
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+
+from models import db, Friend, User
+from services.cache import LocalLRUBackend
+from services.chat import pair_key
+
+logger = logging.getLogger(__name__)
+
+
+class FriendLink(NamedTuple):
+    """两人之间的好友关系（user_id 为发起方）"""
+
+    id: int
+    user_id: int
+    friend_id: int
+    status: str
+
+
+def pair_condition(user_a: int, user_b: int):
+    """两人之间好友关系的过滤条件（走 ux_friends_pair 唯一索引）"""
+    low, high = pair_key(user_a, user_b)
+    return db.and_(Friend.user_low_id == low, Friend.user_high_id == high)
+
+
+def _load_link(user_a: int, user_b: int) -> Optional[FriendLink]:
+    row = (
+        db.session.query(Friend.id, Friend.user_id, Friend.friend_id, Friend.status)
+        .filter(pair_condition(user_a, user_b))
+        .first()
+    )
+    return FriendLink(*row) if row else None
+
+
+class FriendshipCache:
+    """好友关系的进程内缓存（按规范化用户对缓存）"""
+
+    # 缓存"没有关系"的占位值
+    _NONE = ()
+
+    def __init__(self, ttl: float = 30.0, max_entries: int = 4096):
+        """
+        初始化
+
+        Args:
+            ttl: 缓存有效期（秒），决定其它 worker 上关系变更的最长可见延迟
+            max_entries: 最多缓存的用户对数量
+        """
+        self.ttl = ttl
+        # 进程内存储，值直接保存元组而不序列化
+        self._store = LocalLRUBackend(max_entries=max_entries)
+
+    def init_app(self, app):
+        self.ttl = float(os.getenv("FRIENDSHIP_CACHE_TTL", self.ttl))
+
+    @staticmethod
+    def _key(user_a: int, user_b: int) -> str:
+        low, high = pair_key(user_a, user_b)
+        return f"{low}:{high}"
+
+    def get(self, user_a: int, user_b: int) -> Optional[FriendLink]:
+        """返回两人之间的关系；未缓存时查询一次唯一索引并缓存结果"""
+        key = self._key(user_a, user_b)
+        cached = self._store.get(key)
+        if cached is not None:
+            return FriendLink(*cached) if cached else None
+        link = _load_link(user_a, user_b)
+        if self.ttl > 0:
+            self._store.set(key, tuple(link) if link else self._NONE, self.ttl)
+        return link
+
+    def invalidate(self, user_a: int, user_b: int):
+        self._store.delete(self._key(user_a, user_b))
+
+
+# 全局好友关系缓存实例
+friendship_cache = FriendshipCache()
+
+
+def get_friendship(
+    user_id: int, other_id: int, use_cache: bool = True
+) -> Optional[FriendLink]:
+    """
+    两人之间的好友关系（不论由谁发起）
+
+    Args:
+        use_cache: 为 False 时直接查询数据库（写操作前的检查使用）
+    """
+    user_id, other_id = int(user_id), int(other_id)
+    if not use_cache:
+        return _load_link(user_id, other_id)
+    return friendship_cache.get(user_id, other_id)
+
+
+def are_friends(user_id: int, other_id: int, use_cache: bool = True) -> bool:
+    """
+    两人是否为已接受的好友
+
+    Args:
+        use_cache: 为 False 时直接查询数据库。缓存只在处理变更的 worker 中失效，
+            其它 worker 最多延迟 TTL 才能看到解除好友，写操作前的检查应绕过缓存
+    """
+    link = get_friendship(user_id, other_id, use_cache=use_cache)
+    return link is not None and link.status == "accepted"
+
+
+def friend_links(user_id: int, other_ids: Iterable[int]) -> Dict[int, FriendLink]:
+    """
+    一次查询取出用户与一组用户之间的关系
+
+    Returns:
+        对方 id 到关系的映射（没有关系的用户不在结果中）
+    """
+    lower = [other for other in set(other_ids) if other < user_id]
+    higher = [other for other in set(other_ids) if other > user_id]
+    branches = []
+    if higher:
+        branches.append(
+            db.and_(Friend.user_low_id == user_id, Friend.user_high_id.in_(higher))
+        )
+    if lower:
+        branches.append(
+            db.and_(Friend.user_high_id == user_id, Friend.user_low_id.in_(lower))
+        )
+    if not branches:
+        return {}
+    rows = db.session.query(
+        Friend.id, Friend.user_id, Friend.friend_id, Friend.status
+    ).filter(db.or_(*branches))
+    links = {}
+    for row in rows:
+        link = FriendLink(*row)
+        other = link.friend_id if link.user_id == user_id else link.user_id
+        links[other] = link
+    return links
+
+
+# 回填时保留的重复历史记录没有用户对，列表查询中排除
+_KEYED = Friend.user_low_id.isnot(None)
+
+
+def friend_ids(user_id: int) -> List[int]:
+    """用户的全部好友 id（双向关系用一条 UNION 查询取出，两个分支各走一个索引）"""
+    sent = db.select(Friend.friend_id.label("user_id")).where(
+        Friend.user_id == user_id, Friend.status == "accepted", _KEYED
+    )
+    received = db.select(Friend.user_id.label("user_id")).where(
+        Friend.friend_id == user_id, Friend.status == "accepted", _KEYED
+    )
+    return [row[0] for row in db.session.execute(db.union(sent, received))]
+
+
+_REQUEST_COLUMNS = (
+    Friend.id,
+    Friend.user_id,
+    Friend.friend_id,
+    Friend.status,
+    Friend.created_at,
+    Friend.updated_at,
+)
+
+
+def pending_requests(user_id: int) -> List[Any]:
+    """用户收到和发出的待处理好友请求（一条 UNION 查询）"""
+    received = db.select(*_REQUEST_COLUMNS).where(
+        Friend.friend_id == user_id, Friend.status == "pending", _KEYED
+    )
+    sent = db.select(*_REQUEST_COLUMNS).where(
+        Friend.user_id == user_id, Friend.status == "pending", _KEYED
+    )
+    return db.session.execute(db.union_all(received, sent)).all()
+
+
+def serialize_request(row, cards: Dict[int, Dict[str, Any]]) -> Dict[str, Any]:
+    """好友请求（字段与 Friend.to_dict 一致，双方均为紧凑用户卡片）"""
+    return {
+        "id": row.id,
+        "user_id": row.user_id,
+        "friend_id": row.friend_id,
+        "status": row.status,
+        "created_at": row.created_at.isoformat() + "Z" if row.created_at else None,
+        "updated_at": row.updated_at.isoformat() + "Z" if row.updated_at else None,
+        "user": cards.get(row.user_id),
+        "friend": cards.get(row.friend_id),
+    }
+
+
+def _prefix_pattern(text: str) -> str:
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return escaped + "%"
+
+
+def search_users_by_prefix(
+    text: str, exclude_id: Optional[int] = None, limit: int = 10
+) -> List[Any]:
+    """
+    按用户名前缀（输入包含 @ 时同时按邮箱前缀）搜索用户
+
+    只取 id / username / email 三列（不加载头像等大字段），卡片由 load_user_cards 批量补全。
+
+    前缀匹配可以走 username / email 的唯一索引做范围扫描，每个分支最多读 limit 行，
+    不会像 '%q%' 那样全表扫描；大小写是否敏感取决于列的排序规则（MySQL 默认不敏感）。
+    """
+    pattern = _prefix_pattern(text)
+    columns = [User.username]
+    if "@" in text:
+        columns.append(User.email)
+
+    found: Dict[int, Any] = {}
+    for column in columns:
+        query = db.session.query(User.id, User.username, User.email).filter(
+            column.like(pattern, escape="\\")
+        )
+        if exclude_id is not None:
+            query = query.filter(User.id != exclude_id)
+        for user in query.order_by(column).limit(limit):
+            found.setdefault(user.id, user)
+    return sorted(found.values(), key=lambda user: user.username)[:limit]
+
+
+def invalidate_friendship(user_id: int, other_id: int):
+    """关系变更提交后调用"""
+    friendship_cache.invalidate(int(user_id), int(other_id))
+
+
+def request_row_to_reuse(
+    user_id: int, friend_id: int, existing: Optional[FriendLink]
+) -> Optional[Friend]:
+    """
+    重新发起好友请求时复用的记录（没有可复用的记录时返回 None）
+
+    回填时保留的同方向历史记录（用户对为空）占用了 (user_id, friend_id) 唯一约束，
+    存在时复用它；原来参与唯一索引的记录退出索引，保留为历史。
+    在调用方的事务中执行，由调用方提交。
+    """
+    stale = Friend.query.filter(
+        Friend.user_id == user_id,
+        Friend.friend_id == friend_id,
+        Friend.user_low_id.is_(None),
+    ).first()
+    if stale is None:
+        return Friend.query.get(existing.id) if existing else None
+    if existing is not None:
+        db.session.execute(
+            db.update(Friend)
+            .where(Friend.id == existing.id)
+            .values(user_low_id=None, user_high_id=None)
+            .execution_options(synchronize_session=False)
+        )
+    return stale
+
+
+def _unkeyed_links():
+    """缺少规范化用户对、且该用户对尚无记录占用的好友关系（需要回填的记录）"""
+    low = db.case(
+        (Friend.user_id < Friend.friend_id, Friend.user_id), else_=Friend.friend_id
+    )
+    high = db.case(
+        (Friend.user_id < Friend.friend_id, Friend.friend_id), else_=Friend.user_id
+    )
+    keyed = db.aliased(Friend)
+    return db.session.query(Friend.id).filter(
+        Friend.user_low_id.is_(None),
+        ~db.exists().where(keyed.user_low_id == low, keyed.user_high_id == high),
+    )
+
+
+def backfill_friend_pairs() -> int:
+    """
+    为旧的好友关系补写规范化用户对（启动时调用）
+
+    同一对用户存在多条历史记录时（双方互相发起过请求），只保留一条参与唯一索引：
+    优先已接受的，其次待处理的，再按 id 最小。其余记录原样保留、用户对为空
+    （唯一索引允许多个空值），不再被关系检查和好友请求列表使用。
+    启动时的检查只查看用户对为空且该用户对尚无记录的行（走 ux_friends_pair 索引），
+    已回填完成后不会重复扫描整张表。
+
+    Returns:
+        补写的记录数量
+    """
+    if _unkeyed_links().first() is None:
+        return 0
+
+    rows = db.session.query(
+        Friend.id, Friend.user_id, Friend.friend_id, Friend.status, Friend.user_low_id
+    ).all()
+    groups = defaultdict(list)
+    for row in rows:
+        groups[pair_key(row.user_id, row.friend_id)].append(row)
+
+    priority = {"accepted": 0, "pending": 1}
+    updates = []
+    skipped = 0
+    for (low, high), links in groups.items():
+        if any(link.user_low_id is not None for link in links):
+            skipped += sum(1 for link in links if link.user_low_id is None)
+            continue
+        keeper = min(links, key=lambda link: (priority.get(link.status, 2), link.id))
+        updates.append({"row_id": keeper.id, "low": low, "high": high})
+        skipped += len(links) - 1
+
+    if updates:
+        db.session.execute(
+            db.text(
+                "UPDATE friends SET user_low_id = :low, user_high_id = :high "
+                "WHERE id = :row_id"
+            ),
+            updates,
+        )
+    db.session.commit()
+    if skipped:
+        logger.warning(f"{skipped} duplicate friend records left without a pair key")
+    logger.info(f"Backfilled pair keys for {len(updates)} friend records")
+    return len(updates)
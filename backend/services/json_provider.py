@@ -0,0 +1,105 @@
+"""
+JSON 编码服务模块
+安装了 orjson 时使用 orjson 序列化响应（不可用或遇到不支持的数据时回退到标准库），
+并提供逐块输出大型 JSON 文档的流式编码工具
+"""
+
+import json
+import logging
+from types import GeneratorType
+from typing import Any, Callable, Iterable, Iterator
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except Exception:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    基于 orjson 的 JSON 提供者
+
+    输出与默认提供者保持一致：按键排序、datetime 序列化为 HTTP 日期格式、
+    非字符串键转换为字符串；非 ASCII 字符直接以 UTF-8 输出，体积更小。
+    """
+
+    if orjson is not None:
+        _options = (
+            orjson.OPT_SORT_KEYS
+            | orjson.OPT_NON_STR_KEYS
+            | orjson.OPT_PASSTHROUGH_DATETIME
+            | orjson.OPT_PASSTHROUGH_DATACLASS
+        )
+
+    def dumps_bytes(self, obj: Any) -> bytes:
+        """序列化为紧凑的 UTF-8 字节串"""
+        if orjson is not None:
+            try:
+                return orjson.dumps(obj, default=self.default, option=self._options)
+            except TypeError:
+                # 超出 64 位的整数等 orjson 不支持的数据
+                pass
+        return json.dumps(
+            obj,
+            default=self.default,
+            ensure_ascii=False,
+            sort_keys=self.sort_keys,
+            separators=(",", ":"),
+        ).encode("utf-8")
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if orjson is not None and not kwargs:
+            return self.dumps_bytes(obj).decode("utf-8")
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs: Any) -> Any:
+        if orjson is not None and not kwargs:
+            try:
+                return orjson.loads(s)
+            except orjson.JSONDecodeError:
+                # 交给标准库抛出一致的异常信息
+                pass
+        return super().loads(s, **kwargs)
+
+    def response(self, *args: Any, **kwargs: Any):
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            self.dumps_bytes(obj) + b"\n", mimetype=self.mimetype
+        )
+
+
+def iter_json(obj: Any, dumps: Callable[[Any], str]) -> Iterator[str]:
+    """
+    逐块输出 JSON 文档
+
+    dict 逐个键输出，生成器/迭代器作为数组逐个元素输出（不整体放入内存），
+    其它值交给 dumps 序列化。
+
+    Args:
+        obj: 要输出的文档
+        dumps: 单个值的序列化函数
+    """
+    if isinstance(obj, dict):
+        yield "{"
+        for index, (key, value) in enumerate(obj.items()):
+            yield ("," if index else "") + json.dumps(str(key)) + ":"
+            yield from iter_json(value, dumps)
+        yield "}"
+    elif isinstance(obj, (GeneratorType, Iterator)):
+        yield "[\n"
+        for index, item in enumerate(obj):
+            yield (",\n" if index else "") + dumps(item)
+        yield "\n]"
+    else:
+        yield dumps(obj)
+
+
+def iter_json_items(items: Iterable[Any]) -> Iterator[Any]:
+    """把可迭代对象包装成生成器，使 iter_json 将其作为流式数组输出"""
+    yield from items
@@ -0,0 +1,124 @@
+"""
+数据库命名锁服务模块
+多 worker 部署时选出唯一的执行者（启动时的建表与回填、定时维护任务）。MySQL 使用
+GET_LOCK / RELEASE_LOCK，锁随持有它的连接释放，进程崩溃不会遗留；SQLite 仅用于
+单进程开发环境，直接视为获得锁
+"""
+
+import logging
+from contextlib import contextmanager
+from typing import Iterator
+
+from sqlalchemy import text
+
+from models import db
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def named_lock(name: str, timeout: float = 0) -> Iterator[bool]:
+    """
+    获取数据库命名锁，with 块结束时释放
+
+    锁在一个单独的连接上持有，with 块内的查询照常使用 db.session。
+
+    Args:
+        name: 锁名称（自动加上数据库名前缀，避免同一 MySQL 实例上的其它库冲突）
+        timeout: 等待锁的秒数，0 表示不等待
+
+    Yields:
+        是否获得了锁
+    """
+    engine = db.engine
+    if engine.dialect.name != "mysql":
+        yield True
+        return
+
+    lock_name = f"{engine.url.database}:{name}"
+    with engine.connect() as conn:
+        acquired = (
+            conn.execute(
+                text("SELECT GET_LOCK(:name, :timeout)"),
+                {"name": lock_name, "timeout": timeout},
+            ).scalar()
+            == 1
+        )
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                try:
+                    conn.execute(
+                        text("SELECT RELEASE_LOCK(:name)"), {"name": lock_name}
+                    )
+                except Exception as e:
+                    # 释放失败时丢弃该连接，锁随连接关闭释放，不会回到连接池
+                    logger.error(f"Failed to release lock {lock_name}: {e}")
+                    conn.invalidate()
+
+
+class LeaderElection:
+    """
+    在多个 worker 中选出唯一执行后台任务的进程
+
+    获得锁的进程在一个专用连接上一直持有，直到进程退出、连接断开或调用 release；
+    其余进程每次检查时重试，领导者退出后由它们接替。
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._conn = None
+
+    def _lock_name(self, engine) -> str:
+        return f"{engine.url.database}:{self.name}"
+
+    def is_leader(self) -> bool:
+        """当前进程是否持有锁（未持有时尝试获取，不等待）"""
+        engine = db.engine
+        if engine.dialect.name != "mysql":
+            return True
+        params = {"name": self._lock_name(engine)}
+
+        if self._conn is not None:
+            # 确认锁仍属于这条连接（连接可能已被服务端超时断开）
+            try:
+                held = self._conn.execute(
+                    text("SELECT IS_USED_LOCK(:name) = CONNECTION_ID()"), params
+                ).scalar()
+                self._conn.commit()
+                if held:
+                    return True
+            except Exception as e:
+                logger.warning(f"Lost leader lock {params['name']}: {e}")
+            self._discard()
+
+        conn = engine.connect()
+        try:
+            acquired = (
+                conn.execute(text("SELECT GET_LOCK(:name, 0)"), params).scalar() == 1
+            )
+            conn.commit()
+        except Exception:
+            conn.invalidate()
+            conn.close()
+            raise
+        if not acquired:
+            conn.close()
+            return False
+        self._conn = conn
+        logger.info(f"Acquired leader lock {params['name']}")
+        return True
+
+    def _discard(self):
+        # 直接丢弃连接：锁随连接关闭释放，不会随连接回到连接池
+        conn, self._conn = self._conn, None
+        try:
+            conn.invalidate()
+            conn.close()
+        except Exception:
+            pass
+
+    def release(self):
+        if self._conn is not None:
+            self._discard()
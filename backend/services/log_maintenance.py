@@ -0,0 +1,208 @@
+"""
+操作日志维护服务模块
+定期把 system_logs 按天、按 action / resource_type 汇总到 system_log_daily，
+并按保留期分批删除过期明细（走 created_at 索引的范围删除），明细表大小保持有界，
+管理端统计读取汇总表。多 worker 部署时由数据库锁选出一个进程执行
+"""
+
+import logging
+import os
+import threading
+from datetime import date, datetime, time, timedelta
+from typing import Optional
+
+from models import db, SystemLog, SystemLogDaily
+from services.locks import LeaderElection
+
+logger = logging.getLogger(__name__)
+
+
+def _day_start(day: date) -> datetime:
+    return datetime.combine(day, time.min)
+
+
+def rollup_day(day: date) -> int:
+    """
+    重算某一天的汇总（先删后插，在一个事务中完成，可重复执行）
+
+    Returns:
+        汇总行数
+    """
+    start = _day_start(day)
+    rows = (
+        db.session.query(
+            SystemLog.action,
+            db.func.coalesce(SystemLog.resource_type, ""),
+            db.func.count(SystemLog.id),
+            db.func.count(db.distinct(SystemLog.user_id)),
+        )
+        .filter(
+            SystemLog.created_at >= start,
+            SystemLog.created_at < start + timedelta(days=1),
+        )
+        .group_by(SystemLog.action, db.func.coalesce(SystemLog.resource_type, ""))
+        .all()
+    )
+    db.session.execute(
+        db.delete(SystemLogDaily)
+        .where(SystemLogDaily.day == day)
+        .execution_options(synchronize_session=False)
+    )
+    if rows:
+        db.session.execute(
+            db.insert(SystemLogDaily),
+            [
+                {
+                    "day": day,
+                    "action": action,
+                    "resource_type": resource_type,
+                    "count": count,
+                    "user_count": user_count,
+                }
+                for action, resource_type, count, user_count in rows
+            ],
+        )
+    db.session.commit()
+    return len(rows)
+
+
+def _last_rolled_up_day() -> Optional[date]:
+    return db.session.query(db.func.max(SystemLogDaily.day)).scalar()
+
+
+def rollup_pending(today: Optional[date] = None) -> int:
+    """
+    汇总尚未汇总的日期到今天
+
+    从最后一个已汇总日的前一天开始重算：最后一天汇总时可能尚不完整，
+    前一天的日志也可能在零点后才由后台批量写入。
+
+    Returns:
+        处理的天数
+    """
+    today = today or datetime.utcnow().date()
+    start = _last_rolled_up_day()
+    if start is None:
+        first_log = db.session.query(db.func.min(SystemLog.created_at)).scalar()
+        if first_log is None:
+            return 0
+        start = first_log.date()
+    else:
+        start -= timedelta(days=1)
+
+    day = start
+    while day <= today:
+        rollup_day(day)
+        day += timedelta(days=1)
+    return (today - start).days + 1
+
+
+def purge_expired_logs(retention_days: int, batch_size: int = 5000) -> int:
+    """
+    分批删除超过保留期的日志明细（每批单独提交，避免长事务和大量锁）
+
+    只删除已完成汇总的日期的明细，未汇总的日志不会丢失统计。
+
+    Returns:
+        删除的行数
+    """
+    if retention_days <= 0:
+        return 0
+    cutoff = _day_start(datetime.utcnow().date() - timedelta(days=retention_days))
+    last_day = _last_rolled_up_day()
+    if last_day is None:
+        return 0
+    # 不删除可能被重算的日期
+    cutoff = min(cutoff, _day_start(last_day - timedelta(days=1)))
+
+    deleted = 0
+    while True:
+        ids = [
+            row_id
+            for (row_id,) in db.session.query(SystemLog.id)
+            .filter(SystemLog.created_at < cutoff)
+            .order_by(SystemLog.created_at, SystemLog.id)
+            .limit(batch_size)
+        ]
+        if not ids:
+            break
+        db.session.execute(
+            db.delete(SystemLog)
+            .where(SystemLog.id.in_(ids))
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        deleted += len(ids)
+        if len(ids) < batch_size:
+            break
+    if deleted:
+        logger.info(f"Purged {deleted} system logs older than {cutoff.date()}")
+    return deleted
+
+
+class LogMaintenance:
+    """日志汇总与过期清理的后台任务"""
+
+    def __init__(self, interval: float = 3600.0, retention_days: int = 90):
+        """
+        初始化
+
+        Args:
+            interval: 执行间隔（秒），为 0 时不启动后台线程
+            retention_days: 明细保留天数，为 0 时不删除
+        """
+        self.interval = interval
+        self.retention_days = retention_days
+        self._stop = threading.Event()
+        self._thread = None
+        self._app = None
+        self._leader = LeaderElection("log_maintenance")
+
+    def init_app(self, app):
+        """绑定 Flask 应用并启动后台线程"""
+        self._app = app
+        self.interval = float(os.getenv("LOG_MAINTENANCE_INTERVAL", self.interval))
+        self.retention_days = int(os.getenv("LOG_RETENTION_DAYS", self.retention_days))
+        if self._thread is None and self.interval > 0:
+            self._thread = threading.Thread(
+                target=self._run, name="log-maintenance", daemon=True
+            )
+            self._thread.start()
+
+    def run_once(self) -> bool:
+        """
+        执行一次汇总和清理（只在被选为执行者的 worker 中执行）
+
+        Returns:
+            本进程是否执行了任务
+        """
+        with self._app.app_context():
+            try:
+                if not self._leader.is_leader():
+                    return False
+                rollup_pending()
+                purge_expired_logs(self.retention_days)
+                return True
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Log maintenance failed: {e}")
+                return False
+            finally:
+                db.session.remove()
+
+    def _run(self):
+        # 启动后先等待一个较短的间隔，避免与启动时的建表/回填争用
+        if self._stop.wait(min(self.interval, 60.0)):
+            return
+        while True:
+            self.run_once()
+            if self._stop.wait(self.interval):
+                return
+
+    def stop(self):
+        self._stop.set()
+        self._leader.release()
+
+
+# 全局日志维护任务实例
+log_maintenance = LogMaintenance()
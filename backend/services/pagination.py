@@ -0,0 +1,214 @@
+"""
+游标分页服务模块
+基于 (排序列, id) 的 keyset 分页，翻到第 N 页与第 1 页成本相同，且无需 COUNT(*)
+"""
+
+import base64
+import json
+import logging
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+from models import db
+
+logger = logging.getLogger(__name__)
+
+# 单页最大条数，防止客户端一次拉取过多数据
+MAX_PER_PAGE = 100
+
+
+def _encode_value(value: Any) -> Any:
+    """将排序值编码为可 JSON 序列化的形式"""
+    if isinstance(value, datetime):
+        return {"dt": value.isoformat()}
+    return value
+
+
+def _decode_value(value: Any) -> Any:
+    """还原 _encode_value 编码的排序值"""
+    if isinstance(value, dict) and "dt" in value:
+        return datetime.fromisoformat(value["dt"])
+    return value
+
+
+def encode_cursor(sort_key: str, value: Any, row_id: int) -> str:
+    """
+    生成不透明游标
+
+    Args:
+        sort_key: 排序列名称（用于防止游标跨排序方式误用）
+        value: 最后一条记录的排序列值
+        row_id: 最后一条记录的 id
+
+    Returns:
+        URL 安全的 base64 游标字符串
+    """
+    payload = json.dumps(
+        {"k": sort_key, "v": _encode_value(value), "i": row_id},
+        separators=(",", ":"),
+    ).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("utf-8").rstrip("=")
+
+
+def decode_cursor(cursor: str, sort_key: str):
+    """
+    解析游标，返回 (排序值, id)
+
+    Raises:
+        ValueError: 游标格式错误或与当前排序方式不匹配
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode("utf-8")))
+        if data.get("k") != sort_key:
+            raise ValueError("Cursor does not match sort order")
+        return _decode_value(data.get("v")), int(data["i"])
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {e}")
+
+
+def _after_condition(sort_column, id_column, value, row_id, descending):
+    """构造“位于游标之后”的过滤条件（NULL 在升序时最前、降序时最后）"""
+    if value is None:
+        if descending:
+            return db.and_(sort_column.is_(None), id_column < row_id)
+        return db.or_(
+            sort_column.isnot(None),
+            db.and_(sort_column.is_(None), id_column > row_id),
+        )
+
+    if descending:
+        return db.or_(
+            sort_column < value,
+            db.and_(sort_column == value, id_column < row_id),
+            sort_column.is_(None),
+        )
+    return db.or_(
+        sort_column > value,
+        db.and_(sort_column == value, id_column > row_id),
+    )
+
+
+def keyset_paginate(
+    query,
+    sort_column,
+    id_column,
+    cursor: Optional[str] = None,
+    per_page: int = 20,
+    descending: bool = True,
+) -> Dict[str, Any]:
+    """
+    对查询执行 keyset 分页
+
+    多取一条记录判断是否还有下一页，因此每页只需一次带 LIMIT 的索引扫描。
+
+    Args:
+        query: 已应用过滤条件但未排序的查询
+        sort_column: 排序列
+        id_column: 主键列（用于打破排序值相同的平局）
+        cursor: 上一页返回的 next_cursor
+        per_page: 每页条数
+        descending: 是否降序
+
+    Returns:
+        {"items": [...], "next_cursor": str 或 None, "has_more": bool}
+
+    Raises:
+        ValueError: 游标无效
+    """
+    per_page = max(1, min(per_page or 20, MAX_PER_PAGE))
+    sort_key = sort_column.key
+
+    if cursor:
+        value, row_id = decode_cursor(cursor, sort_key)
+        query = query.filter(
+            _after_condition(sort_column, id_column, value, row_id, descending)
+        )
+
+    if descending:
+        query = query.order_by(sort_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(sort_column.asc(), id_column.asc())
+
+    rows = query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    items = rows[:per_page]
+
+    next_cursor = None
+    if has_more and items:
+        last = items[-1]
+        next_cursor = encode_cursor(
+            sort_key, getattr(last, sort_key), getattr(last, id_column.key)
+        )
+
+    return {"items": items, "next_cursor": next_cursor, "has_more": has_more}
+
+
+def approximate_count(model) -> Optional[int]:
+    """
+    返回表的近似行数，不执行 COUNT(*) 全表扫描
+
+    MySQL 读取 information_schema 中的统计信息；SQLite 使用 MAX(id)
+    （对只追加的表足够准确）。失败时返回 None。
+    """
+    table_name = model.__tablename__
+    try:
+        if db.engine.dialect.name == "mysql":
+            result = db.session.execute(
+                db.text(
+                    "SELECT TABLE_ROWS FROM information_schema.TABLES "
+                    "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :name"
+                ),
+                {"name": table_name},
+            ).scalar()
+        else:
+            result = db.session.query(db.func.max(model.id)).scalar()
+        return int(result or 0)
+    except Exception as e:
+        logger.warning(f"Approximate count failed for {table_name}: {e}")
+        return None
+
+
+def wants_keyset(args) -> bool:
+    """
+    判断请求是否使用游标分页
+
+    显式传入 cursor，或未传 page 参数时使用游标分页；
+    仅传 page 的旧客户端继续走 OFFSET 分页以保持兼容。
+    """
+    return "cursor" in args or "page" not in args
+
+
+def keyset_response(
+    key: str, page: Dict[str, Any], items: List[Any], total: Optional[int] = None
+) -> Dict[str, Any]:
+    """构建游标分页的统一响应体"""
+    body = {
+        key: items,
+        "next_cursor": page["next_cursor"],
+        "has_more": page["has_more"],
+    }
+    if total is not None:
+        body["total"] = total
+        body["total_is_approximate"] = True
+    return body
+
+
+def iter_batches(query, id_column, batch_size: int = 500) -> Iterator[Any]:
+    """
+    按 id 分批遍历查询结果（每批一次 keyset 查询）
+
+    与 yield_per 不同，不占用服务端游标，遍历过程中可以继续执行其它查询。
+    """
+    last_id = None
+    while True:
+        batch_query = query
+        if last_id is not None:
+            batch_query = batch_query.filter(id_column > last_id)
+        rows = batch_query.order_by(id_column).limit(batch_size).all()
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1].id
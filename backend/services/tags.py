@@ -0,0 +1,246 @@
+"""
+标签服务模块
+维护规范化的标签字典（tags）与帖子-标签关联表（post_tags），并缓存标签列表
+"""
+
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List
+
+from models import db, Algorithm, Post, PostTag, Tag
+from services.catalog import catalog_cache, catalog_versions
+from services.counters import insert_ignore
+
+logger = logging.getLogger(__name__)
+
+MAX_TAG_LENGTH = 100
+
+
+def normalize_tags(tags) -> List[str]:
+    """去除空白、空值和重复项，保持原有顺序"""
+    result = []
+    seen = set()
+    for tag in tags or []:
+        if not isinstance(tag, str):
+            continue
+        name = tag.strip()[:MAX_TAG_LENGTH]
+        if name and name.lower() not in seen:
+            seen.add(name.lower())
+            result.append(name)
+    return result
+
+
+def tag_key(name: str) -> str:
+    """标签的规范化键（不区分大小写）"""
+    return name.lower()
+
+
+def _lookup_tag_ids(names: List[str]) -> Dict[str, int]:
+    keys = {tag_key(name) for name in names}
+    rows = db.session.query(Tag.id, Tag.name_key).filter(Tag.name_key.in_(keys))
+    return {key: tag_id for tag_id, key in rows}
+
+
+def get_or_create_tag_ids(names: List[str]) -> Dict[str, int]:
+    """
+    返回标签名到标签 id 的映射，不存在的标签自动加入字典
+
+    并发创建同名标签时依赖唯一约束幂等插入。
+    """
+    if not names:
+        return {}
+    found = _lookup_tag_ids(names)
+    missing = [name for name in names if tag_key(name) not in found]
+    if missing:
+        now = datetime.utcnow()
+        for name in missing:
+            insert_ignore(
+                Tag, name=name, name_key=tag_key(name), post_count=0, created_at=now
+            )
+        catalog_versions.bump(db.session, ["tags"])
+        found = _lookup_tag_ids(names)
+    return {name: found[tag_key(name)] for name in names if tag_key(name) in found}
+
+
+def register_tags(tags: Iterable[str]):
+    """将标签加入字典（用于算法标签等不关联帖子的来源）"""
+    get_or_create_tag_ids(normalize_tags(tags))
+
+
+def sync_post_tags(post_id: int, tags):
+    """
+    使 post_tags 与帖子的标签数组保持一致，并原子地调整标签计数
+
+    只有新增标签时才递增 "tags" 版本号；计数变化由标签列表按周期刷新。
+
+    在调用方的事务中执行，由调用方提交。
+    """
+    wanted = set(get_or_create_tag_ids(normalize_tags(tags)).values())
+    current = {
+        tag_id
+        for (tag_id,) in db.session.query(PostTag.tag_id).filter_by(post_id=post_id)
+    }
+
+    to_remove = current - wanted
+    to_add = wanted - current
+
+    if to_remove:
+        PostTag.query.filter(
+            PostTag.post_id == post_id, PostTag.tag_id.in_(to_remove)
+        ).delete(synchronize_session=False)
+        _adjust_tag_counts(to_remove, -1)
+
+    if to_add:
+        # 幂等插入，只为真正插入的关联增加计数（并发同步同一帖子时不会重复计数）
+        to_add = {
+            tag_id
+            for tag_id in to_add
+            if insert_ignore(PostTag, post_id=post_id, tag_id=tag_id)
+        }
+        if to_add:
+            _adjust_tag_counts(to_add, 1)
+
+
+def _adjust_tag_counts(tag_ids, delta: int):
+    db.session.execute(
+        db.update(Tag)
+        .where(Tag.id.in_(tag_ids))
+        .values(post_count=db.func.coalesce(Tag.post_count, 0) + delta)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def posts_with_tag(tag: str):
+    """返回“帖子包含指定标签”的过滤条件（走 post_tags 索引）"""
+    return posts_with_any_tag([tag])
+
+
+def posts_with_any_tag(tags: Iterable[str]):
+    """返回“帖子包含任一指定标签”的过滤条件（走 post_tags 索引）"""
+    keys = [tag_key(name) for name in normalize_tags(tags)]
+    subquery = (
+        db.select(PostTag.post_id)
+        .join(Tag, Tag.id == PostTag.tag_id)
+        .where(Tag.name_key.in_(keys))
+    )
+    return Post.id.in_(subquery)
+
+
+def tag_counts_epoch() -> int:
+    """
+    标签帖子数的刷新周期编号（TAG_COUNT_REFRESH 秒一个周期）
+
+    帖子增删标签只调整计数、不递增 "tags" 版本号，避免并发发帖争用同一版本号行；
+    标签列表的缓存键和 ETag 带上周期编号，计数最多延迟一个周期。
+    """
+    interval = float(os.getenv("TAG_COUNT_REFRESH", "10"))
+    return int(time.time() // interval) if interval > 0 else 0
+
+
+def get_all_tags() -> Dict[str, object]:
+    """
+    返回全部标签及其帖子数的缓存条目（{"body": 序列化后的 JSON}）
+
+    新增标签后版本号变化即失效，帖子数按 tag_counts_epoch 周期刷新。
+    """
+
+    def build():
+        rows = db.session.query(Tag.name, Tag.post_count).order_by(Tag.name).all()
+        return {
+            "tags": [name for name, _ in rows],
+            "counts": {name: count or 0 for name, count in rows},
+        }
+
+    return catalog_cache.get_or_build(
+        f"post_tags:{tag_counts_epoch()}", "tags", build
+    )
+
+
+def backfill_tags() -> bool:
+    """
+    从已有帖子和算法的 tags 字段回填标签字典与关联表
+
+    仅在标签字典为空时执行，用于旧数据库升级后的首次启动。
+
+    Returns:
+        是否执行了回填
+    """
+    if db.session.query(Tag.id).first() is not None:
+        return False
+
+    for post_id, tags in db.session.query(Post.id, Post.tags).all():
+        if tags:
+            sync_post_tags(post_id, tags)
+    for (tags,) in db.session.query(Algorithm.tags).all():
+        if tags:
+            get_or_create_tag_ids(normalize_tags(tags))
+    db.session.commit()
+    logger.info("Backfilled tag dictionary from existing posts and algorithms")
+    return True
+
+
+def backfill_tag_keys() -> int:
+    """
+    为旧标签补写规范化键（启动时调用，已全部补齐时只需一次查询）
+
+    仅大小写不同的重复标签（SQLite 的 name 列区分大小写时可能产生）合并到 id 最小的
+    标签：帖子关联移到保留的标签并重算其帖子数，重复的字典条目删除。
+    标签字典由帖子的 tags 字段派生，帖子本身的数据不变。
+
+    Returns:
+        补写或合并的标签数量
+    """
+    if db.session.query(Tag.id).filter(Tag.name_key.is_(None)).first() is None:
+        return 0
+
+    rows = db.session.query(Tag.id, Tag.name, Tag.name_key).order_by(Tag.id).all()
+    canonical = {row.name_key: row.id for row in rows if row.name_key}
+    updates = []
+    merges = {}
+    for row in rows:
+        if row.name_key:
+            continue
+        key = tag_key(row.name)
+        if key in canonical:
+            merges[row.id] = canonical[key]
+        else:
+            canonical[key] = row.id
+            updates.append({"tag_id": row.id, "name_key": key})
+
+    if updates:
+        db.session.execute(
+            db.text("UPDATE tags SET name_key = :name_key WHERE id = :tag_id"), updates
+        )
+    for duplicate_id, keep_id in merges.items():
+        post_ids = db.session.query(PostTag.post_id).filter_by(tag_id=duplicate_id)
+        for (post_id,) in post_ids.all():
+            insert_ignore(PostTag, post_id=post_id, tag_id=keep_id)
+        db.session.execute(
+            db.delete(PostTag)
+            .where(PostTag.tag_id == duplicate_id)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.execute(
+            db.delete(Tag)
+            .where(Tag.id == duplicate_id)
+            .execution_options(synchronize_session=False)
+        )
+    if merges:
+        kept = set(merges.values())
+        db.session.execute(
+            db.update(Tag)
+            .where(Tag.id.in_(kept))
+            .values(
+                post_count=db.select(db.func.count(PostTag.id))
+                .where(PostTag.tag_id == Tag.id)
+                .scalar_subquery()
+            )
+            .execution_options(synchronize_session=False)
+        )
+        catalog_versions.bump(db.session, ["tags"])
+        logger.warning(f"Merged {len(merges)} tags that differed only in case")
+    db.session.commit()
+    logger.info(f"Backfilled name keys for {len(updates)} tags")
+    return len(updates) + len(merges)
@@ -0,0 +1,327 @@
+"""
+算法理论内容服务模块
+将抓取转换后的算法数据导入索引表，入库时预先计算改写图片路径后的理论 Markdown，详情接口只需查表
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from models import db, ConvertedAlgorithm, ConvertedSource
+from services.locks import named_lock
+
+logger = logging.getLogger(__name__)
+
+# 原仓库图片的 raw GitHub 地址（无 repo 信息时的回退）
+BASE_RAW = (
+    "https://raw.githubusercontent.com/gavinkhung/machine-learning-visualized/"
+    "main/book/"
+)
+_MD_IMAGE_RE = re.compile(r"!\[([^\]]*)\]\((?:\.\./)*(plot/[^)]+)\)")
+_HTML_SRC_RE = re.compile(r"(src=[\"\\\'])(?:\.\./)*(plot/[^\"\\\']+)([\"\\\'])")
+
+
+def rewrite_image_paths(markdown_text, repo=None):
+    """Rewrite relative image paths.
+    If repo is provided, map relative paths (plot/, _images/) to local
+    /ml_images/<repo>/... Otherwise, rewrite to raw GitHub URLs (legacy behavior).
+    """
+    if not markdown_text:
+        return markdown_text
+
+    if repo:
+        text = markdown_text
+        text = text.replace("](" + "plot/", "](/ml_images/" + repo + "/plot/")
+        text = text.replace("(plot/", "(/ml_images/" + repo + "/plot/")
+        text = text.replace("](" + "../" + "plot/", "](/ml_images/" + repo + "/plot/")
+        text = text.replace("](" + "_images/", "](/ml_images/" + repo + "/_images/")
+        text = text.replace("../_images/", "/ml_images/" + repo + "/_images/")
+        text = text.replace("(_images/", "(/ml_images/" + repo + "/_images/")
+        # src="plot/...
+        text = text.replace('src="plot/', 'src="/ml_images/' + repo + "/plot/")
+        return text
+
+    # Fallback: rewrite to the original repo's raw GitHub path
+    # replace markdown image paths: ![alt](plot/...)
+    markdown_text = _MD_IMAGE_RE.sub(r"![\1](" + BASE_RAW + r"\2)", markdown_text)
+    # replace HTML img src attributes: src="plot/..."
+    markdown_text = _HTML_SRC_RE.sub(r"\1" + BASE_RAW + r"\2\3", markdown_text)
+    return markdown_text
+
+
+def theory_source(conv: Optional[Dict[str, Any]]) -> Optional[str]:
+    """从转换数据中取出理论原文（theory 可能是段落列表或字符串）"""
+    if not conv:
+        return None
+    if isinstance(conv.get("theory"), list):
+        return "\n\n".join(conv.get("theory"))
+    return conv.get("theory") or conv.get("description")
+
+
+class TheoryRenderer:
+    """按内容哈希缓存渲染结果的理论内容渲染器"""
+
+    def __init__(self, max_entries: int = 1024):
+        """
+        初始化渲染器
+
+        Args:
+            max_entries: 渲染结果缓存的最大条目数（LRU 淘汰）
+        """
+        self.max_entries = max_entries
+        self._rendered: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def content_hash(text: str, repo: Optional[str]) -> str:
+        digest = hashlib.sha1((repo or "").encode("utf-8") + b"\0")
+        digest.update(text.encode("utf-8"))
+        return digest.hexdigest()
+
+    def render(self, text: Optional[str], repo: Optional[str] = None) -> Optional[str]:
+        """返回改写图片路径后的 Markdown，相同内容只计算一次"""
+        if not text:
+            return None
+        key = self.content_hash(text, repo)
+        with self._lock:
+            cached = self._rendered.get(key)
+            if cached is not None:
+                self._rendered.move_to_end(key)
+                return cached
+
+        rendered = rewrite_image_paths(text, repo=repo)
+        with self._lock:
+            self._rendered[key] = rendered
+            while len(self._rendered) > self.max_entries:
+                self._rendered.popitem(last=False)
+        return rendered
+
+
+# 全局理论渲染器实例
+theory_renderer = TheoryRenderer()
+
+
+def converted_source_paths():
+    """转换数据的候选文件，按优先级从低到高排列（同名条目以后者为准）"""
+    return [
+        os.path.join(os.getcwd(), "scraped_data", "converted_algorithms.json"),
+        os.path.join(os.getcwd(), "scraped_data", "missing_algorithms_converted.json"),
+        os.path.join(os.getcwd(), "converted_algorithms.json"),
+    ]
+
+
+class ConvertedStore:
+    """
+    抓取转换数据的索引存储
+
+    数据导入 converted_algorithms 表（按 name / chinese_name 建索引），各 worker
+    按需查询单条记录并做小容量 LRU 缓存，不再各自常驻完整语料。
+    来源文件的 mtime/size 变化时自动重新导入（多 worker 时由数据库锁保证只有一个导入）。
+    """
+
+    def __init__(self, check_interval: float = 5.0, max_entries: int = 256):
+        """
+        初始化存储
+
+        Args:
+            check_interval: 检查来源文件是否变化的最小间隔（秒）
+            max_entries: 进程内查询结果缓存的最大条目数
+        """
+        self.check_interval = check_interval
+        self.max_entries = max_entries
+        self._signatures = None
+        self._next_check = 0.0
+        self._entries: "OrderedDict[tuple, Optional[Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _file_signatures() -> Dict[str, tuple]:
+        signatures = {}
+        for path in converted_source_paths():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            signatures[path] = (stat.st_mtime_ns, stat.st_size)
+        return signatures
+
+    def refresh_if_changed(self, force: bool = False):
+        """来源文件有变化时重新导入（受 check_interval 节流）"""
+        now = time.monotonic()
+        with self._lock:
+            if not force and now < self._next_check:
+                return
+            self._next_check = now + self.check_interval
+
+        signatures = self._file_signatures()
+        if not force and signatures == self._signatures:
+            return
+
+        # 多个 worker 同时发现变化时只有一个导入，其余 worker 下次检查时
+        # 看到已更新的导入记录即跳过
+        try:
+            with named_lock("converted_sources") as acquired:
+                if not acquired:
+                    return
+                self._sync_sources(signatures)
+        except Exception as e:
+            logger.warning(f"Failed to ingest converted algorithms: {e}")
+            return
+
+        with self._lock:
+            self._signatures = signatures
+            self._entries.clear()
+
+    def _sync_sources(self, signatures: Dict[str, tuple]):
+        """
+        来源文件有变化时，按优先级合并全部现存来源文件并整体同步
+
+        使用独立的会话，不影响（也不提交）调用方请求中的事务。来源文件中已删除的
+        条目随之删除，同名条目由现存的最高优先级文件提供；理论内容未变化的条目不重新渲染。
+        """
+        with Session(db.engine) as session:
+            recorded = {row.path: row for row in session.query(ConvertedSource)}
+            if set(recorded) == set(signatures) and all(
+                (recorded[path].mtime_ns, recorded[path].size) == signature
+                for path, signature in signatures.items()
+            ):
+                return
+
+            merged: Dict[str, tuple] = {}
+            for rank, path in enumerate(converted_source_paths()):
+                if path in signatures:
+                    for item in self._read_items(path):
+                        merged[item["name"]] = (rank, item)
+
+            existing = {
+                row.name: row
+                for row in session.query(ConvertedAlgorithm).options(
+                    db.defer(ConvertedAlgorithm.theory_rendered)
+                )
+            }
+            for name, (rank, item) in merged.items():
+                source_text = theory_source(item) or ""
+                repo = item.get("repo")
+                content_hash = theory_renderer.content_hash(source_text, repo)
+                row = existing.pop(name, None)
+                if row is None:
+                    row = ConvertedAlgorithm(name=name)
+                    session.add(row)
+                if row.content_hash != content_hash:
+                    row.theory_rendered = theory_renderer.render(
+                        source_text, repo=repo
+                    )
+                    row.content_hash = content_hash
+                row.chinese_name = item.get("chinese_name")
+                row.repo = repo
+                row.source_rank = rank
+            for row in existing.values():
+                session.delete(row)
+
+            for path, (mtime_ns, size) in signatures.items():
+                source = recorded.pop(path, None)
+                if source is None:
+                    source = ConvertedSource(path=path)
+                    session.add(source)
+                source.mtime_ns = mtime_ns
+                source.size = size
+                source.ingested_at = datetime.utcnow()
+            for source in recorded.values():
+                session.delete(source)
+
+            session.commit()
+        logger.info(
+            f"Converted algorithms store refreshed ({len(merged)} entries, "
+            f"{len(existing)} removed)"
+        )
+
+    @staticmethod
+    def _read_items(path: str) -> List[Dict[str, Any]]:
+        """
+        读取来源文件中的条目
+
+        Raises:
+            ValueError: 文件无法读取或解析（如正在写入），本次不同步，稍后重试，
+                避免把该文件的条目当作已删除
+        """
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                items = json.load(f)
+        except Exception as e:
+            raise ValueError(f"unreadable converted data {path}: {e}") from e
+        return [it for it in items if isinstance(it, dict) and it.get("name")]
+
+    def lookup(self, name: str, chinese_name: Optional[str] = None):
+        """
+        按算法名（其次中文名）查找转换数据
+
+        Returns:
+            {"repo": str, "theory": str} 或 None
+        """
+        self.refresh_if_changed()
+
+        cache_key = (name, chinese_name or "")
+        with self._lock:
+            if cache_key in self._entries:
+                self._entries.move_to_end(cache_key)
+                return self._entries[cache_key]
+
+        keys = [name] + ([chinese_name] if chinese_name else [])
+        conditions = [ConvertedAlgorithm.name.in_(keys)]
+        if chinese_name:
+            conditions.append(ConvertedAlgorithm.chinese_name == chinese_name)
+        rows = (
+            db.session.query(
+                ConvertedAlgorithm.name,
+                ConvertedAlgorithm.chinese_name,
+                ConvertedAlgorithm.repo,
+                ConvertedAlgorithm.theory_rendered,
+            )
+            .filter(db.or_(*conditions))
+            .all()
+        )
+
+        def _rank(row):
+            if row.name == name:
+                return 0
+            if row.name == chinese_name:
+                return 1
+            return 2
+
+        entry = None
+        if rows:
+            best = min(rows, key=_rank)
+            entry = {"repo": best.repo, "theory": best.theory_rendered}
+
+        with self._lock:
+            self._entries[cache_key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+
+# 全局转换数据存储实例
+converted_store = ConvertedStore()
+
+
+def get_algorithm_theory(algorithm) -> Optional[str]:
+    """
+    返回算法详情页使用的理论内容
+
+    优先使用转换数据中预渲染的理论；没有时回退到算法表中的 theory 字段。
+    """
+    conv = converted_store.lookup(algorithm.name, algorithm.chinese_name)
+    if conv and conv.get("theory"):
+        return conv["theory"]
+
+    repo_name = conv.get("repo") if conv else None
+    return theory_renderer.render(getattr(algorithm, "theory", None), repo=repo_name)
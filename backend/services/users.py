@@ -0,0 +1,70 @@
+"""
+用户资料服务模块
+批量加载紧凑的用户卡片（不含头像数据本身，只给出可缓存的头像地址），
+以及把数据库中以 data URL 保存的头像解码为图片响应
+"""
+
+import base64
+import binascii
+from typing import Any, Dict, Iterable, Optional, Tuple
+from urllib.parse import unquote_to_bytes
+
+from models import db, User
+
+
+def avatar_url(user_id: int, updated_at) -> str:
+    """头像地址，带资料更新时间作为版本号，可被浏览器长期缓存"""
+    version = int(updated_at.timestamp()) if updated_at else 0
+    return f"/api/users/{user_id}/avatar?v={version}"
+
+
+def load_user_cards(user_ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+    """
+    一次查询加载一组用户的紧凑卡片
+
+    只判断头像是否为空，不读取头像内容。
+
+    Returns:
+        用户 id 到 {"id", "username", "role", "avatar"} 的映射
+    """
+    ids = {user_id for user_id in user_ids if user_id is not None}
+    if not ids:
+        return {}
+    rows = db.session.query(
+        User.id,
+        User.username,
+        User.role,
+        User.updated_at,
+        User.avatar.isnot(None).label("has_avatar"),
+    ).filter(User.id.in_(ids))
+    return {
+        row.id: {
+            "id": row.id,
+            "username": row.username,
+            "role": row.role,
+            "avatar": avatar_url(row.id, row.updated_at) if row.has_avatar else None,
+        }
+        for row in rows
+    }
+
+
+def decode_avatar(value: Optional[str]) -> Optional[Tuple[str, bytes]]:
+    """
+    解码 data URL 形式的头像
+
+    Returns:
+        (mimetype, 图片数据)；不是有效的 data URL 时返回 None
+    """
+    if not value or not value.startswith("data:") or "," not in value:
+        return None
+    header, payload = value[5:].split(",", 1)
+    params = header.split(";")
+    mimetype = params[0] or "text/plain"
+    if not mimetype.startswith("image/"):
+        return None
+    try:
+        if "base64" in params[1:]:
+            return mimetype, base64.b64decode(payload)
+        return mimetype, unquote_to_bytes(payload)
+    except (binascii.Error, ValueError):
+        return None
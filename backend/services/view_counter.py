@@ -0,0 +1,115 @@
+"""
+帖子浏览量缓冲服务模块
+在进程内聚合浏览量增量，由后台线程定期批量写回数据库，读路径不再产生写事务
+"""
+
+import atexit
+import logging
+import os
+import threading
+from typing import Dict
+
+from models import db
+
+logger = logging.getLogger(__name__)
+
+
+class ViewCounterBuffer:
+    """浏览量写回缓冲（write-behind）"""
+
+    def __init__(self, flush_interval: float = 5.0):
+        """
+        初始化缓冲区
+
+        Args:
+            flush_interval: 后台批量写回的间隔（秒）
+        """
+        self.flush_interval = flush_interval
+        self._pending: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        # 串行化写回，避免定时线程与退出时的写回交错
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._app = None
+
+    def init_app(self, app):
+        """绑定 Flask 应用并启动后台写回线程"""
+        self._app = app
+        self.flush_interval = float(
+            os.getenv("VIEW_COUNT_FLUSH_INTERVAL", self.flush_interval)
+        )
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="view-counter-flush", daemon=True
+            )
+            self._thread.start()
+            # 正常退出时写回剩余增量，保证不丢失
+            atexit.register(self.shutdown)
+
+    def increment(self, post_id: int, n: int = 1):
+        """记录一次（或 n 次）浏览"""
+        with self._lock:
+            self._pending[post_id] = self._pending.get(post_id, 0) + n
+
+    def pending(self, post_id: int) -> int:
+        """返回尚未写回数据库的浏览量增量"""
+        with self._lock:
+            return self._pending.get(post_id, 0)
+
+    def flush(self) -> int:
+        """
+        将缓冲的增量批量写回数据库
+
+        Returns:
+            本次写回的帖子数量
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+
+            params = [{"post_id": pid, "n": n} for pid, n in batch.items()]
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(
+                        db.text(
+                            "UPDATE posts SET view_count = "
+                            "COALESCE(view_count, 0) + :n WHERE id = :post_id"
+                        ),
+                        params,
+                    )
+            except Exception as e:
+                # 写回失败时把增量放回缓冲区，下次重试
+                logger.error(f"Failed to flush view counts: {e}")
+                with self._lock:
+                    for pid, n in batch.items():
+                        self._pending[pid] = self._pending.get(pid, 0) + n
+                return 0
+            return len(batch)
+
+    def _flush_with_context(self):
+        if self._app is None:
+            return self.flush()
+        with self._app.app_context():
+            return self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self._flush_with_context()
+            except Exception as e:
+                logger.error(f"View counter flush loop error: {e}")
+
+    def shutdown(self):
+        """停止后台线程并写回剩余增量"""
+        self._stop.set()
+        try:
+            self._flush_with_context()
+        except Exception as e:
+            logger.error(f"Final view counter flush failed: {e}")
+
+
+# 全局浏览量缓冲实例
+view_counter = ViewCounterBuffer()
@@ -35,9 +35,12 @@ export HOST=${HOST:-"0.0.0.0"}
 
 # Number of workers (recommended: 2 * CPU cores + 1)
 WORKERS=${WORKERS:-3}
+# Threads per worker (chat push streams hold a thread while connected)
+export THREADS=${THREADS:-16}
 
 echo "Starting ML Learner Flask application in production mode..."
 echo "Workers: $WORKERS"
+echo "Threads: $THREADS"
 echo "Host: $HOST"
 echo "Port: $PORT"
 echo "Database: $DATABASE_NAME@$DATABASE_HOST:$DATABASE_PORT"
@@ -46,7 +49,8 @@ echo "Database: $DATABASE_NAME@$DATABASE_HOST:$DATABASE_PORT"
 exec gunicorn \
     --bind "$HOST:$PORT" \
     --workers $WORKERS \
-    --worker-class sync \
+    --worker-class gthread \
+    --threads $THREADS \
     --worker-timeout 30 \
     --keep-alive 2 \
     --max-requests 1000 \